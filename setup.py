@@ -75,6 +75,7 @@ setup(
         # eg:
         #   'rst': ['docutils>=0.11'],
         #   ':python_version=="2.6"': ['argparse'],
+        'bundle': ['pyarrow'],
     },
     entry_points={
         'console_scripts': [
@@ -0,0 +1,168 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from vertica_python.vertica.cursor import Cursor
+
+from dbdiff.vertica import CursorPool
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_HISTORY = Path('.dbdiff_batch_history.json')
+# weight of the newest run in the expected duration of a job:
+HISTORY_SMOOTHING = 0.5
+
+
+def get_job(job: dict, defaults: Optional[dict] = None) -> dict:
+    '''Check one job of a manifest (see read_manifest()) and fill in its defaults.'''
+    missing = {'schema', 'x_table', 'y_table', 'join_cols'} - set(job.keys())
+    if missing:
+        raise RuntimeError('Batch job is missing {0}: {1}'.format(', '.join(sorted(missing)), job))
+    join_cols = job['join_cols']
+    if isinstance(join_cols, str):
+        join_cols = join_cols.split(',')
+    return {
+        'schema': job['schema'],
+        'x_table': job['x_table'],
+        'y_table': job['y_table'],
+        'join_cols': [col.lower() for col in join_cols],
+        'options': {**({} if defaults is None else defaults), **job.get('options', {})},
+        'priority': job.get('priority', 0)
+    }
+
+
+def read_manifest(path: Path) -> List[dict]:
+    '''Read a batch manifest.
+
+    The manifest is a JSON file with either a list of jobs,
+    or an object with a list under "jobs" and an optional "defaults"
+    object that is merged under each job's "options".
+    Each job has the keys:
+
+    - schema, x_table, y_table: as for the diff command.
+    - join_cols: comma separated string or list of column names.
+    - options (optional): any other diff options, by their python name,
+      e.g. {"y_schema": "other", "hierarchical_join": true, "output_format": "XLSX"}.
+    - priority (optional): higher priority jobs are started first, default 0.
+    '''
+    manifest = json.loads(Path(path).read_text())
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    defaults = manifest.get('defaults', {})
+    return [get_job(job, defaults) for job in manifest['jobs']]
+
+
+def get_job_key(job: dict) -> str:
+    '''Stable name for a job, used to look up its run history.'''
+    y_schema = job['options'].get('y_schema') or job['schema']
+    return '{0}.{1}|{2}.{3}'.format(job['schema'], job['x_table'], y_schema, job['y_table']).lower()
+
+
+def get_output_keys(job: dict) -> List[str]:
+    '''The tables and reports a job writes, sorted: the [table]_dedup and _dup tables of both sides, in the schema of the table,
+    the [x_table]_JOINED (and _JOINED_1, ...) and _DIFF tables, in the output schema, and the reports, named after the x table.
+    The jobs that share any of them (e.g. the same y table, or x and y swapped) must not run at the same time.'''
+    options = job['options']
+    y_schema = options.get('y_schema') or job['schema']
+    output_schema = options.get('output_schema') or job['schema']
+    keys = {'report:' + job['x_table']}
+    for schema, table in ((job['schema'], job['x_table']), (y_schema, job['y_table'])):
+        keys |= {'{0}.{1}_dedup'.format(schema, table), '{0}.{1}_dup'.format(schema, table)}
+    keys |= {'{0}.{1}_joined'.format(output_schema, job['x_table']), '{0}.{1}_diff'.format(output_schema, job['x_table'])}
+    return sorted(key.lower() for key in keys)
+
+
+class OutputLocks:
+    '''A lock for each output key (see get_output_keys()), all of a job's held while it runs,
+    so that the jobs that write the same tables and reports run one after the other.'''
+
+    def __init__(self):
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, job: dict) -> Iterator[None]:
+        '''Hold the locks of all of the output keys of `job`, taken in their sorted order,
+        so that two jobs waiting for each other's keys can't each hold some of them.'''
+        with self._lock:
+            locks = [self._locks.setdefault(key, threading.Lock()) for key in get_output_keys(job)]
+        with ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            yield
+
+
+def read_history(path: Path) -> Dict[str, dict]:
+    if not Path(path).exists():
+        return {}
+    return json.loads(Path(path).read_text())
+
+
+def update_history(history: Dict[str, dict], results: List[dict]) -> Dict[str, dict]:
+    '''Fold the durations of successful runs into the expected duration of each job.'''
+    for result in results:
+        if result['status'] != 'ok':
+            continue
+        previous = history.get(result['key'])
+        if previous is None:
+            history[result['key']] = {'duration': result['duration'], 'runs': 1}
+        else:
+            history[result['key']] = {
+                'duration': (HISTORY_SMOOTHING * result['duration']) + ((1 - HISTORY_SMOOTHING) * previous['duration']),
+                'runs': previous['runs'] + 1
+            }
+    return history
+
+
+def order_jobs(jobs: List[dict], history: Dict[str, dict]) -> List[dict]:
+    '''Order the jobs by priority, then longest expected duration first.
+
+    Starting the long jobs first keeps one slow pair from running alone at the end.
+    Jobs that have never run are expected to take the average of the known jobs.
+    '''
+    known = [info['duration'] for info in history.values()]
+    default_duration = (sum(known) / len(known)) if known else 0.0
+    for job in jobs:
+        job['expected_duration'] = history.get(get_job_key(job), {}).get('duration', default_duration)
+    return sorted(jobs, key=lambda job: (-job['priority'], -job['expected_duration']))
+
+
+def run_batch(jobs: List[dict],
+              run_job: Callable[[Cursor, dict], Dict[str, Any]],
+              pool: CursorPool,
+              concurrency: int,
+              history: Optional[Dict[str, dict]] = None) -> List[dict]:
+    '''Run `run_job(cur, job)` for each job, at most `concurrency` at a time, each on a pooled cursor.
+
+    A failing job is logged and recorded, it doesn't stop the others.
+    The jobs that write the same output tables (see get_output_keys()) wait for each other, before taking a cursor.
+    Returns one result per job (in the order they were started) with the keys
+    key, status ('ok' or 'error'), duration, and either the dict returned
+    by `run_job` under 'result' or the error message under 'error'.
+    '''
+    ordered = order_jobs(jobs, {} if history is None else history)
+    locks = OutputLocks()
+
+    def run_one(job: dict) -> dict:
+        key = get_job_key(job)
+        with locks.hold(job):
+            LOGGER.info('Starting batch job ' + key + ' (expected {0:.0f}s).'.format(job['expected_duration']))
+            start = time.monotonic()
+            try:
+                with pool.acquire(discard=job['options'].get('case_insensitive', False)) as cur:
+                    result = run_job(cur, job)
+            except Exception as e:
+                LOGGER.exception('Batch job ' + key + ' failed.')
+                return {'key': key, 'status': 'error', 'duration': time.monotonic() - start, 'error': str(e)}
+        duration = time.monotonic() - start
+        LOGGER.info('Finished batch job ' + key + ' in {0:.0f}s.'.format(duration))
+        return {'key': key, 'status': 'ok', 'duration': duration, 'result': result}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # the executor starts the jobs in the order they were submitted:
+        futures = [executor.submit(run_one, job) for job in ordered]
+        return [future.result() for future in futures]
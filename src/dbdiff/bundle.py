@@ -0,0 +1,102 @@
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Mapping
+
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+MANIFEST_NAME = 'manifest.json'
+FRAME_DIR_NAME = 'frames'
+BUNDLE_VERSION = 1
+
+
+def check_pyarrow() -> None:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise RuntimeError('Result bundles need pyarrow, install it with: pip install dbdiff[bundle]')
+
+
+def json_default(value: Any) -> Any:
+    # numpy scalars (e.g. the counts from pandas) as python ones:
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def to_feather(df: pd.DataFrame, path: Path) -> None:
+    '''df.to_feather(path), with its object columns of mixed types (e.g. ints and strings in one sample column),
+    which Arrow can't type, as strings.'''
+    import pyarrow
+    try:
+        df.to_feather(path)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        columns = [column for column in df.columns if df[column].dtype == object]
+        LOGGER.debug('Saving the object columns of {0} as strings: {1}'.format(path, ', '.join(map(str, columns))))
+        df = df.copy()
+        for column in columns:
+            df[column] = df[column].where(df[column].isnull(), df[column].astype(str))
+        df.to_feather(path)
+
+
+def save_bundle(all_info: dict, output_dir: Path, name: str) -> Path:
+    '''Write all of `all_info` (the info of a diff, see cli.main), samples included, to `output_dir`.
+
+    Each DataFrame goes to its own Arrow IPC (Feather v2) file under frames/,
+    which can be memory mapped (e.g. pyarrow.ipc.open_file(pyarrow.memory_map(path))).
+    Everything else goes in manifest.json, with {"frame": "frames/00001.arrow"}
+    in place of each DataFrame. `name` is kept for the file names of reports re-rendered from it.
+    The object columns of a DataFrame with mixed types are saved as strings (see to_feather()).
+    Returns the path of the manifest.
+    '''
+    check_pyarrow()
+    frame_dir = output_dir / FRAME_DIR_NAME
+    frame_dir.mkdir(parents=True, exist_ok=True)
+    frame_count = 0
+
+    def pack(value: Any) -> Any:
+        nonlocal frame_count
+        if isinstance(value, pd.DataFrame):
+            frame_count += 1
+            frame_path = Path(FRAME_DIR_NAME, '{0:05d}.arrow'.format(frame_count))
+            packed: Dict[str, Any] = {'frame': frame_path.as_posix()}
+            # Arrow files don't have an index, keep it as the first column unless it's the default:
+            if not isinstance(value.index, pd.RangeIndex):
+                packed['index_name'] = value.index.name
+                value = value.reset_index()
+                packed['index'] = value.columns[0]
+            to_feather(value, output_dir / frame_path)
+            return packed
+        # dicts, and a column_info kept on disk (see dbdiff.store.ColumnStore), read one column at a time:
+        if isinstance(value, Mapping):
+            return {'dict': {key: pack(v) for key, v in value.items()}}
+        return {'value': value}
+
+    manifest = {'version': BUNDLE_VERSION, 'name': name, 'all_info': pack(all_info)}
+    path = output_dir / MANIFEST_NAME
+    path.write_text(json.dumps(manifest, indent=1, default=json_default))
+    LOGGER.info('Wrote {0} frame(s) to the bundle in {1}.'.format(frame_count, output_dir))
+    return path
+
+
+def load_bundle(output_dir: Path) -> Dict[str, Any]:
+    '''Read a bundle written by save_bundle().
+    Returns the `name` it was saved with and the `all_info`, as it was saved.'''
+    check_pyarrow()
+    manifest = json.loads((output_dir / MANIFEST_NAME).read_text())
+    if manifest['version'] > BUNDLE_VERSION:
+        raise RuntimeError('Bundle version {0} is newer than this version of dbdiff can read ({1}).'.format(manifest['version'], BUNDLE_VERSION))
+
+    def unpack(packed: dict) -> Any:
+        if 'frame' in packed:
+            df = pd.read_feather(output_dir / packed['frame'])
+            if 'index' in packed:
+                df = df.set_index(packed['index'])
+                df.index.name = packed['index_name']
+            return df
+        if 'dict' in packed:
+            return {key: unpack(v) for key, v in packed['dict'].items()}
+        return packed['value']
+
+    return {'name': manifest['name'], 'all_info': unpack(manifest['all_info'])}
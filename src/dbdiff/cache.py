@@ -0,0 +1,91 @@
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Optional
+
+from vertica_python.vertica.cursor import Cursor
+
+from dbdiff import __version__
+from dbdiff.incremental import get_fingerprints, get_options_key
+from dbdiff.store import keep_columns
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_CACHE_DIR = Path('.dbdiff_cache')
+DEFAULT_CACHE_MAX_MB = 512
+
+
+class RunCache:
+    '''Results of whole diffs (the all_info of cli.main), stored as pickles in `cache_dir`.
+
+    An entry is keyed on the diff options and on the row count and aggregate hash
+    of both tables (see get_run_key), so it is only found while neither table changed.
+    When the entries take more than `max_mb` MB, the least recently used are removed.
+    A column_info kept on disk (see dbdiff.store.ColumnStore) is copied next to the entry, rather than into it.
+    '''
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_mb: float = DEFAULT_CACHE_MAX_MB):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def get_path(self, key: str) -> Path:
+        return self.cache_dir / (key + '.pkl')
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self.get_path(key)
+        if not path.exists():
+            return None
+        with path.open('rb') as f:
+            all_info = pickle.load(f)
+        # the modification time is the last use, for the LRU eviction:
+        os.utime(path)
+        return all_info
+
+    def put(self, key: str, all_info: dict) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.get_path(key)
+        tmp_path = path.with_suffix('.tmp')
+        if 'column_info' in all_info:
+            all_info = {**all_info, 'column_info': keep_columns(all_info['column_info'], path.with_suffix('.sqlite'))}
+        with tmp_path.open('wb') as f:
+            pickle.dump(all_info, f)
+        tmp_path.replace(path)
+        self.evict(keep=path)
+
+    def get_size(self, path: Path) -> int:
+        '''The size of an entry, with the copy of its columns if any.'''
+        columns_path = path.with_suffix('.sqlite')
+        return path.stat().st_size + (columns_path.stat().st_size if columns_path.exists() else 0)
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        '''Remove the least recently used entries until they fit in max_bytes.
+        `keep` (the newest entry) is never removed.'''
+        entries = sorted(self.cache_dir.glob('*.pkl'), key=lambda p: p.stat().st_mtime)
+        total = sum(self.get_size(p) for p in entries)
+        for path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            total -= self.get_size(path)
+            LOGGER.info('Evicting cached diff ' + path.stem + '.')
+            path.unlink()
+            if path.with_suffix('.sqlite').exists():
+                path.with_suffix('.sqlite').unlink()
+
+
+def get_run_key(cur: Cursor,
+                x_schema: str, x_table: str,
+                y_schema: str, y_table: str,
+                join_cols: list,
+                options: dict) -> str:
+    '''Content address of a diff: the dbdiff version, the tables and options,
+    and the row count and aggregate hash of the rows of both tables.'''
+    LOGGER.info('Getting table fingerprints for the run cache.')
+    return get_options_key({
+        'version': __version__,
+        'x': [x_schema, x_table, get_fingerprints(cur, x_schema, x_table)],
+        'y': [y_schema, y_table, get_fingerprints(cur, y_schema, y_table)],
+        'join_cols': join_cols,
+        'options': options,
+    })
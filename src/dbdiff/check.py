@@ -0,0 +1,61 @@
+import logging
+from typing import Any, Dict, Optional
+
+from vertica_python.vertica.cursor import Cursor
+
+from dbdiff.incremental import get_fingerprints
+from dbdiff.stages import Stage, run_stages
+from dbdiff.vertica import CursorPool, get_column_info_lookup
+
+LOGGER = logging.getLogger(__name__)
+
+
+def check_identical(cur: Cursor,
+                    x_schema: str, x_table: str,
+                    y_schema: str, y_table: str,
+                    join_cols: list,
+                    exclude_columns: Optional[set] = None,
+                    pool: Optional[CursorPool] = None) -> Dict[str, Any]:
+    '''Are the two tables identical? Without building any tables.
+
+    Each table is scanned once for its row count, an order independent hash
+    of the full rows (all columns, less `exclude_columns`), and one of the join keys.
+    With a pool, the two scans run at the same time.
+    Columns in only one of the tables make them different (without scanning).
+    The values are hashed as stored, so the same values in different dtypes
+    (e.g. int and numeric) count as different.
+
+    Returns whether they are identical, the reason if not,
+    and the fingerprint of each side (if they were scanned).
+    '''
+    if exclude_columns is None:
+        exclude_columns = set()
+    x_columns = set(get_column_info_lookup(cur, x_schema, x_table).keys()) - exclude_columns
+    y_columns = set(get_column_info_lookup(cur, y_schema, y_table).keys()) - exclude_columns
+    if x_columns != y_columns:
+        return {
+            'identical': False,
+            'reason': 'The tables have different columns, only in x: {0}, only in y: {1}.'.format(
+                ', '.join(sorted(x_columns - y_columns)) or 'none',
+                ', '.join(sorted(y_columns - x_columns)) or 'none'
+            )
+        }
+
+    def fingerprint(schema: str, table: str):
+        def run(cur: Cursor, results: dict) -> dict:
+            return get_fingerprints(cur, schema, table, columns=sorted(x_columns), key_cols=join_cols)['']
+        return run
+
+    results, timings = run_stages([
+        Stage('x', fingerprint(x_schema, x_table)),
+        Stage('y', fingerprint(y_schema, y_table)),
+    ], cur, pool=pool)
+    check_info: Dict[str, Any] = {'identical': True, 'reason': 'The tables are identical.', 'x': results['x'], 'y': results['y']}
+    for key, reason in (('row_count', 'The tables have a different # of rows.'),
+                        ('key_hash', 'The tables have different join keys.'),
+                        ('row_hash', 'The tables have different rows.')):
+        if results['x'][key] != results['y'][key]:
+            check_info.update(identical=False, reason=reason)
+            break
+    LOGGER.info(check_info['reason'])
+    return check_info
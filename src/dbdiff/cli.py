@@ -1,8 +1,11 @@
 import json
 import logging
 import logging.config
+import math
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Any
+from typing import (Any, Callable, ContextManager, Dict, List, MutableMapping,
+                    Optional, Set, Tuple)
 
 import click
 import pandas as pd
@@ -10,19 +13,44 @@ from jinja2 import Environment, PackageLoader
 from vertica_python.vertica.cursor import Cursor
 
 from dbdiff import __version__
-from dbdiff.main import (check_primary_key, create_diff_table,
+from dbdiff.batch import (DEFAULT_HISTORY, read_history, read_manifest,
+                          run_batch, update_history)
+from dbdiff.bundle import load_bundle, save_bundle
+from dbdiff.cache import DEFAULT_CACHE_MAX_MB, RunCache, get_run_key
+from dbdiff.check import check_identical
+from dbdiff.explore import DEFAULT_CACHE_COLUMNS, DiffExplorer, ExploreServer
+from dbdiff.incremental import DEFAULT_STATE_DIR, diff_incremental
+from dbdiff.main import (DEFAULT_SAMPLE, SAMPLE_METHODS, create_diff_table,
                          create_joined_table, get_all_col_info,
                          get_column_diffs, get_column_diffs_from_joined,
-                         get_diff_columns, get_diff_rows,
-                         get_diff_rows_from_joined, get_unmatched_rows,
+                         get_column_profile, get_diff_columns, get_diff_rows,
+                         get_diff_rows_from_joined, get_dup_stats,
+                         get_hash_keys, get_identical_columns,
+                         get_joined_shards, get_primary_key_info,
+                         get_profile_drift, get_unmatched_rows,
                          get_unmatched_rows_straight, insert_diff_table,
                          select_distinct_rows)
-from dbdiff.report import excel_report, html_report
-from dbdiff.vertica import get_cur
+from dbdiff.planner import plan_diff
+from dbdiff.report import (ShardWriter, get_comparison_matrix,
+                           html_matrix_report, html_report,
+                           html_report_sharded, html_schema_report,
+                           iter_excel_report)
+from dbdiff.schema import (fill_catalog_cache, get_schema_columns,
+                           get_schema_jobs)
+from dbdiff.serve import DiffServer, DiffService
+from dbdiff.stages import (Stage, StagesInterrupted, get_scoped_results,
+                           run_stages, scope_stages)
+from dbdiff.store import ColumnStore, close_columns, get_column_counts
+from dbdiff.telemetry import StageTelemetry
+from dbdiff.vertica import (CatalogCache, CursorPool, get_column_info_lookup,
+                            get_cur, get_table_exists,
+                            implicit_dtype_comparison, use_catalog_cache)
 
 JINJA_ENV = Environment(loader=PackageLoader('dbdiff', 'templates'))
 DEFAULT_LOGGING_CONFIG = Path(__file__).with_name('logging.json')
 LOGGER = logging.getLogger(__name__)
+# the exit code of --check when the tables are not identical (1 is an error, and 2 a usage error, as click exits with):
+CHECK_DIFFERENT_EXIT_CODE = 3
 
 
 def initialize_logging(config: Path) -> None:
@@ -41,6 +69,18 @@ def df_to_dict(x: Any) -> Any:
         return x
 
 
+def nan_to_none(x: Any) -> Any:
+    '''JSON has no NaN, so the missing floats of a summary (e.g. from its dataframes) become None, written as null.'''
+    if isinstance(x, float) and math.isnan(x):
+        return None
+    elif isinstance(x, dict):
+        return {k: nan_to_none(v) for k, v in x.items()}
+    elif isinstance(x, (list, tuple)):
+        return [nan_to_none(v) for v in x]
+    else:
+        return x
+
+
 def get_summary_from_all_info(d: dict) -> dict:
     return {
         'x_schema': d['x_schema'],
@@ -56,11 +96,152 @@ def get_summary_from_all_info(d: dict) -> dict:
         'missing_join_info': {side: {k: df_to_dict(v) for k, v in info.items()} for side, info in d['missing_join_info'].items()},
         # just the counts from the diff summary:
         'diff_summary': d['diff_summary'],
-        'hierarchical_join_info': {col: {side: {k: df_to_dict(v) for k, v in info.items()} for side, info in col_info.items()} for col, col_info in d['hierarchical_join_info'].items()}
+        'hierarchical_join_info': {col: {side: {k: df_to_dict(v) for k, v in info.items()} for side, info in col_info.items()} for col, col_info in d['hierarchical_join_info'].items()},
+        'stage_timings': d.get('stage_timings', {}),
+        'stage_telemetry': d.get('stage_telemetry', {}),
+        'column_profile': df_to_dict(d.get('column_profile')),
+        'plan': d.get('plan')
+    }
+
+
+def get_headline_from_all_info(d: dict) -> Dict[str, Any]:
+    '''Just the top line counts of a diff, e.g. for a batch summary.'''
+    return {
+        'x_table': d['x_table'],
+        'y_table': d['y_table'],
+        'total_row_count': d['total_row_count'],
+        'x_only_row_count': d['missing_join_info']['x']['count'],
+        'y_only_row_count': d['missing_join_info']['y']['count'],
+        'diff_row_count': d['diff_summary'].get('count'),
+        'diff_cell_count': d['diff_summary']['total_count'],
+        'diff_column_count': len(d['column_info']),
     }
 
 
-@click.command()
+def write_json_summary(all_info: dict, x_table: str) -> Path:
+    # get the parts of the info that aren't dataframes
+    summary_info = get_summary_from_all_info(all_info)
+    path = Path(f'{x_table}_diff_summary.json')
+    path.write_text(json.dumps(nan_to_none(summary_info), indent=4, default=str))
+    return path
+
+
+def get_query_columns(cur: Cursor, table: str, query: str) -> Dict[str, str]:
+    '''The columns and dtypes of the result of `query`, from the catalog entry
+    of an empty local temp table of it (so without running the query).'''
+    probe_table = table + '_probe'
+    cur.execute(JINJA_ENV.get_template('table_drop.sql').render(schema_name='v_temp_schema', table_name=probe_table))
+    q_probe = JINJA_ENV.get_template('create_temp_table.sql').render(table_name=probe_table, query='SELECT * FROM (' + query + ') q LIMIT 0')
+    LOGGER.info(q_probe)
+    cur.execute(q_probe)
+    columns = get_column_info_lookup(cur, 'v_temp_schema', probe_table)
+    cur.execute(JINJA_ENV.get_template('table_drop.sql').render(schema_name='v_temp_schema', table_name=probe_table))
+    return columns
+
+
+def create_temp_tables_from_queries(cur: Cursor,
+                                    x_schema: str, x_table: str, x_table_query: bool,
+                                    y_schema: str, y_table: str, y_table_query: bool,
+                                    join_cols: list,
+                                    exclude_columns: Optional[set] = None,
+                                    keep_columns: Optional[list] = None,
+                                    prune: bool = True,
+                                    lazy: bool = False) -> Tuple[Tuple[str, str], Tuple[str, str], Set[str]]:
+    '''Instantiate the query stored in the file X_TABLE (if x_table_query) and/or Y_TABLE (if y_table_query)
+    into a local temp table named after the file. Returns the (schema, table) to diff for each side,
+    and the columns of the queries that were pruned (see below).
+
+    The columns of each query are read first (see get_query_columns()).
+    With `prune`, only the join columns, `keep_columns`, and the columns that will be compared
+    (in both x and y, not excluded, and of comparable dtypes) are computed,
+    the others are kept as NULLs of their dtype, so they still show in the report.
+    With `lazy`, the queries become local temp views instead, which are run again by each step of the diff:
+    for queries that are cheaper to recompute than to store.
+    '''
+    if exclude_columns is None:
+        exclude_columns = set()
+    # the query (None for a table), name and columns of each side:
+    sides: Dict[str, Dict[str, Any]] = {}
+    for side, schema, table, is_query in (('x', x_schema, x_table, x_table_query), ('y', y_schema, y_table, y_table_query)):
+        if is_query:
+            with open(table, 'r') as f:
+                query = f.read()
+            name = Path(table).stem
+            sides[side] = {'query': query, 'name': name, 'columns': get_query_columns(cur, name, query)}
+        else:
+            sides[side] = {'query': None, 'name': table, 'columns': get_column_info_lookup(cur, schema, table)}
+
+    x_columns, y_columns = sides['x']['columns'], sides['y']['columns']
+    compared = {
+        col for col in x_columns
+        if (col in y_columns) and (col not in exclude_columns) and
+        (implicit_dtype_comparison(x_columns[col], y_columns[col]) or implicit_dtype_comparison(y_columns[col], x_columns[col]))
+    }
+    keep = set(join_cols) | set(keep_columns or []) | compared
+    pruned: Set[str] = set()
+
+    for side, info in sides.items():
+        if info['query'] is None:
+            continue
+        columns = [(col, dtype, (not prune) or (col in keep)) for col, dtype in info['columns'].items()]
+        pruned |= {col for col, dtype, kept in columns if not kept}
+        if prune:
+            LOGGER.info('Computing {0} of the {1} columns of the {2} query, the others are not compared.'.format(
+                sum(keep for col, dtype, keep in columns), len(columns), side))
+        q = JINJA_ENV.get_template('query_projection.sql').render(columns=columns, query=info['query'])
+        # a pooled session may still have this temp table (or view) from an earlier diff:
+        drop_template = 'table_drop.sql' if get_table_exists(cur, 'v_temp_schema', info['name']) else 'view_drop.sql'
+        cur.execute(JINJA_ENV.get_template(drop_template).render(schema_name='v_temp_schema', table_name=info['name']))
+        q_create = JINJA_ENV.get_template('create_temp_view.sql' if lazy else 'create_temp_table.sql').render(table_name=info['name'], query=q)
+        LOGGER.info(q_create)
+        cur.execute(q_create)
+
+    return (
+        (x_schema, x_table) if sides['x']['query'] is None else ('v_temp_schema', sides['x']['name']),
+        (y_schema, y_table) if sides['y']['query'] is None else ('v_temp_schema', sides['y']['name']),
+        pruned
+    )
+
+
+def write_report(all_info: dict, output_format: str, x_table: str) -> Path:
+    '''Write the report for `all_info` in `output_format`, named after `x_table`.
+    Returns the path written.'''
+    output_format = output_format.upper()
+    if output_format == 'HTML':
+        report = html_report(**all_info)
+        path = Path(x_table + '_report.html')
+        with path.open('w') as f:
+            f.write(report)
+    elif output_format == 'HTML-SHARDED':
+        path = html_report_sharded(Path(x_table + '_report'), **all_info)
+    elif output_format == 'XLSX':
+        reports = iter_excel_report(**all_info)
+        path = Path(x_table + '_report.xlsx')
+        writer = pd.ExcelWriter(path, engine='xlsxwriter')
+        for sheet_name, df in reports:
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+        writer.save()
+    return path
+
+
+class DefaultCommandGroup(click.Group):
+    '''A group that runs the `diff` command when the first argument is not
+    one of its commands, so `dbdiff SCHEMA X_TABLE Y_TABLE JOIN_COLS` keeps working.'''
+
+    def parse_args(self, ctx, args):
+        if args and (args[0] not in self.commands) and (args[0] not in ctx.help_option_names + ['--version']):
+            args.insert(0, 'diff')
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup)
+@click.version_option(__version__)
+def cli():
+    """Compare tables on Vertica.
+    Without a command, runs `diff`: see `dbdiff diff --help`."""
+
+
+@cli.command('diff')
 @click.argument('schema')
 @click.argument('x_table')
 @click.argument('y_table')
@@ -70,11 +251,12 @@ def get_summary_from_all_info(d: dict) -> dict:
 @click.option('--drop-output-tables', is_flag=True, help='Drop the joined and diff tables created and used here.')
 @click.option('--x-table-query', is_flag=True, help="If X_TABLE is not a table in Vertica, but rather a query stored in a file, add this flag and the query will be read and instantiated into a temporary table. Ex: 'temp_xtable_name_to_use.sql'.")
 @click.option('--y-table-query', is_flag=True, help='If Y_TABLE is not a table in Vertica, but rather a query stored in a file, add this flag and the query will be read and instantiated into a temporary table.')
+@click.option('--lazy-table-query', is_flag=True, help='With --x-table-query/--y-table-query, make the queries local temp views rather than tables, for queries that are cheaper to run again for each step than to store.')
 @click.option('--exclude-columns', default="", help='Comma separated string of column names to exclude.')
 @click.option('--hierarchical-join', is_flag=True, help='If multiple join keys, and join key #2 is a subset of join key #1. We expect matches for all of #1 from both tables even if we dont match on #1 and #2. This way, we can have more nuanced output by first breaking out missing on the first key.')
 @click.option('--max-rows-all', default=10, help='Limit of full rows to pull that have differences.', show_default=True)
 @click.option('--max-rows-column', default=10, help='Limit of grouped and raw column level differences to pull.', show_default=True)
-@click.option('--output-format', type=click.Choice(['HTML', 'XLSX'], case_sensitive=False), default="HTML")
+@click.option('--output-format', type=click.Choice(['HTML', 'HTML-SHARDED', 'XLSX'], case_sensitive=False), default="HTML", help='HTML-SHARDED writes a directory with a small index page that loads each column on demand, for very wide diffs.')
 @click.option('--save-column-summary', is_flag=True, help='Save the column dtype and match summary.')
 @click.option('--save-column-summary-format', type=click.Choice(['CSV', 'PICKLE'], case_sensitive=False), default="CSV")
 @click.option('--skip-row-total', is_flag=True, help='Skip counting the total # of rows with differences, only use cell differences.')
@@ -82,15 +264,43 @@ def get_summary_from_all_info(d: dict) -> dict:
 @click.option('--logging-config', type=Path, default=DEFAULT_LOGGING_CONFIG)
 @click.option('--case-insensitive', is_flag=True, help='If using this flag, all case sensitivity is turned off.')
 @click.option('--save-json-summary', is_flag=True, help='Save a .json file of the diff summary.')
-@click.version_option(__version__)
-def cli(schema: str, x_table: str, y_table: str,
-        join_cols: str, y_schema: str, output_schema: str, drop_output_tables: bool,
-        x_table_query: bool, y_table_query: bool, exclude_columns: str,
-        hierarchical_join: bool, max_rows_all: int, max_rows_column: int,
-        output_format: str, save_column_summary: bool,
-        save_column_summary_format: str, skip_row_total: bool,
-        use_diff_table: bool, logging_config: Path, case_insensitive: bool,
-        save_json_summary: bool):
+@click.option('--prune-identical-columns', is_flag=True, help='Before the join, checksum each column on both sides, and leave the columns that are identical out of the joined table and the column diffs.')
+@click.option('--joined-shard-width', default=0, help='Split the joined table into several, each with the join keys and at most this many of the compared columns, for very wide tables. 0 keeps one joined table.', show_default=True)
+@click.option('--plan', 'plan_strategy', is_flag=True, help='Estimate the size, width and share of differing rows of the diff (from the catalog and a sample of the keys), and choose --use-diff-table, --joined-shard-width, --prune-identical-columns, --skip-row-total, --sample and --partition-column from them. Those given by hand are kept.')
+@click.option('--check', is_flag=True, help='Only check whether the tables are identical (by row count and a hash of the rows and of the join keys), without building any tables. Exits with 0 if they are, 3 if not (1 is an error, 2 a usage error). Not supported with --case-insensitive.')
+@click.option('--diff-if-different', is_flag=True, help='With --check, run the full diff and write its report if the tables are not identical (still exiting with 3).')
+@click.option('--resource-pool', default=None, help='Run the queries of the diff in this Vertica resource pool.')
+@click.option('--runtime-cap', default=None, help="The longest any one query may run, e.g. '30 minutes' (the session's RUNTIMECAP).")
+@click.option('--memory-cap', default=None, help="The most memory the queries may use, e.g. '4G' (the session's MEMORYCAP).")
+@click.option('--stage-timeout', type=float, default=None, help='Cancel the diff if any one stage runs for longer than this many seconds. A partial report is written, as on Ctrl-C.')
+@click.option('--telemetry-interval', type=float, default=None, help="Every this many seconds, log the rows, memory and spills of the running statements from Vertica's monitoring tables (on a separate connection), with an ETA, and add each stage's peak memory and rows scanned to the JSON summary.")
+@click.option('--profile', is_flag=True, help='Also profile each column on both sides (null rate, min/max, distinct estimate, mean and top values) and show them side by side in the report, with the statistics that drifted.')
+@click.option('--profile-only', is_flag=True, help='Only profile the columns, as --profile, without joining the tables.')
+@click.option('--profile-top-values', default=5, help='Number of most frequent values to profile for each column, 0 to skip them (and their scan).', show_default=True)
+@click.option('--sample', type=click.Choice(SAMPLE_METHODS, case_sensitive=False), default=DEFAULT_SAMPLE, help="How the rows of the samples in the report are picked: 'first' takes the first found, without sorting, 'hash' the same ones every run (by the hash of the join keys), and 'ordered' those with the lowest join keys, which sorts all of the rows they're picked from.", show_default=True)
+@click.option('--fused-column-queries', is_flag=True, help='Get the count, samples and binned differences of each column with one query that reads its differences once, rather than one query for each.')
+@click.option('--skip-column-details', is_flag=True, help='Only count the differences of each column, without their samples: the report has their queries to run, or open its bundle (--save-bundle) with `dbdiff explore` to fetch them as each column is opened. Keeps the output tables, which the queries read.')
+@click.option('--hash-join-keys', is_flag=True, help='Join the tables on one 64-bit hash of the join keys (those of the same data type in both tables), comparing the keys themselves only on the rows whose hashes match, and sort and segment the joined table by it. For composite keys, especially of wide VARCHARs. Not with --case-insensitive.')
+@click.option('--spill-dir', type=Path, default=None, help='Write the samples of each column with differences to a SQLite file in this directory as soon as the column is done, and keep only the counts in memory, for diffs with very many differing columns.')
+@click.option('--save-bundle', 'save_result_bundle', is_flag=True, help='Save all of the results, samples included, to [X_TABLE]_bundle/ as Arrow files and a JSON manifest (needs pyarrow). See `dbdiff report`.')
+@click.option('--workers', default=1, help='Number of connections to use, to run independent stages of the diff at the same time.', show_default=True)
+@click.option('--partition-column', default=None, help='Diff incrementally: only rediff the partitions (values of this column) that changed on either side since the last run, and reuse the stored results of the others.')
+@click.option('--state-dir', type=Path, default=DEFAULT_STATE_DIR, help='Where the incremental diff (--partition-column) stores its state.', show_default=True)
+@click.option('--cache-dir', type=Path, default=None, help='Cache the results of whole diffs here, and reuse them while neither table (by row count and hash) nor the options changed.')
+@click.option('--cache-max-mb', default=DEFAULT_CACHE_MAX_MB, help='Size of the --cache-dir, the least recently used results are removed past it.', show_default=True)
+def diff(schema: str, x_table: str, y_table: str,
+         join_cols: str, y_schema: str, output_schema: str, drop_output_tables: bool,
+         x_table_query: bool, y_table_query: bool, lazy_table_query: bool, exclude_columns: str,
+         hierarchical_join: bool, max_rows_all: int, max_rows_column: int,
+         output_format: str, save_column_summary: bool,
+         save_column_summary_format: str, skip_row_total: bool,
+         use_diff_table: bool, logging_config: Path, case_insensitive: bool,
+         save_json_summary: bool, prune_identical_columns: bool,
+         joined_shard_width: int, plan_strategy: bool, check: bool, diff_if_different: bool,
+         resource_pool: str, runtime_cap: str,
+         memory_cap: str, stage_timeout: float, telemetry_interval: float,
+         profile: bool, profile_only: bool, profile_top_values: int, sample: str, fused_column_queries: bool, skip_column_details: bool, hash_join_keys: bool, spill_dir: Path, save_result_bundle: bool, workers: int, partition_column: str,
+         state_dir: Path, cache_dir: Path, cache_max_mb: int):
     """Compare two flat files X_TABLE and Y_TABLE, using Vertica as the join engine.
     Assume they are both in the same schema = SCHEMA.
     Join them on the columns in comma-separated string JOIN_COLS.
@@ -105,67 +315,133 @@ def cli(schema: str, x_table: str, y_table: str,
         y_schema = schema
     if output_schema is None:
         output_schema = schema
+    if check and case_insensitive:
+        # the check hashes the values as they are stored:
+        raise click.UsageError('--check does not support --case-insensitive.')
+    if hash_join_keys and case_insensitive:
+        raise click.UsageError('--hash-join-keys does not support --case-insensitive.')
     join_cols_list = list(map(lambda x: x.lower(), join_cols.split(',')))
     exclude_columns_set = set(map(lambda x: x.lower(), exclude_columns.split(',')))
     initialize_logging(logging_config)
 
-    with get_cur() as cur:
-        if x_table_query:
-            with open(x_table, 'r') as f:
-                q = f.read()
-            x_table = Path(x_table).stem
-            LOGGER.info('Creating temp table from query for x.')
-            q_create = JINJA_ENV.get_template('create_temp_table.sql').render(table_name=x_table, query=q)
-            LOGGER.info(q_create)
-            cur.execute(q_create)
-            schema = 'v_temp_schema'
-        if y_table_query:
-            with open(y_table, 'r') as f:
-                q = f.read()
-            y_table = Path(y_table).stem
-            LOGGER.info('Creating temp table from query for y.')
-            q_create = JINJA_ENV.get_template('create_temp_table.sql').render(table_name=y_table, query=q)
-            LOGGER.info(q_create)
-            cur.execute(q_create)
-            y_schema = 'v_temp_schema'
-
-        all_info = main(
-            cur=cur,
-            x_schema=schema,
-            x_table=x_table,
-            y_schema=y_schema,
-            y_table=y_table,
-            output_schema=output_schema,
-            join_cols=join_cols_list,
-            exclude_columns=exclude_columns_set,
-            max_rows_all=max_rows_all,
-            max_rows_column=max_rows_column,
-            drop_output_tables=drop_output_tables,
-            hierarchical_join=hierarchical_join,
-            save_column_summary=save_column_summary,
-            save_column_summary_format=save_column_summary_format,
-            skip_row_total=skip_row_total,
-            use_diff_table=use_diff_table,
-            case_insensitive=case_insensitive
-        )
+    limits = dict(resource_pool=resource_pool, runtime_cap=runtime_cap, memory_cap=memory_cap)
+    try:
+        with get_cur(**limits) as cur, (CursorPool(workers, session=limits) if workers > 1 else nullcontext()) as pool:
+            pruned_columns: Set[str] = set()
+            if x_table_query or y_table_query:
+                LOGGER.info('Creating temp table(s) from the query file(s).')
+                (schema, x_table), (y_schema, y_table), pruned_columns = create_temp_tables_from_queries(
+                    cur,
+                    schema, x_table, x_table_query,
+                    y_schema, y_table, y_table_query,
+                    join_cols=join_cols_list,
+                    exclude_columns=exclude_columns_set,
+                    keep_columns=([] if partition_column is None else [partition_column.lower()]),
+                    # the check hashes every column:
+                    prune=not check,
+                    lazy=lazy_table_query
+                )
 
-    if output_format == 'HTML':
-        report = html_report(**all_info)
-        with open(x_table + '_report.html', 'w') as f:
-            f.write(report)
-    elif output_format == 'XLSX':
-        reports = excel_report(**all_info)
-        writer = pd.ExcelWriter(x_table + '_report.xlsx', engine='xlsxwriter')
-        for sheet_name, df in reports:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-        writer.save()
+            if check:
+                check_pool_context: ContextManager[Optional[CursorPool]]
+                if 'v_temp_schema' in {schema, y_schema}:
+                    # only this session can see the temp tables:
+                    check_pool_context = nullcontext()
+                elif pool is not None:
+                    check_pool_context = nullcontext(pool)
+                else:
+                    check_pool_context = CursorPool(2, session=limits)
+                with check_pool_context as check_pool:
+                    check_info = check_identical(cur, schema, x_table, y_schema, y_table, join_cols_list, exclude_columns_set, check_pool)
+                click.echo(check_info['reason'])
+                if check_info['identical'] or (not diff_if_different):
+                    click.get_current_context().exit(0 if check_info['identical'] else CHECK_DIFFERENT_EXIT_CODE)
 
-    if save_json_summary:
-        # get the parts of the info that aren't dataframes
-        summary_info = get_summary_from_all_info(all_info)
-        Path(f'{x_table}_diff_summary.json').write_text(
-            json.dumps(summary_info, indent=4, default=str)
-        )
+            options = dict(
+                output_schema=output_schema,
+                exclude_columns=exclude_columns_set,
+                max_rows_all=max_rows_all,
+                max_rows_column=max_rows_column,
+                drop_output_tables=drop_output_tables,
+                hierarchical_join=hierarchical_join,
+                save_column_summary=save_column_summary,
+                save_column_summary_format=save_column_summary_format,
+                skip_row_total=skip_row_total,
+                use_diff_table=use_diff_table,
+                case_insensitive=case_insensitive,
+                prune_identical_columns=prune_identical_columns,
+                joined_shard_width=joined_shard_width,
+                stage_timeout=stage_timeout,
+                telemetry_interval=telemetry_interval,
+                spill_dir=spill_dir,
+                profile=profile,
+                profile_only=profile_only,
+                profile_top_values=profile_top_values,
+                pruned_columns=pruned_columns,
+                fused_column_queries=fused_column_queries,
+                skip_column_details=skip_column_details,
+                sample=sample.lower(),
+                hash_join_keys=hash_join_keys,
+                pool=pool
+            )
+            plan = None
+            if plan_strategy:
+                ctx = click.get_current_context()
+                given = {name: value for name, value in ctx.params.items() if ctx.get_parameter_source(name) != click.core.ParameterSource.DEFAULT}
+                plan = plan_diff(cur, schema, x_table, y_schema, y_table, join_cols_list, exclude_columns_set, given)
+                planned = {option: choice['value'] for option, choice in plan['choices'].items()}
+                partition_column = planned.pop('partition_column')
+                options.update(planned)
+            if partition_column is not None:
+                all_info = diff_incremental(
+                    cur=cur,
+                    run_diff=main,
+                    x_schema=schema,
+                    x_table=x_table,
+                    y_schema=y_schema,
+                    y_table=y_table,
+                    join_cols=join_cols_list,
+                    partition_col=partition_column.lower(),
+                    state_dir=state_dir,
+                    **options
+                )
+            else:
+                all_info = main(
+                    cur=cur,
+                    x_schema=schema,
+                    x_table=x_table,
+                    y_schema=y_schema,
+                    y_table=y_table,
+                    join_cols=join_cols_list,
+                    cache=(None if cache_dir is None else RunCache(cache_dir, cache_max_mb)),
+                    # the fragments of the columns as they are done:
+                    shard_dir=(Path(x_table + '_report') if output_format.upper() == 'HTML-SHARDED' else None),
+                    **options
+                )
+    except StagesInterrupted as e:
+        if e.all_info is None:
+            raise click.ClickException(str(e))
+        path = write_report(e.all_info, output_format, x_table)
+        close_columns(e.all_info['column_info'])
+        raise click.ClickException(str(e) + ' Wrote a partial report to ' + str(path) + '.')
+
+    if plan is not None:
+        all_info['plan'] = plan
+    try:
+        write_report(all_info, output_format, x_table)
+
+        if save_json_summary:
+            write_json_summary(all_info, x_table)
+
+        if save_result_bundle:
+            save_bundle(all_info, Path(x_table + '_bundle'), x_table)
+    finally:
+        # the end of the run, for a column_info kept on disk (--spill-dir):
+        close_columns(all_info['column_info'])
+
+    if check:
+        # the tables were not identical:
+        click.get_current_context().exit(CHECK_DIFFERENT_EXIT_CODE)
 
 
 def main(cur: Cursor,
@@ -173,190 +449,1008 @@ def main(cur: Cursor,
          y_schema: str, y_table: str,
          output_schema: str,
          join_cols: list,
-         exclude_columns: set,
-         max_rows_all: int,
-         max_rows_column: int,
-         drop_output_tables: bool,
-         hierarchical_join: bool,
-         save_column_summary: bool,
-         save_column_summary_format: str,
-         skip_row_total: bool,
-         use_diff_table: bool,
-         case_insensitive: bool):
+         exclude_columns: Optional[set] = None,
+         max_rows_all: int = 10,
+         max_rows_column: int = 10,
+         drop_output_tables: bool = False,
+         hierarchical_join: bool = False,
+         save_column_summary: bool = False,
+         save_column_summary_format: str = 'CSV',
+         skip_row_total: bool = False,
+         use_diff_table: bool = False,
+         case_insensitive: bool = False,
+         prune_identical_columns: bool = False,
+         joined_shard_width: int = 0,
+         stage_timeout: Optional[float] = None,
+         pool: Optional[CursorPool] = None,
+         cache: Optional[RunCache] = None,
+         progress: Optional[Callable[[dict], None]] = None,
+         telemetry_interval: Optional[float] = None,
+         spill_dir: Optional[Path] = None,
+         shard_dir: Optional[Path] = None,
+         profile: bool = False,
+         profile_only: bool = False,
+         profile_top_values: int = 5,
+         pruned_columns: Optional[set] = None,
+         fused_column_queries: bool = False,
+         skip_column_details: bool = False,
+         sample: str = DEFAULT_SAMPLE,
+         hash_join_keys: bool = False):
     '''Main method to be called by CLI.
-    A separate function from cli() so that it can be imported easily as well.'''
+    A separate function from cli() so that it can be imported easily as well.
+    The defaults match those of the CLI.
+
+    The diff is run as a set of stages (see get_stages()).
+    If given a pool, stages that don't depend on each other run at the same time,
+    each on its own pooled connection.
+    This isn't possible when the diff uses local temp tables (query inputs, or
+    --drop-output-tables with non-unique keys), which only exist in the session
+    of `cur`, so then all stages run on `cur`.
+
+    If given a cache, the tables are fingerprinted first, and the cached result
+    of the same diff of the same table contents is returned if there is one.
+
+    If a stage runs longer than `stage_timeout` seconds, or on Ctrl-C,
+    the running statements are cancelled, the tables of the diff are dropped,
+    and StagesInterrupted is raised, with the partial results under its all_info (if any).
+
+    progress(event), if given, is called as each stage starts and finishes (see run_stages()).
+
+    With `telemetry_interval`, the running statements are sampled from Vertica's monitoring tables
+    on a separate connection every that many seconds (see StageTelemetry), logged with their progress,
+    passed to `progress`, and summarized by stage under stage_telemetry.
+
+    With `spill_dir`, the info of each column with differences goes to a ColumnStore (a SQLite file) in it
+    as soon as the column is done, rather than staying in memory, and the reports read it back one column at a time.
+    With `shard_dir`, the fragment of each column of the sharded HTML report is written to it as soon as the column is done
+    (see report.ShardWriter), and html_report_sharded() on the same directory then only writes the rest.
+
+    With `profile`, the distribution of each column on each side is profiled (see get_column_profile()),
+    the two tables at the same time if given a pool, and compared under column_profile.
+    With `profile_only`, that's all, the tables aren't joined.
+    The `pruned_columns` of query inputs, which are only NULLs (see create_temp_tables_from_queries()), aren't profiled.
+
+    With `fused_column_queries`, the details of each column come from one query on the joined table
+    (see get_fused_column_info()), rather than from a count query and one more query for each output.
+    With `skip_column_details`, only the differences of each column are counted, and its queries are rendered
+    without being run (see main.get_column_details() and dbdiff.explore to run them later).
+
+    `sample` is how the rows of the samples are picked (see main.SAMPLE_METHODS): by default the first found,
+    without sorting the rows they are picked from.
+
+    With `hash_join_keys`, the tables are joined on the hash of their join keys first (see create_joined_table()),
+    which compares the keys as they are stored, so not with `case_insensitive`.'''
+    if exclude_columns is None:
+        exclude_columns = set()
+    if hash_join_keys and case_insensitive:
+        # equal keys of different case have different hashes:
+        raise RuntimeError('Joining on the hash of the keys (hash_join_keys) does not support comparing them without case (case_insensitive).')
+    if use_diff_table and joined_shard_width:
+        raise RuntimeError('Splitting the joined table (joined_shard_width) is not supported with the diff table (use_diff_table).')
+    if skip_column_details and drop_output_tables:
+        raise RuntimeError('The queries of the skipped column details (skip_column_details) read the output tables, they cannot be dropped (drop_output_tables).')
+
+    pool, prepare_cur = prepare_cursors(cur, pool, case_insensitive, drop_output_tables or ('v_temp_schema' in {x_schema, y_schema}))
+
+    if cache is not None:
+        cache_key = get_run_key(cur, x_schema, x_table, y_schema, y_table, join_cols, {
+            'output_schema': output_schema,
+            'exclude_columns': exclude_columns,
+            'max_rows_all': max_rows_all,
+            'max_rows_column': max_rows_column,
+            'drop_output_tables': drop_output_tables,
+            'hierarchical_join': hierarchical_join,
+            'save_column_summary': save_column_summary,
+            'save_column_summary_format': save_column_summary_format,
+            'skip_row_total': skip_row_total,
+            'use_diff_table': use_diff_table,
+            'case_insensitive': case_insensitive,
+            'prune_identical_columns': prune_identical_columns,
+            'joined_shard_width': joined_shard_width,
+            'profile': profile,
+            'profile_only': profile_only,
+            'profile_top_values': profile_top_values,
+            'pruned_columns': pruned_columns,
+            'fused_column_queries': fused_column_queries,
+            'skip_column_details': skip_column_details,
+            'sample': sample,
+            'hash_join_keys': hash_join_keys,
+        })
+        cached_all_info = cache.get(cache_key)
+        if cached_all_info is not None:
+            LOGGER.info('Neither table changed since a cached diff with the same options, using its results.')
+            return cached_all_info
+
+    stages = get_stages(
+        x_schema=x_schema,
+        x_table=x_table,
+        y_schema=y_schema,
+        y_table=y_table,
+        output_schema=output_schema,
+        join_cols=join_cols,
+        exclude_columns=exclude_columns,
+        max_rows_all=max_rows_all,
+        max_rows_column=max_rows_column,
+        drop_output_tables=drop_output_tables,
+        hierarchical_join=hierarchical_join,
+        save_column_summary=save_column_summary,
+        save_column_summary_format=save_column_summary_format,
+        skip_row_total=skip_row_total,
+        use_diff_table=use_diff_table,
+        prune_identical_columns=prune_identical_columns,
+        joined_shard_width=joined_shard_width,
+        spill_dir=spill_dir,
+        shard_dir=shard_dir,
+        profile=profile,
+        profile_only=profile_only,
+        profile_top_values=profile_top_values,
+        pruned_columns=pruned_columns,
+        fused_column_queries=fused_column_queries,
+        skip_column_details=skip_column_details,
+        sample=sample,
+        hash_join_keys=hash_join_keys
+    )
+    telemetry = None if telemetry_interval is None else StageTelemetry(get_cur, telemetry_interval, progress)
+    try:
+        with (nullcontext() if telemetry is None else telemetry):
+            results, timings = run_stages(
+                stages,
+                cur,
+                pool=pool,
+                prepare_cur=prepare_cur,
+                stage_timeout=stage_timeout,
+                progress=progress,
+                telemetry=telemetry
+            )
+    except StagesInterrupted as e:
+        LOGGER.warning('Dropping the tables of the interrupted diff.')
+        drop_diff_tables(cur, output_schema, x_schema, x_table, y_schema, y_table, e.results)
+        # a partial report, if we got as far as the columns:
+        if 'column_info' in e.results:
+            e.all_info = get_all_info(e.results, e.timings, x_schema, x_table, y_schema, y_table, join_cols)
+            e.all_info['interrupted'] = str(e)
+            if telemetry is not None:
+                e.all_info['stage_telemetry'] = telemetry.summary()
+        raise
+
+    all_info = get_all_info(results, timings, x_schema, x_table, y_schema, y_table, join_cols)
+    if telemetry is not None:
+        all_info['stage_telemetry'] = telemetry.summary()
+    if profile_only:
+        all_info['profile_only'] = True
+
+    if drop_output_tables and not profile_only:
+        LOGGER.info("Dropping output tables. WARNING: queries in the report won't work!")
+        drop_diff_tables(cur, output_schema, x_schema, x_table, y_schema, y_table, results, use_diff_table)
+
+    if cache is not None:
+        cache.put(cache_key, all_info)
+
+    return all_info
+
+
+def prepare_cursors(cur: Cursor,
+                    pool: Optional[CursorPool],
+                    case_insensitive: bool,
+                    local_tables: bool) -> Tuple[Optional[CursorPool], Optional[Callable[[Cursor], None]]]:
+    '''Set up `cur` for a diff, and return the pool and prepare_cur to run its stages with (see run_stages()).
+
+    With `case_insensitive`, the session of `cur`, and then of each pooled cursor, compares strings without case.
+    With `local_tables` (the diff reads or builds local temp tables, which are only visible to the session of `cur`),
+    there is no pool, all the stages run on `cur`.'''
+    def set_case_insensitive(c: Cursor) -> None:
+        c.execute("SET LOCALE TO 'en_US@colstrength=1';")
+        # clear the results
+        c.fetchall()
 
     if case_insensitive:
         LOGGER.info('Setting to case insensitive.')
-        cur.execute("SET LOCALE TO 'en_US@colstrength=1';")
-        # clear the results
-        cur.fetchall()
-
-    all_col_info_df = get_all_col_info(
-        cur,
-        x_schema,
-        x_table,
-        y_schema,
-        y_table,
-        exclude_columns,
-        save_column_summary,
-        save_column_summary_format
-    )
-    comparable_filter = (~all_col_info_df.exclude & all_col_info_df.comparable & ~all_col_info_df.x_dtype.isnull() & ~all_col_info_df.y_dtype.isnull())
-    all_col_info_df['uncomparable'] = (~all_col_info_df.comparable) & (~all_col_info_df.x_dtype.isnull()) & (~all_col_info_df.y_dtype.isnull())
-    # check that the join cols exist on both tables
-    for col in join_cols:
-        if all_col_info_df.loc[comparable_filter & (all_col_info_df.index == col), :].shape[0] == 0:
-            raise RuntimeError('Column `{0}` not in comparable columns (missing from one, both, or bad dtype). Here is the info we do have about that col:\n'.format(col) + all_col_info_df.loc[col, :].to_string())
-
-    LOGGER.info('Checking primary keys.')
-    x = check_primary_key(cur=cur, schema=x_schema, table=x_table, join_cols=join_cols)
-    y = check_primary_key(cur=cur, schema=y_schema, table=y_table, join_cols=join_cols)
-    dedup_info = {x_table: {'count': x}, y_table: {'count': y}}
+        set_case_insensitive(cur)
+    if (pool is not None) and local_tables:
+        LOGGER.info('Running all stages on one connection, the temp tables used by this diff are only visible to one session.')
+        pool = None
+    return pool, (set_case_insensitive if case_insensitive else None)
+
+
+def get_all_info(results: Dict[str, Any], timings: Dict[str, dict],
+                 x_schema: str, x_table: str,
+                 y_schema: str, y_table: str,
+                 join_cols: list) -> Dict[str, Any]:
+    '''Assemble the info for the reports from the results of the stages of main() (see get_stages()).
+    The results of stages that didn't finish, if the diff was interrupted, are left empty.'''
+    all_col_info_df, comparable_filter = results['column_info']
+    all_col_info_df['identical'] = all_col_info_df.index.isin(results.get('column_checksums', set()))
+    dedup_info = {
+        x_table: {'count': results.get('x_primary_key', {}).get('count', 0), **results.get('x_dup_stats', {})},
+        y_table: {'count': results.get('y_primary_key', {}).get('count', 0), **results.get('y_dup_stats', {})}
+    }
+    x_schema, x_table = results.get('x_dedup', (x_schema, x_table))
+    y_schema, y_table = results.get('y_dedup', (y_schema, y_table))
+    column_diffs = results.get('column_diffs', {})
+    no_missing_join = {'count': 0, 'query': '-- not run', 'sample': pd.DataFrame()}
+
+    all_info = {
+        'x_schema': x_schema,
+        'y_schema': y_schema,
+        'x_table': x_table,
+        'y_table': y_table,
+        'join_cols': join_cols,
+        'total_row_count': results.get('joined', 0),
+        'column_info': column_diffs,
+        'column_match_info': all_col_info_df,
+        'missing_join_info': results.get('missing_join', {'x': no_missing_join, 'y': no_missing_join}),
+        'hierarchical_join_info': results.get('hierarchical_join', {}),
+        'dedup_info': dedup_info,
+        'diff_summary': results.get('diff_rows', {'sample': [], 'count': 0, 'total_count': sum(get_column_counts(column_diffs).values())}),
+        'stage_timings': {name: t['end'] - t['start'] for name, t in timings.items() if 'end' in t},
+    }
+    if ('x_profile' in results) and ('y_profile' in results):
+        all_info['column_profile'] = get_profile_drift(results['x_profile'], results['y_profile'])
+    return all_info
+
+
+def drop_diff_tables(cur: Cursor,
+                     output_schema: str,
+                     x_schema: str, x_table: str,
+                     y_schema: str, y_table: str,
+                     results: Dict[str, Any],
+                     use_diff_table: bool = True) -> None:
+    '''Drop every table that the stages of main() may have (started to) build,
+    going by the stages that finished, e.g. after the diff was interrupted or with drop_output_tables:
+    the _dedup and _dup tables, the joined table(s), and the diff table if `use_diff_table`.'''
+    tables = []
+    for side, schema, table in (('x', x_schema, x_table), ('y', y_schema, y_table)):
+        if results.get(side + '_primary_key', {}).get('count', 0) > 0:
+            tables += [(schema, table + '_dedup'), (schema, table + '_dup'),
+                       ('v_temp_schema', table + '_dedup'), ('v_temp_schema', table + '_dup')]
+    if 'joined_shards' in results:
+        tables += [(output_schema, joined_table) for joined_table in results['joined_shards'].keys()]
+    if use_diff_table and ('x_dedup' in results):
+        tables.append((output_schema, results['x_dedup'][1] + '_DIFF'))
+    for schema, table in tables:
+        q = JINJA_ENV.get_template('table_drop.sql').render(schema_name=schema, table_name=table)
+        LOGGER.info(q)
+        cur.execute(q)
+
+
+def get_stages(x_schema: str, x_table: str,
+               y_schema: str, y_table: str,
+               output_schema: str,
+               join_cols: list,
+               exclude_columns: set,
+               max_rows_all: int,
+               max_rows_column: int,
+               drop_output_tables: bool,
+               hierarchical_join: bool,
+               save_column_summary: bool,
+               save_column_summary_format: str,
+               skip_row_total: bool,
+               use_diff_table: bool,
+               prune_identical_columns: bool = False,
+               joined_shard_width: int = 0,
+               spill_dir: Optional[Path] = None,
+               shard_dir: Optional[Path] = None,
+               profile: bool = False,
+               profile_only: bool = False,
+               profile_top_values: int = 5,
+               pruned_columns: Optional[set] = None,
+               joined_table: Optional[str] = None,
+               fused_column_queries: bool = False,
+               skip_column_details: bool = False,
+               sample: str = DEFAULT_SAMPLE,
+               hash_join_keys: bool = False) -> List[Stage]:
+    '''The stages of main(), with the dependencies between them:
+
+    - column_info: the column names and dtypes of both tables.
+    - {x,y}_profile (if profile or profile_only): the distribution of each column that isn't excluded
+      (or one of the `pruned_columns` of a query input), on each side.
+      With profile_only, these are the only other stages.
+    - {x,y}_primary_key: the # of rows in each table that aren't unique on the join keys,
+      and the # of NULLs in each join key, counted along with the rows (see main.get_primary_key_info()).
+      The keys without NULLs on either side are joined with =, which the optimizer does better with, the others with <=>.
+    - hierarchical_join (if hierarchical_join): rows missing on each join key, from the original tables.
+    - {x,y}_dedup: the (schema, table) to compare for each side, deduplicated if needed.
+    - {x,y}_dup_stats: the # of duplicated join keys, their rows, and the most rows for one key, if any.
+    - missing_join: rows that don't match after deduplication.
+    - column_checksums (if prune_identical_columns): the columns that are identical by checksum,
+      which are then left out of the joined table and the column diffs.
+    - joined_shards: the columns in each joined table, by table name,
+      several if joined_shard_width is less than the # of columns to compare (see get_joined_shards).
+      The joined table is `joined_table`, by default [the deduplicated x table]_JOINED.
+    - joined: build the joined table(s), its result is the # of rows.
+    - diff_table (if use_diff_table): build the diff table.
+    - column_diffs, diff_rows: the differences by column and by row.
+      The column diffs are a ColumnStore in `spill_dir`, if given,
+      and the fragment of each column of the sharded HTML report is written to `shard_dir` as it is done, if given.
+      Without the diff table, each column's details come from one query if fused_column_queries.
+      With skip_column_details, only their counts and queries.
+
+    The rows of all of the samples are picked by the `sample` method (see main.SAMPLE_METHODS).
+    With hash_join_keys, missing_join and joined join on the hash of the keys first (see main.create_joined_table()).
+    '''
+
+    def column_info(cur: Cursor, results: dict):
+        all_col_info_df = get_all_col_info(
+            cur,
+            x_schema,
+            x_table,
+            y_schema,
+            y_table,
+            exclude_columns,
+            save_column_summary,
+            save_column_summary_format
+        )
+        comparable_filter = (~all_col_info_df.exclude & all_col_info_df.comparable & ~all_col_info_df.x_dtype.isnull() & ~all_col_info_df.y_dtype.isnull())
+        all_col_info_df['uncomparable'] = (~all_col_info_df.comparable) & (~all_col_info_df.x_dtype.isnull()) & (~all_col_info_df.y_dtype.isnull())
+        # check that the join cols exist on both tables
+        for col in join_cols:
+            if all_col_info_df.loc[comparable_filter & (all_col_info_df.index == col), :].shape[0] == 0:
+                raise RuntimeError('Column `{0}` not in comparable columns (missing from one, both, or bad dtype). Here is the info we do have about that col:\n'.format(col) + all_col_info_df.loc[col, :].to_string())
+        return all_col_info_df, comparable_filter
+
+    def get_compare_filter(results: dict):
+        all_col_info_df, comparable_filter = results['column_info']
+        return comparable_filter & ~all_col_info_df.index.isin(results.get('column_checksums', set()))
+
+    def column_profile(side: str, schema: str, table: str):
+        def run(cur: Cursor, results: dict) -> pd.DataFrame:
+            all_col_info_df, comparable_filter = results['column_info']
+            profiled = ~all_col_info_df.exclude & ~all_col_info_df[side + '_dtype'].isnull() & ~all_col_info_df.index.isin(pruned_columns or set())
+            dtypes = all_col_info_df.loc[profiled, side + '_dtype']
+            LOGGER.info('Profiling the columns of ' + schema + '.' + table + '.')
+            return get_column_profile(cur, schema, table, dtypes.to_dict(), profile_top_values)
+        return run
+
+    def primary_key(schema: str, table: str):
+        def run(cur: Cursor, results: dict) -> Dict[str, Any]:
+            return get_primary_key_info(cur=cur, schema=schema, table=table, join_cols=join_cols)
+        return run
+
+    def get_not_null_keys(results: dict) -> List[str]:
+        return [col for col in join_cols if results['x_primary_key']['key_nulls'][col] == 0 and results['y_primary_key']['key_nulls'][col] == 0]
 
     # hard stop on primary key:
     # assert x == 0, '# non distinct rows in ' + x_table + ' is ' + str(x)
     # assert y == 0, '# non distinct rows in ' + y_table + ' is ' + str(y)
 
-    if hierarchical_join:
+    def hierarchical(cur: Cursor, results: dict):
         LOGGER.info('Getting rows that are missing on each join key.')
-        hierarchical_join_info = get_unmatched_rows(
+        return get_unmatched_rows(
             cur=cur,
             x_schema=x_schema,
             y_schema=y_schema,
             x_table=x_table,
             y_table=y_table,
             join_cols=join_cols,
-            max_rows_column=max_rows_column
+            max_rows_column=max_rows_column,
+            not_null_keys=get_not_null_keys(results),
+            sample=sample
         )
-    else:
-        hierarchical_join_info = {}
 
-    # create sub-tables to allow a comparison:
-    if x != 0:
-        LOGGER.info('X table was not unique on join keys, creating _dedup and _dup versions.')
-        schema, x_table = select_distinct_rows(
-            cur,
-            x_schema,
-            x_table,
-            join_cols,
-            use_temp_tables=(drop_output_tables or x_schema == 'v_temp_schema')
+    def dedup(side: str, schema: str, table: str):
+        # create sub-tables to allow a comparison:
+        def run(cur: Cursor, results: dict) -> Tuple[str, str]:
+            if results[side + '_primary_key']['count'] == 0:
+                return schema, table
+            LOGGER.info(side.upper() + ' table was not unique on join keys, creating _dedup and _dup versions.')
+            return select_distinct_rows(
+                cur,
+                schema,
+                table,
+                join_cols,
+                use_temp_tables=(drop_output_tables or schema == 'v_temp_schema')
+            )
+        return run
+
+    def dup_stats(side: str, table: str):
+        def run(cur: Cursor, results: dict) -> dict:
+            if results[side + '_primary_key']['count'] == 0:
+                return {}
+            return get_dup_stats(cur, results[side + '_dedup'][0], table, join_cols)
+        return run
+
+    def missing_join(cur: Cursor, results: dict):
+        LOGGER.info('Getting rows that did not match (not in joined table) after deduping.')
+        return get_unmatched_rows_straight(
+            cur=cur,
+            x_schema=results['x_dedup'][0],
+            y_schema=results['y_dedup'][0],
+            x_table=results['x_dedup'][1],
+            y_table=results['y_dedup'][1],
+            join_cols=join_cols,
+            max_rows_column=max_rows_column,
+            not_null_keys=get_not_null_keys(results),
+            sample=sample,
+            hash_keys=hash_join_keys,
+            hash_cols=(get_hash_keys(results['column_info'][0], join_cols) if hash_join_keys else None)
         )
-    if y != 0:
-        LOGGER.info('Y table was not unique on join keys, creating _dedup and _dup versions.')
-        y_schema, y_table = select_distinct_rows(
-            cur,
-            y_schema,
-            y_table,
-            join_cols,
-            use_temp_tables=(drop_output_tables or y_schema == 'v_temp_schema')
+
+    def column_checksums(cur: Cursor, results: dict) -> set:
+        all_col_info_df, comparable_filter = results['column_info']
+        same_dtype = all_col_info_df.x_dtype.str.lower() == all_col_info_df.y_dtype.str.lower()
+        columns = all_col_info_df.loc[comparable_filter & same_dtype & ~all_col_info_df.index.isin(join_cols), :].index.tolist()
+        LOGGER.info('Checksumming columns on both sides.')
+        return get_identical_columns(
+            cur=cur,
+            x_schema=results['x_dedup'][0],
+            x_table=results['x_dedup'][1],
+            y_schema=results['y_dedup'][0],
+            y_table=results['y_dedup'][1],
+            join_cols=join_cols,
+            columns=columns
         )
 
-    LOGGER.info('Getting rows that did not match (not in joined table) after deduping.')
-    missing_join_info = get_unmatched_rows_straight(
-        cur=cur,
-        x_schema=x_schema,
-        y_schema=y_schema,
-        x_table=x_table,
-        y_table=y_table,
-        join_cols=join_cols,
-        max_rows_column=max_rows_column
-    )
+    def joined_shards(cur: Cursor, results: dict) -> Dict[str, List[str]]:
+        all_col_info_df, comparable_filter = results['column_info']
+        columns = all_col_info_df.loc[get_compare_filter(results) & ~all_col_info_df.index.isin(join_cols), :].index.tolist()
+        return get_joined_shards(columns, joined_shard_width, joined_table or (results['x_dedup'][1] + '_JOINED'))
 
-    # build the joined table
-    LOGGER.info('Building joined table ' + (x_table + '_JOINED'))
-    joined_row_count = create_joined_table(
-        cur=cur,
-        x_schema=x_schema,
-        y_schema=y_schema,
-        x_table=x_table,
-        y_table=y_table,
-        join_cols=join_cols,
-        compare_cols=all_col_info_df.loc[comparable_filter, :],
-        joined_schema=output_schema,
-        joined_table=(x_table + '_JOINED')
-    )
+    def joined(cur: Cursor, results: dict) -> int:
+        all_col_info_df, comparable_filter = results['column_info']
+        compare_filter = get_compare_filter(results)
+        for joined_table, columns in results['joined_shards'].items():
+            LOGGER.info('Building joined table ' + joined_table)
+            # every shard is the same inner join, so has the same # of rows:
+            joined_row_count = create_joined_table(
+                cur=cur,
+                x_schema=results['x_dedup'][0],
+                y_schema=results['y_dedup'][0],
+                x_table=results['x_dedup'][1],
+                y_table=results['y_dedup'][1],
+                join_cols=join_cols,
+                compare_cols=all_col_info_df.loc[compare_filter & all_col_info_df.index.isin(join_cols + columns), :],
+                joined_schema=output_schema,
+                joined_table=joined_table,
+                not_null_keys=get_not_null_keys(results),
+                hash_keys=hash_join_keys
+            )
+        return joined_row_count
 
-    if use_diff_table:
-        # build the diff table
-        LOGGER.info('Building diff table ' + (x_table + '_DIFF.'))
+    def diff_table(cur: Cursor, results: dict) -> None:
+        all_col_info_df, comparable_filter = results['column_info']
+        deduped_x_table = results['x_dedup'][1]
+        LOGGER.info('Building diff table ' + (deduped_x_table + '_DIFF.'))
         create_diff_table(
             cur=cur,
             schema=output_schema,
-            table=(x_table + '_DIFF'),
+            table=(deduped_x_table + '_DIFF'),
             join_cols=join_cols,
             all_col_info_df=all_col_info_df
         )
-        for column in all_col_info_df.loc[comparable_filter & ~all_col_info_df.index.isin(join_cols), :].index.values:
+        for column in all_col_info_df.loc[get_compare_filter(results) & ~all_col_info_df.index.isin(join_cols), :].index.values:
             LOGGER.info('Inserting column ' + column + ' into diff table.')
             insert_diff_table(
                 cur=cur,
                 joined_schema=output_schema,
-                joined_table=(x_table + '_JOINED'),
+                joined_table=(deduped_x_table + '_JOINED'),
                 diff_schema=output_schema,
-                diff_table=(x_table + '_DIFF'),
+                diff_table=(deduped_x_table + '_DIFF'),
                 join_cols=join_cols,
                 column=column
             )
 
-        ############################################################################
-        # Result 1: Get rows with at least N=1 difference (count, query, dataframe),
-        ############################################################################
-        diff_summary = get_diff_rows(cur, output_schema, x_table, join_cols, max_rows_all, skip_row_total)
+    ############################################################################
+    # Result 1: Get rows with at least N=1 difference (count, query, dataframe),
+    ############################################################################
+    def diff_rows_from_diff_table(cur: Cursor, results: dict) -> dict:
+        return get_diff_rows(cur, output_schema, results['x_dedup'][1], join_cols, max_rows_all, skip_row_total, hash_join_keys)
 
-        ############################################################################
-        # Result 2: Get ordered list of columns by # of differences (query, dataframe).
-        ############################################################################
-        diff_columns = get_diff_columns(cur, output_schema, x_table)
+    ############################################################################
+    # Result 2: Get ordered list of columns by # of differences (query, dataframe).
+    # Result 3: Get detailed column diffs.
+    ############################################################################
+    def get_column_store() -> Optional[MutableMapping]:
+        column_store = None if spill_dir is None else ColumnStore(spill_dir)
+        return column_store if shard_dir is None else ShardWriter(shard_dir, column_store)
 
-        ############################################################################
-        # Result 3: Get detailed column diffs.
-        ############################################################################
-        grouped_column_diffs = get_column_diffs(diff_columns, cur, output_schema, x_schema, x_table, y_schema, y_table, join_cols, max_rows_column, all_col_info_df, hierarchical_join)
+    def column_diffs_from_diff_table(cur: Cursor, results: dict) -> MutableMapping:
+        all_col_info_df, comparable_filter = results['column_info']
+        (deduped_x_schema, deduped_x_table), (deduped_y_schema, deduped_y_table) = results['x_dedup'], results['y_dedup']
+        diff_columns = get_diff_columns(cur, output_schema, deduped_x_table)
+        return get_column_diffs(diff_columns, cur, output_schema, deduped_x_schema, deduped_x_table, deduped_y_schema, deduped_y_table, join_cols, max_rows_column, all_col_info_df, hierarchical_join,
+                                column_store=get_column_store(), sample=sample, details=not skip_column_details)
 
-    else:
-        grouped_column_diffs = get_column_diffs_from_joined(
+    def column_diffs_from_joined(cur: Cursor, results: dict) -> MutableMapping:
+        all_col_info_df, comparable_filter = results['column_info']
+        return get_column_diffs_from_joined(
             cur=cur,
             output_schema=output_schema,
-            x_schema=x_schema,
-            x_table=x_table,
-            y_schema=y_schema,
-            y_table=y_table,
+            x_schema=results['x_dedup'][0],
+            x_table=results['x_dedup'][1],
+            y_schema=results['y_dedup'][0],
+            y_table=results['y_dedup'][1],
             join_cols=join_cols,
             max_rows_column=max_rows_column,
             all_col_info_df=all_col_info_df,
-            comparable_filter=comparable_filter,
-            hierarchical=hierarchical_join
+            comparable_filter=get_compare_filter(results),
+            hierarchical=hierarchical_join,
+            joined_tables={column: table for table, columns in results['joined_shards'].items() for column in columns},
+            column_store=get_column_store(),
+            fused=fused_column_queries,
+            sample=sample,
+            details=not skip_column_details
         )
-        diff_summary = get_diff_rows_from_joined(
+
+    def diff_rows_from_joined(cur: Cursor, results: dict) -> dict:
+        return get_diff_rows_from_joined(
             cur=cur,
-            grouped_column_diffs=grouped_column_diffs,
+            grouped_column_diffs=results['column_diffs'],
             output_schema=output_schema,
-            x_table=x_table,
+            x_table=results['x_dedup'][1],
             join_cols=join_cols,
             max_rows_all=max_rows_all,
-            skip_row_total=skip_row_total
+            skip_row_total=skip_row_total,
+            joined_shards=results['joined_shards'],
+            not_null_keys=get_not_null_keys(results),
+            sample=sample,
+            hash_keys=hash_join_keys
         )
 
-    all_info = {
-        'x_schema': x_schema,
-        'y_schema': y_schema,
-        'x_table': x_table,
-        'y_table': y_table,
-        'join_cols': join_cols,
-        'total_row_count': joined_row_count,
-        'column_info': grouped_column_diffs,
-        'column_match_info': all_col_info_df,
-        'missing_join_info': missing_join_info,
-        'hierarchical_join_info': hierarchical_join_info,
-        'dedup_info': dedup_info,
-        'diff_summary': diff_summary,
-    }
+    profile_stages = [
+        Stage('x_profile', column_profile('x', x_schema, x_table), ('column_info',)),
+        Stage('y_profile', column_profile('y', y_schema, y_table), ('column_info',)),
+    ]
+    if profile_only:
+        return [Stage('column_info', column_info)] + profile_stages
+
+    stages = [
+        Stage('column_info', column_info),
+        Stage('x_primary_key', primary_key(x_schema, x_table), ('column_info',)),
+        Stage('y_primary_key', primary_key(y_schema, y_table), ('column_info',)),
+        Stage('x_dedup', dedup('x', x_schema, x_table), ('x_primary_key',)),
+        Stage('y_dedup', dedup('y', y_schema, y_table), ('y_primary_key',)),
+        Stage('x_dup_stats', dup_stats('x', x_table), ('x_dedup',)),
+        Stage('y_dup_stats', dup_stats('y', y_table), ('y_dedup',)),
+        Stage('missing_join', missing_join, ('column_info', 'x_primary_key', 'y_primary_key', 'x_dedup', 'y_dedup')),
+    ]
+    if profile:
+        stages += profile_stages
+    if prune_identical_columns:
+        stages += [
+            Stage('column_checksums', column_checksums, ('column_info', 'x_dedup', 'y_dedup')),
+            Stage('joined_shards', joined_shards, ('column_info', 'x_dedup', 'column_checksums')),
+        ]
+    else:
+        stages.append(Stage('joined_shards', joined_shards, ('column_info', 'x_dedup')))
+    stages.append(Stage('joined', joined, ('column_info', 'x_primary_key', 'y_primary_key', 'x_dedup', 'y_dedup', 'joined_shards')))
+    if hierarchical_join:
+        stages.append(Stage('hierarchical_join', hierarchical, ('column_info', 'x_primary_key', 'y_primary_key')))
+    if use_diff_table:
+        stages += [
+            Stage('diff_table', diff_table, ('joined',)),
+            Stage('diff_rows', diff_rows_from_diff_table, ('diff_table',)),
+            Stage('column_diffs', column_diffs_from_diff_table, ('diff_table',)),
+        ]
+    else:
+        stages += [
+            Stage('column_diffs', column_diffs_from_joined, ('joined',)),
+            Stage('diff_rows', diff_rows_from_joined, ('column_diffs',)),
+        ]
+    return stages
+
+
+def main_many(cur: Cursor,
+              x_schema: str, x_table: str,
+              y_tables: List[Tuple[str, str]],
+              output_schema: str,
+              join_cols: list,
+              exclude_columns: Optional[set] = None,
+              max_rows_all: int = 10,
+              max_rows_column: int = 10,
+              drop_output_tables: bool = False,
+              hierarchical_join: bool = False,
+              skip_row_total: bool = False,
+              case_insensitive: bool = False,
+              prune_identical_columns: bool = False,
+              joined_shard_width: int = 0,
+              stage_timeout: Optional[float] = None,
+              pool: Optional[CursorPool] = None,
+              progress: Optional[Callable[[dict], None]] = None,
+              spill_dir: Optional[Path] = None,
+              profile: bool = False,
+              sample: str = DEFAULT_SAMPLE,
+              hash_join_keys: bool = False) -> Dict[str, dict]:
+    '''Diff one (baseline) table against several candidates, the (schema, table) pairs of `y_tables`.
+    The options are those of main().
+
+    The stages of the diff against each candidate (see get_stages()) run as one set (see scope_stages()),
+    so that the stages of the x side are only run once for all of them:
+    its primary key check, the NULLs in its join keys, its deduplication and duplicate stats, and its profile.
+    Each candidate gets its own joined table, [x_table]_[y_table]_JOINED.
+    The diff table (use_diff_table) is not supported, its name is fixed by the x table.
+
+    Returns the all_info of each candidate, as main() would, by "schema.table".
+    '''
+    if exclude_columns is None:
+        exclude_columns = set()
+    if hash_join_keys and case_insensitive:
+        raise RuntimeError('Joining on the hash of the keys (hash_join_keys) does not support comparing them without case (case_insensitive).')
+    names = ['{0}.{1}'.format(y_schema, y_table) for y_schema, y_table in y_tables]
+    # the joined tables (and reports) are named after the candidate tables, without their schemas:
+    if len({y_table for y_schema, y_table in y_tables}) < len(y_tables):
+        raise RuntimeError('The candidate tables need different names: ' + ', '.join(names) + '.')
+
+    pool, prepare_cur = prepare_cursors(
+        cur, pool, case_insensitive,
+        drop_output_tables or ('v_temp_schema' in {x_schema} | {y_schema for y_schema, y_table in y_tables})
+    )
+
+    shared = {'x_primary_key', 'x_dedup', 'x_dup_stats', 'x_profile'}
+    stage_sets = []
+    for name, (y_schema, y_table) in zip(names, y_tables):
+        stage_sets.append((name + ':', get_stages(
+            x_schema=x_schema,
+            x_table=x_table,
+            y_schema=y_schema,
+            y_table=y_table,
+            output_schema=output_schema,
+            join_cols=join_cols,
+            exclude_columns=exclude_columns,
+            max_rows_all=max_rows_all,
+            max_rows_column=max_rows_column,
+            drop_output_tables=drop_output_tables,
+            hierarchical_join=hierarchical_join,
+            save_column_summary=False,
+            save_column_summary_format='CSV',
+            skip_row_total=skip_row_total,
+            use_diff_table=False,
+            prune_identical_columns=prune_identical_columns,
+            joined_shard_width=joined_shard_width,
+            spill_dir=spill_dir,
+            profile=profile,
+            joined_table='{0}_{1}_JOINED'.format(x_table, y_table),
+            sample=sample,
+            hash_join_keys=hash_join_keys
+        )))
+
+    try:
+        results, timings = run_stages(
+            scope_stages(stage_sets, shared),
+            cur,
+            pool=pool,
+            prepare_cur=prepare_cur,
+            stage_timeout=stage_timeout,
+            progress=progress
+        )
+    except StagesInterrupted as e:
+        LOGGER.warning('Dropping the tables of the interrupted diffs.')
+        for name, (y_schema, y_table) in zip(names, y_tables):
+            drop_diff_tables(cur, output_schema, x_schema, x_table, y_schema, y_table, get_scoped_results(e.results, name + ':', shared), use_diff_table=False)
+        raise
 
+    all_infos = {}
+    for name, (y_schema, y_table) in zip(names, y_tables):
+        all_infos[name] = get_all_info(
+            get_scoped_results(results, name + ':', shared),
+            get_scoped_results(timings, name + ':', shared),
+            x_schema, x_table, y_schema, y_table, join_cols
+        )
     if drop_output_tables:
-        LOGGER.info("Dropping output tables. WARNING: queries in the report won't work!")
-        cur.execute(JINJA_ENV.get_template('table_drop.sql').render(schema_name=output_schema, table_name=(x_table + '_JOINED')))
-        if use_diff_table:
-            cur.execute(JINJA_ENV.get_template('table_drop.sql').render(schema_name=output_schema, table_name=(x_table + '_DIFF')))
+        LOGGER.info("Dropping output tables. WARNING: queries in the reports won't work!")
+        for name, (y_schema, y_table) in zip(names, y_tables):
+            drop_diff_tables(cur, output_schema, x_schema, x_table, y_schema, y_table, get_scoped_results(results, name + ':', shared), use_diff_table=False)
+    return all_infos
 
-    return all_info
+
+def run_job(cur: Cursor, job: dict) -> Dict[str, Any]:
+    '''Run one job from a batch manifest (see dbdiff.batch.read_manifest) on `cur`:
+    build the diff and write its report.
+    Returns the top line counts and the report path.'''
+    options = dict(job['options'])
+    output_format = options.pop('output_format', 'HTML')
+    save_json_summary = options.pop('save_json_summary', False)
+    x_schema, x_table = job['schema'], job['x_table']
+    y_schema = options.pop('y_schema', None) or x_schema
+    y_table = job['y_table']
+    options['output_schema'] = options.get('output_schema') or x_schema
+    exclude_columns = options.pop('exclude_columns', [])
+    if isinstance(exclude_columns, str):
+        exclude_columns = exclude_columns.split(',')
+    x_table_query = options.pop('x_table_query', False)
+    y_table_query = options.pop('y_table_query', False)
+    lazy_table_query = options.pop('lazy_table_query', False)
+    if x_table_query or y_table_query:
+        (x_schema, x_table), (y_schema, y_table), options['pruned_columns'] = create_temp_tables_from_queries(
+            cur,
+            x_schema, x_table, x_table_query,
+            y_schema, y_table, y_table_query,
+            join_cols=job['join_cols'],
+            exclude_columns=set(col.lower() for col in exclude_columns),
+            lazy=lazy_table_query
+        )
+
+    all_info = main(
+        cur=cur,
+        x_schema=x_schema,
+        x_table=x_table,
+        y_schema=y_schema,
+        y_table=y_table,
+        join_cols=job['join_cols'],
+        exclude_columns=set(col.lower() for col in exclude_columns),
+        **options
+    )
+    try:
+        result = get_headline_from_all_info(all_info)
+        result['report'] = str(write_report(all_info, output_format, x_table))
+        if save_json_summary:
+            result['json_summary'] = str(write_json_summary(all_info, x_table))
+    finally:
+        close_columns(all_info['column_info'])
+    return result
+
+
+@cli.command('diff-many')
+@click.argument('schema')
+@click.argument('x_table')
+@click.argument('y_tables')
+@click.argument('join_cols')
+@click.option('--output-schema', default=None, help='If you want the schema for the output tables to be different, specify it.')
+@click.option('--drop-output-tables', is_flag=True, help='Drop the joined and deduplicated tables created and used here.')
+@click.option('--exclude-columns', default="", help='Comma separated string of column names to exclude.')
+@click.option('--hierarchical-join', is_flag=True, help='Break out the rows missing on the first join key, as for the diff command.')
+@click.option('--max-rows-all', default=10, help='Limit of full rows to pull that have differences.', show_default=True)
+@click.option('--max-rows-column', default=10, help='Limit of grouped and raw column level differences to pull.', show_default=True)
+@click.option('--output-format', type=click.Choice(['HTML', 'HTML-SHARDED', 'XLSX'], case_sensitive=False), default="HTML", help='Format of the report of each candidate.')
+@click.option('--skip-row-total', is_flag=True, help='Skip counting the total # of rows with differences, only use cell differences.')
+@click.option('--case-insensitive', is_flag=True, help='If using this flag, all case sensitivity is turned off.')
+@click.option('--prune-identical-columns', is_flag=True, help='Leave the columns that are identical by checksum out of the joined tables.')
+@click.option('--joined-shard-width', default=0, help='Split each joined table into several of at most this many compared columns.', show_default=True)
+@click.option('--profile', is_flag=True, help='Also profile each column of the baseline (once) and of each candidate.')
+@click.option('--sample', type=click.Choice(SAMPLE_METHODS, case_sensitive=False), default=DEFAULT_SAMPLE, help='How the rows of the samples in the reports are picked, as for the diff command.', show_default=True)
+@click.option('--hash-join-keys', is_flag=True, help='Join on the hash of the join keys first, as for the diff command.')
+@click.option('--spill-dir', type=Path, default=None, help='Keep the samples of each differing column in a SQLite file in this directory rather than in memory.')
+@click.option('--resource-pool', default=None, help='Run the queries of the diffs in this Vertica resource pool.')
+@click.option('--runtime-cap', default=None, help="The longest any one query may run, e.g. '30 minutes' (the session's RUNTIMECAP).")
+@click.option('--memory-cap', default=None, help="The most memory the queries may use, e.g. '4G' (the session's MEMORYCAP).")
+@click.option('--stage-timeout', type=float, default=None, help='Cancel the diffs if any one stage runs for longer than this many seconds.')
+@click.option('--workers', default=1, help='Number of connections to use, to run independent stages (e.g. of different candidates) at the same time.', show_default=True)
+@click.option('--save-json-summary', is_flag=True, help='Save a .json file of the diff summary of each candidate.')
+@click.option('--logging-config', type=Path, default=DEFAULT_LOGGING_CONFIG)
+def diff_many(schema: str, x_table: str, y_tables: str, join_cols: str,
+              output_schema: str, drop_output_tables: bool, exclude_columns: str,
+              hierarchical_join: bool, max_rows_all: int, max_rows_column: int,
+              output_format: str, skip_row_total: bool, case_insensitive: bool,
+              prune_identical_columns: bool, joined_shard_width: int, profile: bool, sample: str, hash_join_keys: bool, spill_dir: Path,
+              resource_pool: str, runtime_cap: str, memory_cap: str,
+              stage_timeout: float, workers: int, save_json_summary: bool, logging_config: Path):
+    """Compare the baseline table X_TABLE against each of the candidate tables in comma-separated Y_TABLES
+    (each TABLE, in SCHEMA, or SCHEMA.TABLE), joined on the columns in comma-separated JOIN_COLS.
+
+    The baseline is only checked, deduplicated and profiled once.
+    Writes the report of each candidate, [X_TABLE]_[Y_TABLE]_report,
+    and a comparison matrix across the candidates linking to them, [X_TABLE]_matrix.html."""
+    if output_schema is None:
+        output_schema = schema
+    if hash_join_keys and case_insensitive:
+        raise click.UsageError('--hash-join-keys does not support --case-insensitive.')
+    join_cols_list = list(map(lambda x: x.lower(), join_cols.split(',')))
+    exclude_columns_set = set(map(lambda x: x.lower(), exclude_columns.split(',')))
+    candidates = []
+    for name in y_tables.split(','):
+        y_schema, _, y_table = name.rpartition('.')
+        candidates.append((y_schema or schema, y_table))
+    initialize_logging(logging_config)
+
+    limits = dict(resource_pool=resource_pool, runtime_cap=runtime_cap, memory_cap=memory_cap)
+    pool_context: ContextManager[Optional[CursorPool]] = CursorPool(workers, session=limits) if workers > 1 else nullcontext()
+    try:
+        with get_cur(**limits) as cur, pool_context as pool:
+            all_infos = main_many(
+                cur=cur,
+                x_schema=schema,
+                x_table=x_table,
+                y_tables=candidates,
+                output_schema=output_schema,
+                join_cols=join_cols_list,
+                exclude_columns=exclude_columns_set,
+                max_rows_all=max_rows_all,
+                max_rows_column=max_rows_column,
+                drop_output_tables=drop_output_tables,
+                hierarchical_join=hierarchical_join,
+                skip_row_total=skip_row_total,
+                case_insensitive=case_insensitive,
+                prune_identical_columns=prune_identical_columns,
+                joined_shard_width=joined_shard_width,
+                stage_timeout=stage_timeout,
+                pool=pool,
+                spill_dir=spill_dir,
+                profile=profile,
+                sample=sample.lower(),
+                hash_join_keys=hash_join_keys
+            )
+    except StagesInterrupted as e:
+        raise click.ClickException(str(e))
+
+    reports = {}
+    try:
+        for name, all_info in all_infos.items():
+            report_name = x_table + '_' + name.split('.', 1)[1]
+            reports[name] = write_report(all_info, output_format, report_name).as_posix()
+            if save_json_summary:
+                write_json_summary(all_info, report_name)
+        path = Path(x_table + '_matrix.html')
+        path.write_text(html_matrix_report(schema, x_table, get_comparison_matrix(all_infos), reports))
+    finally:
+        for all_info in all_infos.values():
+            close_columns(all_info['column_info'])
+    click.echo(path)
+
+
+@cli.command('schema')
+@click.argument('x_schema')
+@click.argument('y_schema')
+@click.option('--tables', default=None, help='Comma separated names of the tables to diff, by default all of those in both schemas.')
+@click.option('--join-cols', default=None, help='Comma separated join keys for the tables without a primary key in either schema.')
+@click.option('--output-schema', default=None, help='The schema of the output tables, by default X_SCHEMA.')
+@click.option('--drop-output-tables', is_flag=True, help='Drop the joined and diff tables created and used here.')
+@click.option('--exclude-columns', default="", help='Comma separated string of column names to exclude, from every table.')
+@click.option('--max-rows-all', default=10, help='Limit of full rows to pull that have differences.', show_default=True)
+@click.option('--max-rows-column', default=10, help='Limit of grouped and raw column level differences to pull.', show_default=True)
+@click.option('--output-format', type=click.Choice(['HTML', 'HTML-SHARDED', 'XLSX'], case_sensitive=False), default="HTML", help='Format of the report of each table.')
+@click.option('--sample', type=click.Choice(SAMPLE_METHODS, case_sensitive=False), default=DEFAULT_SAMPLE, help='How the rows of the samples in the reports are picked, as for the diff command.', show_default=True)
+@click.option('--hash-join-keys', is_flag=True, help='Join on the hash of the join keys first, as for the diff command.')
+@click.option('--concurrency', default=4, help='Maximum number of tables diffed at once, each on its own pooled connection.', show_default=True)
+@click.option('--history', type=Path, default=DEFAULT_HISTORY, help='JSON file of how long each table took before, used to start the longest first.', show_default=True)
+@click.option('--resource-pool', default=None, help='Run the queries of the diffs in this Vertica resource pool.')
+@click.option('--runtime-cap', default=None, help="The longest any one query may run, e.g. '30 minutes' (the session's RUNTIMECAP).")
+@click.option('--memory-cap', default=None, help="The most memory the queries may use, e.g. '4G' (the session's MEMORYCAP).")
+@click.option('--logging-config', type=Path, default=DEFAULT_LOGGING_CONFIG)
+def schema(x_schema: str, y_schema: str, tables: str, join_cols: str, output_schema: str,
+           drop_output_tables: bool, exclude_columns: str, max_rows_all: int, max_rows_column: int,
+           output_format: str, sample: str, hash_join_keys: bool, concurrency: int, history: Path,
+           resource_pool: str, runtime_cap: str, memory_cap: str, logging_config: Path):
+    """Compare every table of X_SCHEMA with the table of the same name in Y_SCHEMA.
+
+    The columns of all of the tables of both schemas are read with one catalog query.
+    Each pair is joined on the primary key of its x table (or else of its y table), or else on --join-cols.
+    The pairs are diffed --concurrency at a time, as the batch command would, each writing its own report,
+    and [X_SCHEMA]_[Y_SCHEMA]_schema.html links to all of them."""
+    initialize_logging(logging_config)
+    history_info = read_history(history)
+    options = dict(
+        output_schema=output_schema,
+        exclude_columns=[col for col in exclude_columns.lower().split(',') if col],
+        drop_output_tables=drop_output_tables,
+        max_rows_all=max_rows_all,
+        max_rows_column=max_rows_column,
+        output_format=output_format,
+        sample=sample.lower(),
+        hash_join_keys=hash_join_keys
+    )
+
+    limits = dict(resource_pool=resource_pool, runtime_cap=runtime_cap, memory_cap=memory_cap)
+    with CursorPool(concurrency, session=limits) as pool:
+        with pool.acquire() as cur:
+            schema_columns = get_schema_columns(cur, [x_schema, y_schema])
+        pairs = get_schema_jobs(
+            schema_columns, x_schema, y_schema,
+            tables=(None if tables is None else tables.split(',')),
+            default_join_cols=(None if join_cols is None else join_cols.lower().split(',')),
+            options=options
+        )
+        if not pairs['jobs']:
+            raise click.ClickException('No tables of {0} and {1} to diff.'.format(x_schema, y_schema))
+        # the diffs read the columns of their tables from the ones just read:
+        catalog_cache = CatalogCache(float('inf'))
+        fill_catalog_cache(catalog_cache, schema_columns)
+        use_catalog_cache(catalog_cache)
+        try:
+            results = run_batch(pairs['jobs'], run_job, pool, concurrency, history_info)
+        finally:
+            use_catalog_cache(None)
+
+    history.write_text(json.dumps(update_history(history_info, results), indent=4))
+    path = Path('{0}_{1}_schema.html'.format(x_schema, y_schema))
+    path.write_text(html_schema_report(x_schema, y_schema, pairs['jobs'], results, pairs['only_x'], pairs['only_y'], pairs['skipped']))
+    click.echo(path)
+    failed = [result['key'] for result in results if result['status'] != 'ok']
+    if failed:
+        raise click.ClickException('{0} of {1} tables failed: {2}. See {3}.'.format(len(failed), len(results), ', '.join(failed), path))
+
+
+@cli.command()
+@click.argument('manifest', type=Path)
+@click.option('--concurrency', default=4, help='Maximum number of diffs run at once, each on its own pooled connection.', show_default=True)
+@click.option('--history', type=Path, default=DEFAULT_HISTORY, help='JSON file of how long each job took before, used to start the longest jobs first.', show_default=True)
+@click.option('--summary', type=Path, default=Path('batch_summary.json'), help='Where to write the summary of all jobs.', show_default=True)
+@click.option('--logging-config', type=Path, default=DEFAULT_LOGGING_CONFIG)
+def batch(manifest: Path, concurrency: int, history: Path, summary: Path, logging_config: Path):
+    """Run the diff for every job in the JSON file MANIFEST,
+    sharing a pool of at most --concurrency connections.
+
+    Each job writes its own report, as the diff command would.
+    Jobs run in order of their "priority", then longest expected run time first.
+    See dbdiff.batch.read_manifest for the manifest format."""
+    initialize_logging(logging_config)
+    jobs = read_manifest(manifest)
+    history_info = read_history(history)
+
+    with CursorPool(concurrency) as pool:
+        results = run_batch(jobs, run_job, pool, concurrency, history_info)
+
+    history.write_text(json.dumps(update_history(history_info, results), indent=4))
+    summary.write_text(json.dumps(results, indent=4, default=str))
+    failed = [result['key'] for result in results if result['status'] != 'ok']
+    if failed:
+        raise click.ClickException('{0} of {1} batch jobs failed: {2}. See {3}.'.format(len(failed), len(results), ', '.join(failed), summary))
+
+
+@cli.command()
+@click.argument('bundle', type=Path)
+@click.option('--output-format', type=click.Choice(['HTML', 'HTML-SHARDED', 'XLSX'], case_sensitive=False), default="HTML")
+@click.option('--save-json-summary', is_flag=True, help='Save a .json file of the diff summary.')
+def report(bundle: Path, output_format: str, save_json_summary: bool):
+    """Write the report of a diff from the directory BUNDLE saved by `dbdiff diff --save-bundle`,
+    without connecting to the database."""
+    loaded = load_bundle(bundle)
+    click.echo(write_report(loaded['all_info'], output_format, loaded['name']))
+    if save_json_summary:
+        write_json_summary(loaded['all_info'], loaded['name'])
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1', help='Address to listen on.', show_default=True)
+@click.option('--port', default=8765, help='Port to listen on.', show_default=True)
+@click.option('--workers', default=2, help='Number of diffs run at once, each on its own pooled connection.', show_default=True)
+@click.option('--max-queue', default=16, help='Most jobs waiting to run, more are refused (HTTP 503).', show_default=True)
+@click.option('--catalog-ttl', default=300.0, help='Seconds to keep the columns of each table before reading them from the catalog again.', show_default=True)
+@click.option('--resource-pool', default=None, help='Run the queries of the diffs in this Vertica resource pool.')
+@click.option('--runtime-cap', default=None, help="The longest any one query may run, e.g. '30 minutes' (the session's RUNTIMECAP).")
+@click.option('--memory-cap', default=None, help="The most memory the queries may use, e.g. '4G' (the session's MEMORYCAP).")
+@click.option('--logging-config', type=Path, default=DEFAULT_LOGGING_CONFIG)
+def serve(host: str, port: int, workers: int, max_queue: int, catalog_ttl: float,
+          resource_pool: str, runtime_cap: str, memory_cap: str, logging_config: Path):
+    """Run diffs sent over a local HTTP/JSON API, on connections kept open between them.
+
+    POST a job (as in a `dbdiff batch` manifest) to /jobs, then follow it on /jobs/<id>/events.
+    See dbdiff.serve.DiffHandler for the API."""
+    initialize_logging(logging_config)
+    use_catalog_cache(CatalogCache(catalog_ttl))
+    limits = dict(resource_pool=resource_pool, runtime_cap=runtime_cap, memory_cap=memory_cap)
+    with CursorPool(workers, session=limits) as pool:
+        pool.warm()
+        service = DiffService(run_job, pool.acquire, workers=workers, max_queue=max_queue)
+        service.start()
+        server = DiffServer((host, port), service)
+        LOGGER.info('Serving on http://{0}:{1}/.'.format(host, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            LOGGER.info('Stopping, waiting for the running jobs.')
+        finally:
+            server.server_close()
+            service.stop()
+
+
+@cli.command()
+@click.argument('bundle', type=Path)
+@click.option('--host', default='127.0.0.1', help='Address to listen on.', show_default=True)
+@click.option('--port', default=8766, help='Port to listen on.', show_default=True)
+@click.option('--workers', default=2, help='Most connections open at once, to get the details of the columns being opened.', show_default=True)
+@click.option('--cache-columns', default=DEFAULT_CACHE_COLUMNS, help='Number of columns whose details are kept, the least recently opened are fetched again.', show_default=True)
+@click.option('--max-rows-column', default=10, help='Limit of rows of each sample of a column.', show_default=True)
+@click.option('--resource-pool', default=None, help='Run the queries in this Vertica resource pool.')
+@click.option('--runtime-cap', default=None, help="The longest any one query may run, e.g. '30 minutes' (the session's RUNTIMECAP).")
+@click.option('--memory-cap', default=None, help="The most memory the queries may use, e.g. '4G' (the session's MEMORYCAP).")
+@click.option('--logging-config', type=Path, default=DEFAULT_LOGGING_CONFIG)
+def explore(bundle: Path, host: str, port: int, workers: int, cache_columns: int, max_rows_column: int,
+            resource_pool: str, runtime_cap: str, memory_cap: str, logging_config: Path):
+    """Serve the report of the diff saved in BUNDLE (by `dbdiff diff --save-bundle`) locally,
+    getting the details of each column only when it is opened.
+
+    Diff with --skip-column-details to count the differences of each column without their samples,
+    then the queries of a column run here when it is expanded, and the results of the last --cache-columns
+    columns opened are kept. See dbdiff.explore.DiffExplorer."""
+    initialize_logging(logging_config)
+    loaded = load_bundle(bundle)
+    limits = dict(resource_pool=resource_pool, runtime_cap=runtime_cap, memory_cap=memory_cap)
+    with CursorPool(workers, session=limits) as pool:
+        explorer = DiffExplorer(loaded['all_info'], pool.acquire, max_rows_column=max_rows_column, cache_size=cache_columns)
+        server = ExploreServer((host, port), explorer)
+        LOGGER.info('Serving the report of {0} on http://{1}:{2}/.'.format(loaded['name'], host, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            LOGGER.info('Stopping.')
+        finally:
+            server.server_close()
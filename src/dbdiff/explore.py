@@ -0,0 +1,159 @@
+import html
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import AbstractContextManager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Callable, Dict, Optional, Tuple
+
+import pandas as pd
+
+from dbdiff.main import get_column_details
+from dbdiff.report import (SHARD_DIR_NAME, get_shard_name,
+                           html_column_fragment, html_report_index)
+
+LOGGER = logging.getLogger(__name__)
+# how many columns' details to keep:
+DEFAULT_CACHE_COLUMNS = 32
+
+
+class DetailCache:
+    '''The details of the most recently opened columns (see main.get_column_details), by column.
+    At most `size` columns are kept, the least recently opened is dropped first.'''
+
+    def __init__(self, size: int = DEFAULT_CACHE_COLUMNS):
+        self.size = size
+        self._details: OrderedDict = OrderedDict()
+        # the columns being loaded, set once they are:
+        self._loading: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, column: str, load: Callable[[], Dict[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+        '''The details of `column`, from load() if they are not kept.
+        load() runs outside of the lock, so that other columns can be opened meanwhile,
+        and only once at a time for a column: the others opening it wait for it (and load it themselves if it fails).'''
+        while True:
+            with self._lock:
+                if column in self._details:
+                    self._details.move_to_end(column)
+                    self.hits += 1
+                    return self._details[column]
+                loading = self._loading.get(column)
+                if loading is None:
+                    self.misses += 1
+                    loading = self._loading[column] = threading.Event()
+                    break
+            loading.wait()
+        try:
+            details = load()
+            with self._lock:
+                self._details[column] = details
+                self._details.move_to_end(column)
+                while len(self._details) > self.size:
+                    self._details.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._loading[column]
+            loading.set()
+        return details
+
+
+class DiffExplorer:
+    '''The report of a diff (its all_info, e.g. from a bundle, see dbdiff.bundle), with the details of each column
+    fetched only when it is opened.
+
+    The report page is the index of the sharded HTML report (see report.html_report_index()),
+    and each column's fragment is rendered on request.
+    The columns diffed without their details (skip_column_details) get them by running their stored queries
+    (see main.get_column_details()) on a cursor from `acquire()` (e.g. CursorPool.acquire), kept in a DetailCache.
+    The columns that have their samples already are shown as they are, without a connection.
+    '''
+
+    def __init__(self,
+                 all_info: dict,
+                 acquire: Callable[..., AbstractContextManager],
+                 max_rows_column: int = 10,
+                 cache_size: int = DEFAULT_CACHE_COLUMNS):
+        self.all_info = all_info
+        self.acquire = acquire
+        self.max_rows_column = max_rows_column
+        self.cache = DetailCache(cache_size)
+        self.columns = {get_shard_name(column): column for column in all_info['column_info']}
+        self._index: Optional[str] = None
+
+    def index(self) -> str:
+        if self._index is None:
+            self._index = ''.join(html_report_index(**self.all_info))
+        return self._index
+
+    def fragment(self, name: str) -> Optional[str]:
+        '''The fragment of the column named `name` (see report.get_shard_name()), None if there is no such column.'''
+        if name not in self.columns:
+            return None
+        column = self.columns[name]
+        info = self.all_info['column_info'][column]
+        if 'df' not in info:
+            info = {**info, **self.cache.get(column, lambda: self._load(column, info))}
+        return html_column_fragment(column, info)
+
+    def _load(self, column: str, info: dict) -> Dict[str, pd.DataFrame]:
+        LOGGER.info('Getting the details of column ' + column + '.')
+        with self.acquire() as cur:
+            return get_column_details(cur, info, self.max_rows_column)
+
+
+class ExploreHandler(BaseHTTPRequestHandler):
+    '''Serves the DiffExplorer (set as the `explorer` of the server):
+
+    - GET /: the report page.
+    - GET /columns/<name>.js: the fragment of a column (see report.get_column_shards()), as the page loads it when the column is expanded.
+    '''
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, format: str, *args) -> None:
+        LOGGER.debug(format % args)
+
+    def send_text(self, status: int, content_type: str, text: str) -> None:
+        data = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        explorer: DiffExplorer = self.server.explorer  # type: ignore
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        if parts in ([], ['index.html']):
+            self.send_text(200, 'text/html', explorer.index())
+        elif (len(parts) == 2) and (parts[0] == SHARD_DIR_NAME) and parts[1].endswith('.js'):
+            self.send_fragment(explorer, parts[1][:-len('.js')])
+        else:
+            self.send_text(404, 'text/plain', 'Not found.')
+
+    def send_fragment(self, explorer: DiffExplorer, name: str) -> None:
+        try:
+            fragment = explorer.fragment(name)
+        except Exception as e:
+            LOGGER.exception('Failed to get the details of column {0}.'.format(name))
+            # shown in place of the column's details (the page would not run a script sent with an error status):
+            message = '<p>Failed to get the details of this column: <code class="plaintext">{0}</code></p>'.format(html.escape(str(e)))
+            self.send_text(200, 'application/javascript', 'dbdiffLoadColumn({0}, {1});\n'.format(json.dumps(name), json.dumps(message)))
+            return
+        if fragment is None:
+            self.send_text(404, 'text/plain', 'No column {0}.'.format(name))
+        else:
+            self.send_text(200, 'application/javascript', fragment)
+
+
+class ExploreServer(ThreadingMixIn, HTTPServer):
+    '''Serves `explorer` (see ExploreHandler) on (host, port), each request in its own thread.'''
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], explorer: DiffExplorer):
+        super().__init__(address, ExploreHandler)
+        self.explorer = explorer
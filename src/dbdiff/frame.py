@@ -0,0 +1,183 @@
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import (is_bool_dtype, is_datetime64_any_dtype,
+                              is_numeric_dtype, is_object_dtype)
+
+LOGGER = logging.getLogger(__name__)
+# in place of the schema of the tables, and of the queries, in the reports:
+FRAME_SCHEMA = 'dataframe'
+FRAME_QUERY = '-- compared in memory, see dbdiff.frame.diff_frames()'
+
+
+def to_frame(table: Any) -> pd.DataFrame:
+    '''A pandas DataFrame of `table`, a DataFrame or anything with to_pandas() (e.g. a pyarrow.Table).'''
+    if isinstance(table, pd.DataFrame):
+        return table
+    if hasattr(table, 'to_pandas'):
+        return table.to_pandas()
+    raise RuntimeError('Expected a pandas DataFrame or an Arrow table, got {0}.'.format(type(table)))
+
+
+def get_dtype_group(dtype: Any) -> str:
+    if is_bool_dtype(dtype) or is_numeric_dtype(dtype):
+        return 'numeric'
+    if is_datetime64_any_dtype(dtype):
+        return 'date'
+    if is_object_dtype(dtype):
+        return 'object'
+    return 'string'
+
+
+def frame_dtype_comparison(x_dtype: Any, y_dtype: Any) -> bool:
+    '''Can columns of these dtypes be compared?
+    The pandas take on vertica.implicit_dtype_comparison: numbers (and bools) with numbers,
+    dates with dates, strings with strings, and object columns (which can hold anything) with anything.'''
+    x_group, y_group = get_dtype_group(x_dtype), get_dtype_group(y_dtype)
+    return (x_group == y_group) or ('object' in {x_group, y_group})
+
+
+def get_frame_col_info(x: pd.DataFrame, y: pd.DataFrame, exclude_columns: set) -> pd.DataFrame:
+    '''The column_match_info of two frames, as main.get_all_col_info() (with the stage's uncomparable and identical).'''
+    all_col_info = {}
+    for col in list(x.columns) + [col for col in y.columns if col not in x.columns]:
+        x_dtype = x.dtypes[col] if col in x.columns else None
+        y_dtype = y.dtypes[col] if col in y.columns else None
+        all_col_info[col] = {
+            'x_dtype': None if x_dtype is None else str(x_dtype),
+            'y_dtype': None if y_dtype is None else str(y_dtype),
+            'comparable': (x_dtype is not None) and (y_dtype is not None) and frame_dtype_comparison(x_dtype, y_dtype),
+            'exclude': (col in exclude_columns),
+        }
+    all_col_info_df = pd.DataFrame(all_col_info).transpose()
+    for col in ('comparable', 'exclude'):
+        all_col_info_df[col] = all_col_info_df[col].astype(bool)
+    all_col_info_df['uncomparable'] = (~all_col_info_df.comparable) & (~all_col_info_df.x_dtype.isnull()) & (~all_col_info_df.y_dtype.isnull())
+    all_col_info_df['identical'] = False
+    return all_col_info_df
+
+
+def null_safe_mismatch(x: pd.Series, y: pd.Series) -> np.ndarray:
+    '''Where x and y differ, with nulls equal to each other and to nothing else:
+    the inverse of Vertica's (x <=> y).'''
+    x_null = pd.isna(x).to_numpy()
+    y_null = pd.isna(y).to_numpy()
+    # nullable dtypes compare to <NA> where either side is null, those are settled by the null masks:
+    equal = x.eq(y).fillna(False).to_numpy(dtype=bool)
+    return ~((x_null & y_null) | (~x_null & ~y_null & equal))
+
+
+def select_distinct_frame(df: pd.DataFrame, join_cols: list) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    '''The rows of `df` whose join keys are unique, and the dedup info of the others:
+    the # of rows past one per key (count, as main.check_primary_key()), and main.get_dup_stats().'''
+    duplicated = df.duplicated(subset=join_cols, keep=False).to_numpy()
+    dups = df.loc[duplicated, join_cols]
+    info = {'count': 0}
+    if duplicated.any():
+        group_sizes = dups.groupby(join_cols, dropna=False).size()
+        info = {
+            'count': int(duplicated.sum() - group_sizes.shape[0]),
+            'group_count': int(group_sizes.shape[0]),
+            'row_count': int(duplicated.sum()),
+            'max_dup_count': int(group_sizes.max()),
+        }
+    return df.loc[~duplicated], info
+
+
+def get_unmatched_frame(x: pd.DataFrame, y: pd.DataFrame, join_cols: list, max_rows_column: int) -> Dict[str, Dict[str, Any]]:
+    '''The keys in only one of the frames, as main.get_unmatched_rows_straight().'''
+    keys = x[join_cols].merge(y[join_cols], how='outer', on=join_cols, indicator=True)
+    results = {}
+    for side, only in (('x', 'left_only'), ('y', 'right_only')):
+        unmatched = keys.loc[keys['_merge'] == only, join_cols]
+        results[side] = {
+            'count': int(unmatched.shape[0]),
+            'query': FRAME_QUERY,
+            'sample': unmatched.sort_values(join_cols).head(max_rows_column).reset_index(drop=True)
+        }
+    return results
+
+
+def diff_frames(x: Any, y: Any,
+                join_cols: list,
+                x_name: str = 'x', y_name: str = 'y',
+                exclude_columns: Optional[set] = None,
+                max_rows_all: int = 10,
+                max_rows_column: int = 10) -> Dict[str, Any]:
+    '''Diff two tables that fit in memory, pandas DataFrames or Arrow tables, without the database.
+
+    The same steps as cli.main(), on the frames:
+    rows with duplicate join keys are left out, the rest are joined on the keys (nulls match nulls, as <=>),
+    and each compared column gets a vectorized mismatch mask (see null_safe_mismatch()).
+    Column names are matched as they are (case sensitive), and `x_name` and `y_name` stand in for the table names.
+
+    Returns the info of the diff in the shape of cli.main(), for report.html_report() and report.excel_report().
+    There is no hierarchical join info, and no numeric binning of the differences.
+    '''
+    if exclude_columns is None:
+        exclude_columns = set()
+    x, y = to_frame(x), to_frame(y)
+    timings = {}
+    start = time.monotonic()
+
+    all_col_info_df = get_frame_col_info(x, y, exclude_columns)
+    comparable_filter = all_col_info_df.comparable & ~all_col_info_df.exclude
+    for col in join_cols:
+        if all_col_info_df.loc[comparable_filter & (all_col_info_df.index == col), :].shape[0] == 0:
+            raise RuntimeError('Column `{0}` not in comparable columns (missing from one, both, or bad dtype).'.format(col))
+    columns = [col for col in all_col_info_df.loc[comparable_filter].index if col not in join_cols]
+
+    x_dedup, x_dedup_info = select_distinct_frame(x, join_cols)
+    y_dedup, y_dedup_info = select_distinct_frame(y, join_cols)
+    timings['dedup'], start = time.monotonic() - start, time.monotonic()
+
+    missing_join_info = get_unmatched_frame(x_dedup, y_dedup, join_cols, max_rows_column)
+    joined = x_dedup[join_cols + columns].rename(columns={col: 'x_' + col for col in columns}).merge(
+        y_dedup[join_cols + columns].rename(columns={col: 'y_' + col for col in columns}),
+        how='inner', on=join_cols
+    )
+    # one column per compared column, True where the cells differ:
+    masks = np.column_stack([null_safe_mismatch(joined['x_' + col], joined['y_' + col]) for col in columns]) if columns else np.zeros((joined.shape[0], 0), dtype=bool)
+    timings['joined'], start = time.monotonic() - start, time.monotonic()
+
+    column_info = {}
+    for i in np.argsort(-masks.sum(axis=0), kind='stable'):
+        col, mask = columns[i], masks[:, i]
+        if not mask.any():
+            continue
+        pairs = joined.loc[mask, ['x_' + col, 'y_' + col]]
+        df = pairs.groupby(['x_' + col, 'y_' + col], dropna=False).size().rename('ct').reset_index()
+        column_info[col] = {
+            'count': int(mask.sum()),
+            'df': df.sort_values('ct', ascending=False, kind='stable').head(max_rows_column).reset_index(drop=True),
+            'df_raw': joined.loc[mask, join_cols + ['x_' + col, 'y_' + col]].sort_values(join_cols).head(max_rows_column).reset_index(drop=True),
+            'q': FRAME_QUERY,
+            'q_raw': FRAME_QUERY,
+        }
+    row_mask = masks.any(axis=1)
+    timings['column_diffs'] = time.monotonic() - start
+    LOGGER.info('Compared {0} joined rows on {1} columns in memory, {2} rows have differences.'.format(joined.shape[0], len(columns), row_mask.sum()))
+
+    return {
+        'x_schema': FRAME_SCHEMA,
+        'y_schema': FRAME_SCHEMA,
+        'x_table': x_name,
+        'y_table': y_name,
+        'join_cols': join_cols,
+        'total_row_count': int(joined.shape[0]),
+        'column_info': column_info,
+        'column_match_info': all_col_info_df,
+        'missing_join_info': missing_join_info,
+        'hierarchical_join_info': {},
+        'dedup_info': {x_name: x_dedup_info, y_name: y_dedup_info},
+        'diff_summary': {
+            'query': FRAME_QUERY,
+            'sample': joined.loc[row_mask].head(max_rows_all).reset_index(drop=True),
+            'count': int(row_mask.sum()),
+            'total_count': int(masks.sum())
+        },
+        'stage_timings': timings,
+    }
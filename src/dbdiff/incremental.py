@@ -0,0 +1,283 @@
+import hashlib
+import json
+import logging
+import pickle
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+from jinja2 import Environment, PackageLoader
+from vertica_python.vertica.cursor import Cursor
+
+from dbdiff.store import close_columns, keep_columns
+from dbdiff.vertica import get_column_info_lookup
+
+JINJA_ENV = Environment(loader=PackageLoader('dbdiff', 'templates'))
+LOGGER = logging.getLogger(__name__)
+DEFAULT_STATE_DIR = Path('.dbdiff_state')
+# JSON and pickle can't key on None, so NULL partitions are stored under this:
+NULL_PARTITION = '<NULL>'
+
+
+def get_fingerprints(cur: Cursor, schema: str, table: str,
+                     partition_col: Optional[str] = None,
+                     columns: Optional[List[str]] = None,
+                     key_cols: Optional[List[str]] = None) -> Dict[str, dict]:
+    '''Row count and an order independent hash of the `columns` (default: all) of a table,
+    for each value of `partition_col` (keyed by the value as a string),
+    or for the whole table (keyed by '') if no partition column is given.
+    With `key_cols`, also an order independent hash of just those columns (key_hash).'''
+    if columns is None:
+        columns = list(get_column_info_lookup(cur, schema, table).keys())
+    q = JINJA_ENV.get_template('table_fingerprint.sql').render(
+        schema_name=schema,
+        table_name=table,
+        columns=columns,
+        partition_col=partition_col,
+        key_cols=key_cols
+    )
+    LOGGER.info(q)
+    cur.execute(q)
+    fingerprints = {}
+    for row in cur.fetchall():
+        value = row.get('partition_value', '')
+        key = NULL_PARTITION if value is None else str(value)
+        fingerprints[key] = {k: v for k, v in row.items() if k != 'partition_value'}
+    return fingerprints
+
+
+def get_state_path(state_dir: Path, x_schema: str, x_table: str, y_schema: str, y_table: str) -> Path:
+    return Path(state_dir) / '{0}.{1}__{2}.{3}.pkl'.format(x_schema, x_table, y_schema, y_table).lower()
+
+
+def get_columns_path(state_path: Path, partition: str) -> Path:
+    '''Where the column_info of a partition kept on disk (see dbdiff.store.ColumnStore) is copied, next to the state.'''
+    return state_path.with_name('{0}__{1}.sqlite'.format(state_path.stem, hashlib.sha256(partition.encode()).hexdigest()[:16]))
+
+
+def get_options_key(options: dict) -> str:
+    '''A stored partition result is only reused if the diff options are the same.
+    The connection pool, the stage timeout, the progress reporting, and where the column samples are kept,
+    if any, don't change the results.'''
+    def default(value):
+        return sorted(value) if isinstance(value, (set, frozenset)) else str(value)
+    options = {k: v for k, v in options.items() if k not in {'pool', 'stage_timeout', 'progress', 'telemetry_interval', 'spill_dir'}}
+    return hashlib.sha256(json.dumps(options, sort_keys=True, default=default).encode()).hexdigest()
+
+
+def read_state(path: Path, options_key: str) -> Dict[str, dict]:
+    if not path.exists():
+        return {}
+    with path.open('rb') as f:
+        state = pickle.load(f)
+    if state['options_key'] != options_key:
+        LOGGER.info('Diff options changed since the last incremental run, rediffing every partition.')
+        return {}
+    return state['partitions']
+
+
+def write_state(path: Path, options_key: str, partitions: Dict[str, dict]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with tmp_path.open('wb') as f:
+        pickle.dump({'options_key': options_key, 'partitions': partitions}, f)
+    tmp_path.replace(path)
+
+
+def merge_frames(frames: List[pd.DataFrame], max_rows: int) -> pd.DataFrame:
+    frames = [df for df in frames if df.shape[0] > 0]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).head(max_rows)
+
+
+def merge_column_info(infos: List[dict], max_rows_column: int) -> dict:
+    '''Merge the per column results of several partitions:
+    the counts are added, the grouped pairs are regrouped, and the samples are concatenated.'''
+    merged: Dict[str, Any] = {'count': sum(info['count'] for info in infos)}
+    for key in infos[-1].keys():
+        values = [info[key] for info in infos if key in info]
+        if key == 'count':
+            continue
+        elif key == 'df':
+            frames = [df for df in values if df.shape[0] > 0]
+            if frames:
+                df = pd.concat(frames, ignore_index=True)
+                pair_cols = [col for col in df.columns if col != 'ct']
+                merged[key] = (df.groupby(pair_cols, dropna=False, as_index=False)['ct'].sum()
+                               .sort_values('ct', ascending=False)
+                               .head(max_rows_column))
+            else:
+                merged[key] = pd.DataFrame()
+        elif key == 'df_n_sample':
+            df = merge_frames(values, len(values) * max_rows_column)
+            if 'abs_diff' in df.columns:
+                df = df.sort_values('abs_diff', ascending=False)
+            merged[key] = df.head(max_rows_column)
+        elif isinstance(values[-1], pd.DataFrame):
+            merged[key] = merge_frames(values, max_rows_column)
+        else:
+            # the queries, from the most recent partition with differences in this column:
+            merged[key] = values[-1]
+    return merged
+
+
+def merge_dedup_info(infos: List[dict]) -> dict:
+    # keys never span partitions, so the duplicate groups of each partition are distinct:
+    merged = {'count': sum(info['count'] for info in infos)}
+    stats = [info for info in infos if info.get('group_count')]
+    if stats:
+        merged['group_count'] = sum(info['group_count'] for info in stats)
+        merged['row_count'] = sum(info['row_count'] for info in stats)
+        merged['max_dup_count'] = max(info['max_dup_count'] for info in stats)
+    return merged
+
+
+def merge_all_info(partition_infos: List[dict],
+                   x_schema: str, x_table: str,
+                   y_schema: str, y_table: str,
+                   max_rows_all: int, max_rows_column: int) -> dict:
+    '''Combine the all_info of the diffs of each partition into one for the whole tables.'''
+    missing_join_info = {}
+    for side in ('x', 'y'):
+        missing_join_info[side] = {
+            'count': sum(info['missing_join_info'][side]['count'] for info in partition_infos),
+            'query': '-- merged from {0} partition(s), see the diff of each partition.'.format(len(partition_infos)),
+            'sample': merge_frames([info['missing_join_info'][side]['sample'] for info in partition_infos], max_rows_column),
+        }
+
+    diff_summary = {
+        'total_count': sum(info['diff_summary']['total_count'] for info in partition_infos),
+        'count': sum(info['diff_summary'].get('count', 0) for info in partition_infos),
+        'sample': merge_frames([info['diff_summary']['sample'] for info in partition_infos if isinstance(info['diff_summary'].get('sample'), pd.DataFrame)], max_rows_all),
+    }
+
+    columns: Dict[str, List[dict]] = {}
+    for info in partition_infos:
+        for column, column_info in info['column_info'].items():
+            columns.setdefault(column, []).append(column_info)
+    column_info = {column: merge_column_info(infos, max_rows_column) for column, infos in columns.items()}
+
+    return {
+        'x_schema': x_schema,
+        'y_schema': y_schema,
+        'x_table': x_table,
+        'y_table': y_table,
+        'join_cols': partition_infos[-1]['join_cols'],
+        'total_row_count': sum(info['total_row_count'] for info in partition_infos),
+        'column_info': {column: column_info[column] for column in sorted(column_info, key=lambda c: column_info[c]['count'], reverse=True)},
+        'column_match_info': partition_infos[-1]['column_match_info'],
+        'missing_join_info': missing_join_info,
+        'hierarchical_join_info': {},
+        # the x and y tables (by position, the names are those of each partition's tables):
+        'dedup_info': {
+            table: merge_dedup_info([list(info['dedup_info'].values())[i] for info in partition_infos])
+            for i, table in enumerate((x_table, y_table))
+        },
+        'diff_summary': diff_summary,
+    }
+
+
+def diff_incremental(cur: Cursor,
+                     run_diff: Callable[..., dict],
+                     x_schema: str, x_table: str,
+                     y_schema: str, y_table: str,
+                     join_cols: list,
+                     partition_col: str,
+                     state_dir: Path = DEFAULT_STATE_DIR,
+                     **options) -> dict:
+    '''Diff two partitioned tables, only rediffing the partitions that changed since the last run.
+
+    The row count and aggregate hash of each partition of each table are compared
+    to those stored (in `state_dir`) by the last run with the same options.
+    Each partition that changed on either side is copied into local temp tables
+    and diffed on its own with run_diff(cur=cur, x_schema=..., ..., **options) (i.e. cli.main).
+    The stored results of the other partitions are reused,
+    and the results of all partitions are merged into one all_info.
+    A column_info kept on disk (with spill_dir) is copied next to the state (see get_columns_path()),
+    and the copy is removed once its partition is rediffed or gone.
+    '''
+    if options.get('hierarchical_join'):
+        raise RuntimeError('The hierarchical join analysis is not supported by the incremental diff.')
+    if options.get('profile') or options.get('profile_only'):
+        raise RuntimeError('The column profiles are not supported by the incremental diff.')
+    options_key = get_options_key({'join_cols': join_cols, 'partition_col': partition_col, **options})
+    state_path = get_state_path(state_dir, x_schema, x_table, y_schema, y_table)
+    stored = read_state(state_path, options_key)
+
+    LOGGER.info('Getting partition fingerprints.')
+    fingerprints = {
+        'x': get_fingerprints(cur, x_schema, x_table, partition_col),
+        'y': get_fingerprints(cur, y_schema, y_table, partition_col),
+    }
+    partitions = sorted(set(fingerprints['x'].keys()) | set(fingerprints['y'].keys()))
+    if not partitions:
+        raise RuntimeError('Both tables are empty, there are no partitions to diff.')
+    # partitions no longer in either table are dropped from the state:
+    state = {p: stored[p] for p in partitions if p in stored}
+    changed = [
+        p for p in partitions
+        if (p not in state) or any(state[p][side] != fingerprints[side].get(p) for side in ('x', 'y'))
+    ]
+    LOGGER.info('{0} of {1} partition(s) changed since the last run: {2}'.format(len(changed), len(partitions), ', '.join(changed)))
+
+    for partition in changed:
+        LOGGER.info('Diffing partition ' + partition_col + ' = ' + partition + '.')
+        tables = {}
+        for side, schema, table in (('x', x_schema, x_table), ('y', y_schema, y_table)):
+            tables[side] = table + '_incr_' + side
+            cur.execute(JINJA_ENV.get_template('table_drop.sql').render(schema_name='v_temp_schema', table_name=tables[side]))
+            q = JINJA_ENV.get_template('create_temp_table.sql').render(
+                table_name=tables[side],
+                query=JINJA_ENV.get_template('partition_rows.sql').render(
+                    schema_name=schema,
+                    table_name=table,
+                    partition_col=partition_col,
+                    partition_value=(None if partition == NULL_PARTITION else partition)
+                )
+            )
+            LOGGER.info(q)
+            cur.execute(q)
+        all_info = run_diff(
+            cur=cur,
+            x_schema='v_temp_schema',
+            x_table=tables['x'],
+            y_schema='v_temp_schema',
+            y_table=tables['y'],
+            join_cols=join_cols,
+            **options
+        )
+        # the store of the run is removed once closed, so the state keeps a copy in place of the last one:
+        if partition in state:
+            close_columns(state[partition]['all_info']['column_info'])
+        columns_path = get_columns_path(state_path, partition)
+        if columns_path.exists():
+            columns_path.unlink()
+        columns_path.parent.mkdir(parents=True, exist_ok=True)
+        column_info = keep_columns(all_info['column_info'], columns_path)
+        if column_info is not all_info['column_info']:
+            close_columns(all_info['column_info'])
+        state[partition] = {side: fingerprints[side].get(partition) for side in ('x', 'y')}
+        state[partition]['all_info'] = {**all_info, 'column_info': column_info}
+        # save as we go, so that an interrupted run keeps the partitions it finished:
+        write_state(state_path, options_key, state)
+    write_state(state_path, options_key, state)
+    # the copies of the partitions that are gone, or were diffed with other options:
+    for p in set(stored) - set(state):
+        close_columns(stored[p]['all_info']['column_info'])
+    columns_paths = {get_columns_path(state_path, p) for p in state}
+    for path in state_path.parent.glob(state_path.stem + '__*.sqlite'):
+        if path not in columns_paths:
+            path.unlink()
+
+    # oldest partitions first, so that "most recent" samples and queries come from changed partitions:
+    ordered = [p for p in partitions if p not in changed] + changed
+    merged = merge_all_info(
+        [state[p]['all_info'] for p in ordered],
+        x_schema, x_table, y_schema, y_table,
+        options.get('max_rows_all', 10), options.get('max_rows_column', 10)
+    )
+    merged['incremental_info'] = {'partition_col': partition_col, 'partitions': partitions, 'rediffed': changed}
+    for p in partitions:
+        close_columns(state[p]['all_info']['column_info'])
+    return merged
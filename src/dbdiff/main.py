@@ -1,16 +1,33 @@
 import logging
 import logging.config
 from pathlib import Path
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, MutableMapping, Optional, Sequence, Tuple
 
 import pandas as pd
 from jinja2 import Environment, PackageLoader
 from vertica_python.vertica.cursor import Cursor
 
+from dbdiff.store import get_column_counts
 from dbdiff.vertica import get_column_info_lookup, implicit_dtype_comparison
 
 JINJA_ENV = Environment(loader=PackageLoader('dbdiff', 'templates'))
 LOGGER = logging.getLogger(__name__)
+# how the rows of each sample are picked (see templates/sample_order.sql):
+# - first: whichever rows come first, without sorting the rows it picks them from.
+# - hash: the rows with the lowest hash of the join keys, the same ones on every run.
+# - ordered: the rows with the lowest join keys, sorting all of the rows they're picked from.
+SAMPLE_METHODS = ('first', 'hash', 'ordered')
+DEFAULT_SAMPLE = 'first'
+# the queries of the details of a column (see get_column_diffs_from_joined), the sample each one gets,
+# and whether it needs a LIMIT (the hierarchical samples are rendered limited, the binned differences are at most 10 rows):
+COLUMN_DETAIL_QUERIES = {
+    'q': ('df', True),
+    'q_raw': ('df_raw', True),
+    'q_h_x_sample': ('df_h_x', False),
+    'q_h_y_sample': ('df_h_y', False),
+    'q_n': ('df_n', False),
+    'q_n_sample': ('df_n_sample', True),
+}
 
 
 def is_numeric_like(dtype: str):
@@ -28,13 +45,21 @@ def check_primary_key(cur: Cursor,
                       join_cols: list) -> int:
     '''Given a list of columns return the # of records for which they are NOT
     a primary key.'''
+    return get_primary_key_info(cur, schema, table, join_cols)['count']
 
-    cur.execute(JINJA_ENV.get_template('table_rows.sql').render(schema_name=schema, table_name=table))
+
+def get_primary_key_info(cur: Cursor,
+                         schema: str, table: str,
+                         join_cols: list) -> Dict[str, Any]:
+    '''As check_primary_key(), the # of records for which the join columns are NOT a primary key under `count`,
+    and the # of NULLs in each join column under `key_nulls`, counted along with the rows.'''
+    cur.execute(JINJA_ENV.get_template('table_rows.sql').render(schema_name=schema, table_name=table, null_cols=join_cols))
     r = cur.fetchall()
     n_rows = r[0]['COUNT']
+    key_nulls = {col: r[0]['null_{0}'.format(i)] for i, col in enumerate(join_cols)}
     cur.execute(JINJA_ENV.get_template('table_rows_uniq.sql').render(schema_name=schema, table_name=table, join_cols=', '.join(join_cols)))
     n_distinct_rows = cur.fetchall()[0]['COUNT']
-    return n_rows - n_distinct_rows
+    return {'count': n_rows - n_distinct_rows, 'key_nulls': key_nulls}
 
 
 def get_all_col_info(cur: Cursor, schema, x_table, y_schema, y_table, exclude_columns_set, save_column_summary, save_column_summary_format) -> pd.DataFrame:
@@ -74,6 +99,43 @@ def get_all_col_info(cur: Cursor, schema, x_table, y_schema, y_table, exclude_co
     return all_col_info_df
 
 
+def get_identical_columns(cur: Cursor,
+                          x_schema: str, x_table: str,
+                          y_schema: str, y_table: str,
+                          join_cols: list,
+                          columns: list) -> set:
+    '''Find the columns that are the same in both tables without joining them.
+
+    In one scan of each table, get the row count, a checksum of the join keys,
+    and for each column a checksum of (join keys, column) and its non null count.
+    If the row counts and key checksums match (so, with unique keys, the same rows join),
+    the columns whose checksum and non null count also match are identical.
+    The checksums are of the values as stored, so only pass columns with the same dtype in both tables.
+    '''
+    if len(columns) == 0:
+        return set()
+    checksums = {}
+    for side, schema, table in (('x', x_schema, x_table), ('y', y_schema, y_table)):
+        q = JINJA_ENV.get_template('column_checksums.sql').render(
+            schema_name=schema,
+            table_name=table,
+            join_cols=join_cols,
+            columns=columns
+        )
+        LOGGER.info(q)
+        cur.execute(q)
+        checksums[side] = cur.fetchall()[0]
+    if any(checksums['x'][k] != checksums['y'][k] for k in ('row_count', 'key_hash')):
+        LOGGER.info('The tables have different rows or join keys, not checking columns by checksum.')
+        return set()
+    identical = {
+        column for i, column in enumerate(columns, start=1)
+        if all(checksums['x'][k + str(i)] == checksums['y'][k + str(i)] for k in ('hash_', 'count_'))
+    }
+    LOGGER.info('{0} of {1} column(s) are identical by checksum.'.format(len(identical), len(columns)))
+    return identical
+
+
 def select_distinct_rows(cur: Cursor,
                          schema: str, table: str,
                          join_cols: list,
@@ -83,49 +145,150 @@ def select_distinct_rows(cur: Cursor,
     new table, and return the name of that new table.
     Delete is inefficient, see: https://www.vertica.com/docs/9.2.x/HTML/Content/Authoring/AnalyzingData/Optimizations/PerformanceConsiderationsForDELETEAndUPDATEQueries.htm
     And: https://www.vertica.com/blog/another-way-to-de-duplicate-table-rows-quick-tip/
+    The rows with duplicates go into [table]_dup, with their # of duplicates in dup_count.
+    The table is read (and sorted by join_cols) once, into a local temp table [table]_dup_count
+    with COUNT(*) OVER (PARTITION BY join_cols), rather than joined to the grouped table,
+    and both are then split from it, before it is dropped.
     '''
-    drop_q = JINJA_ENV.get_template('table_drop.sql').render(schema_name=schema, table_name=(table + '_dedup'))
-    LOGGER.info(drop_q)
-    cur.execute(drop_q)
-    q = JINJA_ENV.get_template('create_dedup.sql').render(
-        schema_name=schema, table_name=table,
-        table_name_dedup=(table + '_dedup'),
-        group_cols=', '.join(join_cols),
-        join_cols=' AND '.join(['x.{0} <=> y.{0}'.format(col) for col in join_cols]),
-        use_temp_table=use_temp_tables
+    columns = list(get_column_info_lookup(cur, schema, table).keys())
+    for suffix in ('_dedup', '_dup'):
+        drop_q = JINJA_ENV.get_template('table_drop.sql').render(schema_name=schema, table_name=(table + suffix))
+        LOGGER.info(drop_q)
+        cur.execute(drop_q)
+    drop_count_q = JINJA_ENV.get_template('table_drop.sql').render(schema_name='v_temp_schema', table_name=(table + '_dup_count'))
+    LOGGER.info(drop_count_q)
+    cur.execute(drop_count_q)
+    q = JINJA_ENV.get_template('create_temp_table.sql').render(
+        table_name=(table + '_dup_count'),
+        query=JINJA_ENV.get_template('create_dup_count.sql').render(schema_name=schema, table_name=table, group_cols=', '.join(join_cols))
     )
-    if use_temp_tables:
-        q = JINJA_ENV.get_template('create_temp_table.sql').render(table_name=(table + '_dedup'), query=q)
     LOGGER.info(q)
     cur.execute(q)
+    for suffix, template in (('_dedup', 'create_dedup.sql'), ('_dup', 'create_dup.sql')):
+        q = JINJA_ENV.get_template(template).render(
+            schema_name=schema,
+            table_name_dedup=(table + '_dedup'),
+            table_name_dup=(table + '_dup'),
+            table_name_dup_count=(table + '_dup_count'),
+            columns=columns,
+            use_temp_table=use_temp_tables
+        )
+        if use_temp_tables:
+            q = JINJA_ENV.get_template('create_temp_table.sql').render(table_name=(table + suffix), query=q)
+        LOGGER.info(q)
+        cur.execute(q)
+    LOGGER.info(drop_count_q)
+    cur.execute(drop_count_q)
     LOGGER.info('COMMIT;')
     cur.execute('COMMIT;')
-    drop_q = JINJA_ENV.get_template('table_drop.sql').render(schema_name=schema, table_name=(table + '_dup'))
-    LOGGER.info(drop_q)
-    cur.execute(drop_q)
-    q = JINJA_ENV.get_template('create_dup.sql').render(
-        schema_name=schema, table_name=table,
-        table_name_dup=(table + '_dup'),
-        group_cols=', '.join(join_cols),
-        join_cols=' AND '.join(['x.{0} <=> y.{0}'.format(col) for col in join_cols]),
-        use_temp_table=use_temp_tables
+
+    return (schema, 'v_temp_schema')[use_temp_tables], '{table}_dedup'.format(table=table)
+
+
+def get_column_profile(cur: Cursor,
+                       schema: str, table: str,
+                       columns: Dict[str, str],
+                       top_values: int = 5) -> pd.DataFrame:
+    '''Profile the distribution of each of `columns` (name: dtype), without a join.
+
+    Returns a dataframe indexed by column name with the row_count, null_count, null_rate,
+    min, max (as strings), distinct_estimate (from APPROXIMATE_COUNT_DISTINCT), mean (numeric columns only),
+    and the `top_values` most frequent values with their counts (e.g. "a (10), b (4)").
+    The statistics of all the columns come from one scan,
+    and the top values of all the columns from one more (with GROUPING SETS), if top_values > 0.
+    '''
+    names = list(columns.keys())
+    q = JINJA_ENV.get_template('column_profile.sql').render(
+        schema_name=schema,
+        table_name=table,
+        columns=[(col, is_numeric_like(dtype)) for col, dtype in columns.items()]
     )
-    if use_temp_tables:
-        q = JINJA_ENV.get_template('create_temp_table.sql').render(table_name=(table + '_dup'), query=q)
     LOGGER.info(q)
     cur.execute(q)
-    LOGGER.info('COMMIT;')
-    cur.execute('COMMIT;')
-
-    return (schema, 'v_temp_schema')[use_temp_tables], '{table}_dedup'.format(table=table)
+    r = cur.fetchall()[0]
+    profile = {}
+    for i, col in enumerate(names):
+        null_count = r['row_count'] - r['count_{0}'.format(i)]
+        profile[col] = {
+            'row_count': r['row_count'],
+            'null_count': null_count,
+            'null_rate': (null_count / r['row_count']) if r['row_count'] else None,
+            'min': None if r['min_{0}'.format(i)] is None else str(r['min_{0}'.format(i)]),
+            'max': None if r['max_{0}'.format(i)] is None else str(r['max_{0}'.format(i)]),
+            'distinct_estimate': r['distinct_{0}'.format(i)],
+            'mean': None if r.get('mean_{0}'.format(i)) is None else float(r['mean_{0}'.format(i)]),
+            'top_values': None,
+        }
+    if top_values > 0 and names:
+        q = JINJA_ENV.get_template('column_top_values.sql').render(schema_name=schema, table_name=table, columns=names, limit=top_values)
+        LOGGER.info(q)
+        cur.execute(q)
+        values: Dict[str, List[str]] = {col: [] for col in names}
+        for row in cur.fetchall():
+            values[names[row['column_index']]].append('{0} ({1:,})'.format('NULL' if row['value'] is None else row['value'], row['ct']))
+        for col in names:
+            profile[col]['top_values'] = ', '.join(values[col])
+    return pd.DataFrame.from_dict(profile, orient='index')
+
+
+def get_profile_drift(x_profile: pd.DataFrame, y_profile: pd.DataFrame, distinct_tolerance: float = 0.05) -> pd.DataFrame:
+    '''Put the profiles of the columns in both tables (see get_column_profile) side by side, x_ and y_ prefixed,
+    with `drift`: the statistics that differ between the two, if any.
+    The distinct estimates are approximate, so they only differ past `distinct_tolerance` (relative).'''
+    columns = [col for col in x_profile.index if col in y_profile.index]
+    stats = ['null_rate', 'min', 'max', 'distinct_estimate', 'mean', 'top_values']
+    df = pd.DataFrame(index=pd.Index(columns, name='column'))
+    for stat in stats:
+        df['x_' + stat] = x_profile.loc[columns, stat]
+        df['y_' + stat] = y_profile.loc[columns, stat]
+
+    def drift(row: pd.Series) -> str:
+        changed = []
+        for stat in stats:
+            x, y = row['x_' + stat], row['y_' + stat]
+            if pd.isna(x) and pd.isna(y):
+                continue
+            if stat == 'distinct_estimate' and not (pd.isna(x) or pd.isna(y)):
+                if abs(x - y) > distinct_tolerance * max(x, y):
+                    changed.append(stat)
+            elif pd.isna(x) or pd.isna(y) or (x != y):
+                changed.append(stat)
+        return ', '.join(changed)
+
+    df['drift'] = df.apply(drift, axis=1) if columns else pd.Series(dtype=str)
+    return df.reset_index()
+
+
+def get_dup_stats(cur: Cursor,
+                  schema: str, table: str,
+                  join_cols: list) -> Dict[str, int]:
+    '''Summarize the duplicates that select_distinct_rows() put in [table]_dup:
+    the # of join keys with duplicates (group_count), the # of rows with those keys (row_count),
+    and the most rows with one key (max_dup_count).'''
+    q = JINJA_ENV.get_template('dup_stats.sql').render(
+        schema_name=schema,
+        table_name=(table + '_dup'),
+        group_cols=', '.join(join_cols)
+    )
+    LOGGER.info(q)
+    cur.execute(q)
+    return cur.fetchall()[0]
 
 
 def create_joined_table(cur: Cursor, create_insert=False, **kwargs):
     """
     Joins two tables x and y.
+    The join keys in kwargs['not_null_keys'] (if any) are joined with =, the others with <=>.
+    With kwargs['hash_keys'], the tables are joined on the hash of the join keys of the same dtype on both sides
+    (see get_hash_keys()), and the keys are compared only on the rows whose hashes match.
+    The joined table then also has that hash, as join_hash, and is sorted and segmented by it,
+    which takes CREATE TABLE and then INSERT INTO.
     :param cur: vertica python Cursor
     :return: list - all queries run.
     """
+    if kwargs.get('hash_keys'):
+        create_insert = True
+        kwargs['hash_cols'] = get_hash_keys(kwargs['compare_cols'], kwargs['join_cols'])
     drop_q = JINJA_ENV.get_template('table_drop.sql').render(
         schema_name=kwargs['joined_schema'],
         table_name=kwargs['joined_table'])
@@ -160,6 +323,29 @@ def create_joined_table(cur: Cursor, create_insert=False, **kwargs):
     return joined_row_count
 
 
+def get_hash_keys(all_col_info_df: pd.DataFrame, join_cols: list) -> List[str]:
+    '''The join keys that are hashed to join on (see create_joined_table()): those of the same dtype on both sides,
+    as the hashes of equal values of different dtypes (e.g. 1 and 1.0) differ. The other keys are only compared.'''
+    keys = all_col_info_df.loc[all_col_info_df.index.isin(join_cols), :]
+    hash_keys = [col for col in join_cols if col in keys.index and keys.loc[col, 'x_dtype'].lower() == keys.loc[col, 'y_dtype'].lower()]
+    if not hash_keys:
+        raise RuntimeError('None of the join keys have the same dtype on both sides, so there are none to hash (hash_keys).')
+    return hash_keys
+
+
+def get_joined_shards(columns: list, shard_width: int, joined_table: str) -> Dict[str, List[str]]:
+    '''Split the columns to compare into joined tables of at most `shard_width` columns each
+    (each also has the join keys), named `joined_table`_1, _2, etc.
+    Returns the columns in each joined table, by table name.
+    With no `shard_width` (0), or if they fit in one, all columns go into `joined_table`.'''
+    if (not shard_width) or (len(columns) <= shard_width):
+        return {joined_table: list(columns)}
+    return {
+        joined_table + '_' + str(i // shard_width + 1): list(columns[i:(i + shard_width)])
+        for i in range(0, len(columns), shard_width)
+    }
+
+
 def get_unmatched_rows_straight(
     cur: Cursor,
     x_schema: str,
@@ -167,10 +353,18 @@ def get_unmatched_rows_straight(
     x_table: str,
     y_table: str,
     join_cols: list,
-    max_rows_column: int
+    max_rows_column: int,
+    not_null_keys: Optional[list] = None,
+    sample: str = DEFAULT_SAMPLE,
+    hash_keys: bool = False,
+    hash_cols: Optional[list] = None
 ) -> Dict[str, Dict[str, Any]]:
     '''
     Get rows that don't match on a join using all of the keys ("straight").
+    The keys in `not_null_keys` (no NULLs in either table) are joined with =, the others with <=>.
+    With `hash_keys`, the join is on the hash of the `hash_cols` of the keys first, by default all of them
+    (see create_joined_table() and get_hash_keys()).
+    The samples are picked by the `sample` method (see SAMPLE_METHODS).
     '''
     all_keys_count = JINJA_ENV.get_template('all_keys_count.sql')
     all_keys_sample = JINJA_ENV.get_template('all_keys_sample.sql')
@@ -186,7 +380,11 @@ def get_unmatched_rows_straight(
             'y_table': y_table,
             'join_cols': join_cols,
             'x': (side == 'x'),
-            'max_rows_column': max_rows_column
+            'max_rows_column': max_rows_column,
+            'not_null_keys': not_null_keys or [],
+            'sample': sample,
+            'hash_keys': hash_keys,
+            'hash_cols': hash_cols or join_cols
         }
         q = all_keys_count.render(d)
         cur.execute(q)
@@ -206,13 +404,17 @@ def get_unmatched_rows(
     x_table: str,
     y_table: str,
     join_cols: list,
-    max_rows_column: int
+    max_rows_column: int,
+    not_null_keys: Optional[list] = None,
+    sample: str = DEFAULT_SAMPLE
 ) -> Dict[Any, Dict[str, Dict[str, Any]]]:
     '''
     Pull out rows that are unmatched between the two tables on the join columns.
     If looking at this hierarchically, we consider the join by
     key a, then key a+b (where a matched), then key a+b+c (where a+b matched), etc
     to see at what level we're missing things.
+    The keys after the first in `not_null_keys` (no NULLs in either table) are joined with =, the others with <=>.
+    The samples are picked by the `sample` method (see SAMPLE_METHODS).
     '''
     results = {col: {'x': {'count': 0, 'query': 'select ...', 'sample': pd.DataFrame()},
                      'y': {'count': 0, 'query': 'select ...', 'sample': pd.DataFrame()}} for col in join_cols}
@@ -232,7 +434,8 @@ def get_unmatched_rows(
             'y_table': y_table,
             'join_col': join_cols[0],
             'x': (side == 'x'),
-            'max_rows_column': max_rows_column
+            'max_rows_column': max_rows_column,
+            'sample': sample
         }
         q = first_key_count.render(d)
         cur.execute(q)
@@ -254,7 +457,9 @@ def get_unmatched_rows(
                 'y_table': y_table,
                 'join_cols': join_cols[:(i + 1)],
                 'x': (side == 'x'),
-                'max_rows_column': max_rows_column
+                'max_rows_column': max_rows_column,
+                'not_null_keys': not_null_keys or [],
+                'sample': sample
             }
             q = sub_keys_count.render(d)
             cur.execute(q)
@@ -295,7 +500,8 @@ def get_diff_rows(cur: Cursor,
                   x_table: str,
                   join_cols: list,
                   max_rows_all: int,
-                  skip_row_total: bool = False) -> dict:
+                  skip_row_total: bool = False,
+                  hash_keys: bool = False) -> dict:
     LOGGER.debug("Getting diff rows")
     # first get the count
     q = JINJA_ENV.get_template('table_rows.sql').render(
@@ -324,25 +530,37 @@ def get_diff_rows(cur: Cursor,
     LOGGER.info(q)
     cur.execute(q + ' LIMIT ' + str(max_rows_all))
     diff_rows = pd.DataFrame(cur.fetchall())
+    if hash_keys:
+        diff_rows = diff_rows.drop(columns=['join_hash'], errors='ignore')
 
     return {'query': q, 'sample': diff_rows,
             'count': diff_row_count, 'total_count': diff_total_count}
 
 
 def get_diff_rows_from_joined(cur: Cursor,
-                              grouped_column_diffs: dict,
+                              grouped_column_diffs: MutableMapping,
                               output_schema: str,
                               x_table: str,
                               join_cols: list,
                               max_rows_all: int,
-                              skip_row_total: bool = False) -> dict:
+                              skip_row_total: bool = False,
+                              joined_shards: Optional[Dict[str, List[str]]] = None,
+                              not_null_keys: Optional[list] = None,
+                              sample: str = DEFAULT_SAMPLE,
+                              hash_keys: bool = False) -> dict:
     '''Get diff rows from joined table.
 
     Non self-explanatory argument specifics:
 
-    - grouped_column_diffs:
+    - grouped_column_diffs: the result of get_column_diffs_from_joined (only its counts are read).
+    - joined_shards: the columns in each joined table, if they were split over several (see get_joined_shards).
+      The sample then has the join keys and the x/y values of the columns with differences only.
+    - not_null_keys: the join keys without NULLs, joined with = rather than <=> across the shards.
     - max_rows_all: number of rows to get for the sample (only relevant if skip_row_total=F)
     - skip_row_total: skip sample of rows with differences, query to get that sample, and the total # of rows with > 0 differences. Return only 'total_count', the sum of cell-by-cell differences.
+    - sample: how the sample rows are picked (see SAMPLE_METHODS).
+    - hash_keys: the joined tables have the hash of the join keys (see create_joined_table()), to join the shards on.
+      It's left out of the sample.
 
     Returned data specifics:
 
@@ -354,7 +572,8 @@ def get_diff_rows_from_joined(cur: Cursor,
     '''
     LOGGER.debug("Getting diff rows: get_diff_rows_from_joined()")
 
-    diff_total_count = sum([info['count'] for info in grouped_column_diffs.values()])
+    column_counts = get_column_counts(grouped_column_diffs)
+    diff_total_count = sum(column_counts.values())
     if skip_row_total or (len(grouped_column_diffs) == 0):
         LOGGER.debug("Skipping sample of rows with differences, query to get that sample, and the total # of rows with > 0 differences. Returning only 'total_count', the sum of cell-by-cell differences.")
         return {
@@ -363,25 +582,40 @@ def get_diff_rows_from_joined(cur: Cursor,
             'total_count': diff_total_count
         }
 
-    LOGGER.info(grouped_column_diffs)
-    q = JINJA_ENV.get_template('joined_rows_count.sql').render(
-        joined_schema=output_schema,
-        joined_table=(x_table + '_JOINED'),
-        columns=grouped_column_diffs.keys()
-    )
+    LOGGER.info(column_counts)
+    if joined_shards is not None and len(joined_shards) > 1:
+        # only the shards with differences, and only their columns with differences:
+        shards = [(table, [col for col in columns if col in grouped_column_diffs]) for table, columns in joined_shards.items()]
+        d = {
+            'joined_schema': output_schema,
+            'join_cols': join_cols,
+            'shards': [(table, columns) for table, columns in shards if columns],
+            'not_null_keys': not_null_keys or [],
+            'sample': sample,
+            'hash_keys': hash_keys
+        }
+        count_template, sample_template = 'joined_shards_rows_count.sql', 'joined_shards_rows_sample.sql'
+    else:
+        d = {
+            'joined_schema': output_schema,
+            'joined_table': (x_table + '_JOINED') if joined_shards is None else list(joined_shards.keys())[0],
+            'columns': column_counts.keys(),
+            'join_cols': join_cols,
+            'sample': sample
+        }
+        count_template, sample_template = 'joined_rows_count.sql', 'joined_rows_sample.sql'
+    q = JINJA_ENV.get_template(count_template).render(d)
     LOGGER.info(q)
     cur.execute(q)
     diff_row_count = cur.fetchall()[0]['COUNT']
 
     # we'll pull all columns from the joined table
-    q = JINJA_ENV.get_template('joined_rows_sample.sql').render(
-        joined_schema=output_schema,
-        joined_table=(x_table + '_JOINED'),
-        columns=grouped_column_diffs.keys()
-    )
+    q = JINJA_ENV.get_template(sample_template).render(d)
     LOGGER.info(q)
     cur.execute(q + ' LIMIT ' + str(max_rows_all))
     diff_rows = pd.DataFrame(cur.fetchall())
+    if hash_keys:
+        diff_rows = diff_rows.drop(columns=['join_hash'], errors='ignore')
 
     return {'query': q, 'sample': diff_rows,
             'count': diff_row_count, 'total_count': diff_total_count}
@@ -405,14 +639,21 @@ def get_column_diffs(diff_columns: pd.DataFrame, cur: Cursor,
                      join_cols: list,
                      max_rows_column: int,
                      all_col_info_df: pd.DataFrame,
-                     hierarchical: bool = False) -> dict:
+                     hierarchical: bool = False,
+                     column_store: Optional[MutableMapping] = None,
+                     sample: str = DEFAULT_SAMPLE,
+                     details: bool = True) -> MutableMapping:
+    '''As get_column_diffs_from_joined(), from the diff table.'''
     LOGGER.debug("Getting column diffs")
     # get total count, list of most common differing pairs for each column
     # list of (count, query, df)
-    grouped_column_diffs = {row.column_name: {'count': row['COUNT']} for i, row in diff_columns.iterrows()}
+    grouped_column_diffs = {} if column_store is None else column_store
+    diff_counts = {row.column_name: row['COUNT'] for i, row in diff_columns.iterrows()}
 
-    for column_name, info in grouped_column_diffs.items():
-        LOGGER.info('Getting detailed diff for column: ' + str(column_name) + ' with ' + str(info['count']) + ' differences.')
+    for column_name, diff_count in diff_counts.items():
+        info = {'count': diff_count}
+        if details:
+            LOGGER.info('Getting detailed diff for column: ' + str(column_name) + ' with ' + str(info['count']) + ' differences.')
         q = JINJA_ENV.get_template('diff_column.sql').render(
             column=column_name,
             joined_schema=output_schema, joined_table=(x_table + '_JOINED'),
@@ -429,10 +670,11 @@ def get_column_diffs(diff_columns: pd.DataFrame, cur: Cursor,
             join_cols_join=' AND '.join(['diff.{0} <=> joined.{0}'.format(col) for col in join_cols]),
         )
         info['q_raw'] = q_raw
-        cur.execute(q + ' LIMIT ' + str(max_rows_column))
-        info['df'] = pd.DataFrame(cur.fetchall())
-        cur.execute(q_raw + ' LIMIT ' + str(max_rows_column))
-        info['df_raw'] = pd.DataFrame(cur.fetchall())
+        if details:
+            cur.execute(q + ' LIMIT ' + str(max_rows_column))
+            info['df'] = pd.DataFrame(cur.fetchall())
+            cur.execute(q_raw + ' LIMIT ' + str(max_rows_column))
+            info['df_raw'] = pd.DataFrame(cur.fetchall())
         if hierarchical:
             for schema, table, side in ((x_schema, x_table, 'x'), (y_schema, y_table, 'y')):
                 for limit in (None, max_rows_column):
@@ -444,13 +686,17 @@ def get_column_diffs(diff_columns: pd.DataFrame, cur: Cursor,
                         first_join_col=join_cols[0],
                         schema=schema,
                         table=table,
+                        sample=sample,
                         limit=limit
                     )
                     if limit is None:
                         info['q_h_' + side] = q_h
-                    else:
+                    elif details:
                         cur.execute(q_h)
                         info['df_h_' + side] = pd.DataFrame(cur.fetchall())
+                    else:
+                        # the sample is limited within the query (see get_column_details):
+                        info['q_h_' + side + '_sample'] = q_h
         row = all_col_info_df.loc[column_name, :]
         is_numeric = (is_numeric_like(row.x_dtype) and is_numeric_like(row.y_dtype))
         is_date = (is_date_like(row.x_dtype) and is_date_like(row.y_dtype))
@@ -462,8 +708,6 @@ def get_column_diffs(diff_columns: pd.DataFrame, cur: Cursor,
                 group_cols=', '.join(join_cols),
                 join_cols=' AND '.join(['diff.{0} <=> joined.{0}'.format(col) for col in join_cols]),
                 tiles=min({max({1, info['count']}), 10}))
-            cur.execute(info['q_n'])
-            info['df_n'] = pd.DataFrame(cur.fetchall())
             info['q_n_sample'] = JINJA_ENV.get_template('diff_column_numeric_diffs_sorted.sql').render(
                 column=column_name,
                 joined_schema=output_schema, joined_table=(x_table + '_JOINED'),
@@ -471,11 +715,119 @@ def get_column_diffs(diff_columns: pd.DataFrame, cur: Cursor,
                 join_cols=join_cols,
                 join_cols_join=' AND '.join(['diff.{0} <=> joined.{0}'.format(col) for col in join_cols]),
             )
-            cur.execute(info['q_n_sample'] + ' LIMIT ' + str(max_rows_column))
-            info['df_n_sample'] = pd.DataFrame(cur.fetchall())
+            if details:
+                cur.execute(info['q_n'])
+                info['df_n'] = pd.DataFrame(cur.fetchall())
+                cur.execute(info['q_n_sample'] + ' LIMIT ' + str(max_rows_column))
+                info['df_n_sample'] = pd.DataFrame(cur.fetchall())
+        grouped_column_diffs[column_name] = info
     return grouped_column_diffs
 
 
+def get_column_details(cur: Cursor, info: dict, max_rows_column: int) -> Dict[str, pd.DataFrame]:
+    '''Run the queries of a column's info, as rendered without its details (see get_column_diffs_from_joined),
+    each limited to `max_rows_column` rows. Returns their samples, by the keys of COLUMN_DETAIL_QUERIES.'''
+    details = {}
+    for query_key, (df_key, append_limit) in COLUMN_DETAIL_QUERIES.items():
+        if info.get(query_key) is None:
+            continue
+        q = info[query_key] + (' LIMIT ' + str(max_rows_column) if append_limit else '')
+        LOGGER.info(q)
+        cur.execute(q)
+        details[df_key] = pd.DataFrame(cur.fetchall())
+    return details
+
+
+def get_fused_column_info(cur: Cursor,
+                          joined_schema: str, joined_table: str,
+                          column: str,
+                          join_cols: list,
+                          max_rows_column: int,
+                          numeric: bool = False,
+                          x_dtype: Optional[str] = None,
+                          y_dtype: Optional[str] = None,
+                          hier_tables: Sequence[Tuple[str, str, str]] = (),
+                          sample: str = DEFAULT_SAMPLE) -> Optional[dict]:
+    '''The info of one column of the joined table (see get_column_diffs_from_joined), from one query.
+
+    The differing rows of the column are read once (materialized in a WITH clause), and the count,
+    the grouped pairs, the raw sample, the binned and biggest differences (if `numeric`)
+    and the rows of the joined keys in each of the (side, schema, table) `hier_tables`, if any,
+    all come back as the parts of one result set.
+    The column of each side of `hier_tables` is cast to the dtype of that side, `x_dtype` or `y_dtype`,
+    as it is in the joined table.
+
+    Returns None if the column has no differences.
+    '''
+    q_fused = JINJA_ENV.get_template('joined_column_fused.sql').render(
+        column=column,
+        joined_schema=joined_schema, joined_table=joined_table,
+        join_cols=join_cols,
+        limit=max_rows_column,
+        numeric=numeric,
+        tiles=10,
+        x_dtype=x_dtype,
+        y_dtype=y_dtype,
+        hier_tables=hier_tables,
+        sample=sample
+    )
+    LOGGER.info(q_fused)
+    cur.execute(q_fused)
+    parts: Dict[str, List[dict]] = {}
+    for fused_row in cur.fetchall():
+        parts.setdefault(fused_row['part'], []).append(fused_row)
+    diff_count = parts['count'][0]['ct']
+    if diff_count == 0:
+        return None
+    LOGGER.info('Got detailed diff for column: ' + str(column) + ' with ' + str(diff_count) + ' differences.')
+
+    def get_part(part: str, columns: list) -> pd.DataFrame:
+        return pd.DataFrame([{col: r[col] for col in columns} for r in parts.get(part, [])], columns=columns)
+
+    pair_cols = ['x_' + column, 'y_' + column]
+    info = {
+        'count': diff_count,
+        'df': get_part('grouped', pair_cols + ['ct']),
+        'df_raw': get_part('raw', join_cols + pair_cols),
+        # the queries of each output, as if they were run on their own:
+        'q': JINJA_ENV.get_template('joined_column.sql').render(
+            column=column,
+            joined_schema=joined_schema, joined_table=joined_table
+        ),
+        'q_raw': JINJA_ENV.get_template('joined_column_raw.sql').render(
+            column=column,
+            joined_schema=joined_schema, joined_table=joined_table,
+            join_cols=join_cols,
+            sample=sample
+        ),
+    }
+    for side, schema, table in hier_tables:
+        info['q_h_' + side] = JINJA_ENV.get_template('joined_column_hier.sql').render(
+            column=column,
+            joined_schema=joined_schema, joined_table=joined_table,
+            join_cols=join_cols,
+            schema=schema,
+            table=table,
+            limit=None,
+            sample=sample
+        )
+        info['df_h_' + side] = get_part('hier_' + side, join_cols + [side + '_' + column]).rename(columns={side + '_' + column: column})
+    if numeric:
+        info['q_n'] = JINJA_ENV.get_template('joined_column_numeric_diffs_binned.sql').render(
+            column=column,
+            joined_schema=joined_schema, joined_table=joined_table,
+            tiles=min({max({1, diff_count}), 10}))
+        info['df_n'] = get_part('binned', ['min_diff', 'max_diff', 'ct'])
+        info['q_n_sample'] = JINJA_ENV.get_template('joined_column_numeric_diffs_sorted.sql').render(
+            column=column,
+            joined_schema=joined_schema, joined_table=joined_table,
+            join_cols=join_cols
+        )
+        info['df_n_sample'] = get_part('sorted', join_cols + pair_cols + ['abs_diff'])
+    LOGGER.info(info)
+    return info
+
+
 def get_column_diffs_from_joined(cur: Cursor,
                                  output_schema: str,
                                  x_schema: str, x_table: str,
@@ -484,7 +836,12 @@ def get_column_diffs_from_joined(cur: Cursor,
                                  max_rows_column: int,
                                  all_col_info_df: pd.DataFrame,
                                  comparable_filter,
-                                 hierarchical: bool = False) -> dict:
+                                 hierarchical: bool = False,
+                                 joined_tables: Optional[Dict[str, str]] = None,
+                                 column_store: Optional[MutableMapping] = None,
+                                 fused: bool = False,
+                                 sample: str = DEFAULT_SAMPLE,
+                                 details: bool = True) -> MutableMapping:
     '''Get column-by-column diffs directly from the joined table.
 
     Non self-explanatory argument specifics:
@@ -497,6 +854,16 @@ def get_column_diffs_from_joined(cur: Cursor,
     - comparable_filter: an 0/1 index on all_col_info_df to filter on columns to compare.
         - in cli.py, this filter/index is set using datatype matching and the user-supplied list of columns to exclude.
     - hierarchical: if true, additional outputs are included for each columns that are samples with the join keys.
+    - joined_tables: the joined table that has each column, if they were split over several (see get_joined_shards).
+      Defaults to [x_table]_JOINED for all columns.
+    - column_store: where to put the info of each column as soon as it is done, e.g. a dbdiff.store.ColumnStore
+      to keep the samples on disk rather than in memory. Returned, in place of a new dict, if given.
+    - fused: if true, get all of the outputs of each column with one query (see get_fused_column_info),
+      rather than a count query and then one query per output. The queries in the outputs are the same either way.
+    - sample: how the rows of the raw and hierarchical samples are picked (see SAMPLE_METHODS).
+    - details: if false, only count the differences of each column, and render its queries without running them,
+      so the info has no dataframes (see get_column_details to run them later).
+      The hierarchical samples then also get their limited queries, as `q_h_{x,y}_sample`.
 
     Returned data specifics:
     - dict grouped_column_diffs:
@@ -509,75 +876,99 @@ def get_column_diffs_from_joined(cur: Cursor,
     column_list_to_compare = all_col_info_df.loc[comparable_filter & ~all_col_info_df.index.isin(join_cols), :].index.values
     LOGGER.info("Getting column diffs for columns:")
     LOGGER.info(",".join(column_list_to_compare))
-    grouped_column_diffs = {}
+    grouped_column_diffs = {} if column_store is None else column_store
 
     for column in column_list_to_compare:
         LOGGER.info("=" * 80)
         LOGGER.info(column)
+        joined_table = (joined_tables or {}).get(column, x_table + '_JOINED')
+        row = all_col_info_df.loc[column, :]
+        is_numeric = (is_numeric_like(row.x_dtype) and is_numeric_like(row.y_dtype))
+        is_date = (is_date_like(row.x_dtype) and is_date_like(row.y_dtype))
+        if fused and details:
+            info = get_fused_column_info(
+                cur, output_schema, joined_table, column, join_cols, max_rows_column,
+                numeric=(is_numeric or is_date), x_dtype=row.x_dtype, y_dtype=row.y_dtype,
+                hier_tables=([('x', x_schema, x_table), ('y', y_schema, y_table)] if hierarchical else []),
+                sample=sample
+            )
+            if info is None:
+                LOGGER.info('NOT getting detailed diff for column: ' + str(column) + ' with 0 differences.')
+            else:
+                grouped_column_diffs[column] = info
+            continue
         joined_count_q = JINJA_ENV.get_template('joined_count.sql').render(
             column=column,
             joined_schema=output_schema,
-            joined_table=(x_table + '_JOINED')
+            joined_table=joined_table
         )
         LOGGER.info(joined_count_q)
         cur.execute(joined_count_q)
         diff_count = cur.fetchall()[0]['COUNT']
         if diff_count > 0:
-            LOGGER.info('Getting detailed diff for column: ' + str(column) + ' with ' + str(diff_count) + ' differences.')
             q = JINJA_ENV.get_template('joined_column.sql').render(
                 column=column,
-                joined_schema=output_schema, joined_table=(x_table + '_JOINED')
+                joined_schema=output_schema, joined_table=joined_table
             )
             q_raw = JINJA_ENV.get_template('joined_column_raw.sql').render(
                 column=column,
-                joined_schema=output_schema, joined_table=(x_table + '_JOINED'),
-                join_cols=join_cols
+                joined_schema=output_schema, joined_table=joined_table,
+                join_cols=join_cols,
+                sample=sample
             )
-            LOGGER.info(q)
-            cur.execute(q + ' LIMIT ' + str(max_rows_column))
-            df = pd.DataFrame(cur.fetchall())
-            LOGGER.info(q_raw)
-            cur.execute(q_raw + ' LIMIT ' + str(max_rows_column))
-            df_raw = pd.DataFrame(cur.fetchall())
-            grouped_column_diffs[column] = {'count': diff_count, 'df': df, 'df_raw': df_raw, 'q': q, 'q_raw': q_raw}
-            LOGGER.info(grouped_column_diffs[column])
+            info = {'count': diff_count, 'q': q, 'q_raw': q_raw}
+            if details:
+                LOGGER.info('Getting detailed diff for column: ' + str(column) + ' with ' + str(diff_count) + ' differences.')
+                LOGGER.info(q)
+                cur.execute(q + ' LIMIT ' + str(max_rows_column))
+                info['df'] = pd.DataFrame(cur.fetchall())
+                LOGGER.info(q_raw)
+                cur.execute(q_raw + ' LIMIT ' + str(max_rows_column))
+                info['df_raw'] = pd.DataFrame(cur.fetchall())
+                LOGGER.info(info)
 
             if hierarchical:
                 for schema, table, side in ((x_schema, x_table, 'x'), (y_schema, y_table, 'y')):
                     for limit in (None, max_rows_column):
                         q_h = JINJA_ENV.get_template('joined_column_hier.sql').render(
                             column=column,
-                            joined_schema=output_schema, joined_table=(x_table + '_JOINED'),
+                            joined_schema=output_schema, joined_table=joined_table,
                             join_cols=join_cols,
                             schema=schema,
                             table=table,
-                            limit=limit
+                            limit=limit,
+                            sample=sample
                         )
                         if limit is None:
-                            grouped_column_diffs[column]['q_h_' + side] = q_h
-                        else:
+                            info['q_h_' + side] = q_h
+                        elif details:
                             cur.execute(q_h)
-                            grouped_column_diffs[column]['df_h_' + side] = pd.DataFrame(cur.fetchall())
-            row = all_col_info_df.loc[column, :]
-            is_numeric = (is_numeric_like(row.x_dtype) and is_numeric_like(row.y_dtype))
-            is_date = (is_date_like(row.x_dtype) and is_date_like(row.y_dtype))
+                            info['df_h_' + side] = pd.DataFrame(cur.fetchall())
+                        else:
+                            # the sample is limited within the query (see get_column_details):
+                            info['q_h_' + side + '_sample'] = q_h
             if is_numeric or is_date:
-                grouped_column_diffs[column]['q_n'] = JINJA_ENV.get_template('joined_column_numeric_diffs_binned.sql').render(
+                info['q_n'] = JINJA_ENV.get_template('joined_column_numeric_diffs_binned.sql').render(
                     column=column,
-                    joined_schema=output_schema, joined_table=(x_table + '_JOINED'),
-                    tiles=min({max({1, grouped_column_diffs[column]['count']}), 10}))
-                cur.execute(grouped_column_diffs[column]['q_n'])
-                grouped_column_diffs[column]['df_n'] = pd.DataFrame(cur.fetchall())
-                grouped_column_diffs[column]['q_n_sample'] = JINJA_ENV.get_template('joined_column_numeric_diffs_sorted.sql').render(
+                    joined_schema=output_schema, joined_table=joined_table,
+                    tiles=min({max({1, info['count']}), 10}))
+                info['q_n_sample'] = JINJA_ENV.get_template('joined_column_numeric_diffs_sorted.sql').render(
                     column=column,
-                    joined_schema=output_schema, joined_table=(x_table + '_JOINED'),
+                    joined_schema=output_schema, joined_table=joined_table,
                     join_cols=join_cols
                 )
-                cur.execute(grouped_column_diffs[column]['q_n_sample'] + ' LIMIT ' + str(max_rows_column))
-                grouped_column_diffs[column]['df_n_sample'] = pd.DataFrame(cur.fetchall())
+                if details:
+                    cur.execute(info['q_n'])
+                    info['df_n'] = pd.DataFrame(cur.fetchall())
+                    cur.execute(info['q_n_sample'] + ' LIMIT ' + str(max_rows_column))
+                    info['df_n_sample'] = pd.DataFrame(cur.fetchall())
+            grouped_column_diffs[column] = info
         else:
             LOGGER.info('NOT getting detailed diff for column: ' + str(column) + ' with ' + str(diff_count) + ' differences.')
     LOGGER.info(len(grouped_column_diffs))
+    if column_store is not None:
+        # the store keeps its columns by most differences first:
+        return column_store
     grouped_column_diffs_sorted = {x: grouped_column_diffs[x] for x in sorted(grouped_column_diffs.keys(), key=lambda x: grouped_column_diffs[x]['count'], reverse=True)}
     LOGGER.info(len(grouped_column_diffs_sorted))
     return grouped_column_diffs_sorted
@@ -0,0 +1,192 @@
+import logging
+import re
+from typing import Any, Dict, Optional
+
+from jinja2 import Environment, PackageLoader
+from vertica_python.vertica.cursor import Cursor
+
+from dbdiff.vertica import get_column_info_lookup, implicit_dtype_comparison
+
+JINJA_ENV = Environment(loader=PackageLoader('dbdiff', 'templates'))
+LOGGER = logging.getLogger(__name__)
+# about how many keys to sample from the larger table:
+SAMPLE_KEYS = 100000
+# the diff table pays off when few rows differ, across enough columns that scanning the joined table for each is slow:
+DIFF_TABLE_MIN_COLUMNS = 20
+DIFF_TABLE_MAX_DIFF_RATE = 0.05
+# checksumming the columns first pays off when there are enough of them that most are likely identical:
+PRUNE_MIN_COLUMNS = 20
+PRUNE_MAX_DIFF_RATE = 0.5
+# past this many compared columns, the joined table is split into shards this wide:
+SHARD_MIN_COLUMNS = 200
+SHARD_WIDTH = 100
+# past this many differing rows, the sample of them is enough, without counting them all:
+SKIP_ROW_TOTAL_MIN_DIFF_ROWS = 10000000
+# up to this many differing rows, sorting them by hash for a sample spread over the keys is cheap:
+SAMPLE_HASH_MAX_DIFF_ROWS = 1000000
+# past this many rows, tables partitioned on the same column are diffed one partition at a time:
+PARTITION_MIN_ROWS = 100000000
+# a partition expression that is a plain column, e.g. `x_table.load_date`:
+PARTITION_COLUMN_RE = re.compile(r'^\(*\s*(?:\w+\.)?(\w+)\s*\)*$')
+
+
+def get_table_storage(cur: Cursor, schema: str, table: str) -> Dict[str, Any]:
+    '''The row count, bytes and partition column (if it's partitioned on a plain column) of a table, from the catalog.
+    Tables without storage statistics (views, temp tables) are counted, their bytes are None.'''
+    q = JINJA_ENV.get_template('table_storage.sql').render(schema_name=schema, table_name=table)
+    LOGGER.info(q)
+    cur.execute(q)
+    r = cur.fetchall()[0]
+    storage = {'rows': r['row_count'], 'bytes': r['used_bytes'], 'partition_column': None}
+    if storage['rows'] is None:
+        q = JINJA_ENV.get_template('table_rows.sql').render(schema_name=schema, table_name=table)
+        LOGGER.info(q)
+        cur.execute(q)
+        storage['rows'] = cur.fetchall()[0]['COUNT']
+    match = PARTITION_COLUMN_RE.match(r['partition_expression'] or '')
+    if match is not None:
+        storage['partition_column'] = match.group(1).lower()
+    return storage
+
+
+def get_estimates(cur: Cursor,
+                  x_schema: str, x_table: str,
+                  y_schema: str, y_table: str,
+                  join_cols: list,
+                  exclude_columns: Optional[set] = None,
+                  sample_keys: int = SAMPLE_KEYS) -> Dict[str, Any]:
+    '''Cheap estimates of the size of a diff:
+
+    - {x,y}_rows, {x,y}_bytes, {x,y}_partition_column: from the catalog (see get_table_storage()).
+    - columns: the # of columns to compare (in both tables, not excluded, of comparable dtypes).
+    - sample_modulus: 1 in this many keys were sampled, the same keys on both sides (by the hash of the keys).
+    - sample_matched_rows: the sampled rows with their keys in both tables, once on each side.
+    - diff_rate: the share of those with a difference in any compared column, None if none matched.
+    - diff_rows: the estimated # of rows with differences in the whole tables.
+    - {x,y}_dup_rate: the share of sampled rows with a duplicated key on each side.
+      As in the diff, those rows are left out of the matched rows (see main.select_distinct_rows()).
+    '''
+    if exclude_columns is None:
+        exclude_columns = set()
+    x_lookup = get_column_info_lookup(cur, x_schema, x_table)
+    y_lookup = get_column_info_lookup(cur, y_schema, y_table)
+    columns = [col for col, dtype in x_lookup.items()
+               if (col in y_lookup) and (col not in exclude_columns) and (col not in join_cols) and implicit_dtype_comparison(dtype, y_lookup[col])]
+
+    estimates: Dict[str, Any] = {'columns': len(columns)}
+    for side, schema, table in (('x', x_schema, x_table), ('y', y_schema, y_table)):
+        storage = get_table_storage(cur, schema, table)
+        estimates.update({side + '_' + k: v for k, v in storage.items()})
+
+    modulus = max(1, max(estimates['x_rows'], estimates['y_rows']) // sample_keys)
+    q = JINJA_ENV.get_template('key_hash_sample.sql').render(
+        x_schema=x_schema, x_table=x_table,
+        y_schema=y_schema, y_table=y_table,
+        join_cols=join_cols,
+        # the values are hashed as the x dtype on both sides, as they're compared in the joined table:
+        x_columns=join_cols + columns,
+        y_columns=join_cols + [col if y_lookup[col] == x_lookup[col] else col + '::' + x_lookup[col] for col in columns],
+        modulus=modulus
+    )
+    LOGGER.info(q)
+    cur.execute(q)
+    r = cur.fetchall()[0]
+    matched = r['matched_rows'] or 0
+    estimates.update({
+        'sample_modulus': modulus,
+        'sample_matched_rows': matched,
+        'diff_rate': (r['diff_rows'] / matched) if matched else None,
+        'diff_rows': (r['diff_rows'] or 0) * modulus,
+        'x_dup_rate': (r['x_dup_rows'] / r['x_rows']) if r['x_rows'] else 0.0,
+        'y_dup_rate': (r['y_dup_rows'] / r['y_rows']) if r['y_rows'] else 0.0,
+    })
+    return estimates
+
+
+def choose_strategy(estimates: Dict[str, Any], given: Optional[Dict[str, Any]] = None) -> Dict[str, dict]:
+    '''Choose the options of a diff from its estimates (see get_estimates()).
+
+    Returns {'value': ..., 'reason': ...} for each of use_diff_table, joined_shard_width, prune_identical_columns,
+    skip_row_total, sample and partition_column.
+    The options in `given` (those set by hand, and any others of the diff that constrain these, e.g. hierarchical_join)
+    are kept as they are, and the others are chosen around them.
+    '''
+    if given is None:
+        given = {}
+    choices: Dict[str, dict] = {}
+
+    def choose(option: str, value: Any, reason: str) -> None:
+        if option in given:
+            choices[option] = {'value': given[option], 'reason': 'Given.'}
+        else:
+            choices[option] = {'value': value, 'reason': reason}
+
+    columns = estimates['columns']
+    diff_rate = estimates['diff_rate']
+    rate = 'unknown' if diff_rate is None else '{0:.1%}'.format(diff_rate)
+    rows = max(estimates['x_rows'], estimates['y_rows'])
+
+    if given.get('joined_shard_width'):
+        choose('use_diff_table', False, 'The joined table is split (joined_shard_width), which the diff table does not support.')
+    elif diff_rate is None:
+        choose('use_diff_table', False, 'No sampled keys matched, so the share of differing rows is unknown.')
+    elif (columns >= DIFF_TABLE_MIN_COLUMNS) and (diff_rate <= DIFF_TABLE_MAX_DIFF_RATE):
+        choose('use_diff_table', True, 'Few matched rows differ ({0}) across {1} columns: each column reads the small diff table rather than scanning the joined table.'.format(rate, columns))
+    elif columns < DIFF_TABLE_MIN_COLUMNS:
+        choose('use_diff_table', False, 'Only {0} columns to compare: scanning the joined table for each is cheaper than building the diff table.'.format(columns))
+    else:
+        choose('use_diff_table', False, 'Many matched rows differ ({0}): the diff table would be about as large as the joined table.'.format(rate))
+
+    if choices['use_diff_table']['value']:
+        choose('joined_shard_width', 0, 'The diff table does not support splitting the joined table.')
+    elif columns >= SHARD_MIN_COLUMNS:
+        choose('joined_shard_width', SHARD_WIDTH, '{0} columns to compare: joined tables of at most {1} columns each are cheaper to scan.'.format(columns, SHARD_WIDTH))
+    else:
+        choose('joined_shard_width', 0, 'Only {0} columns to compare, one joined table.'.format(columns))
+
+    if (columns >= PRUNE_MIN_COLUMNS) and (diff_rate is not None) and (diff_rate <= PRUNE_MAX_DIFF_RATE):
+        choose('prune_identical_columns', True, '{0} columns, with {1} of the rows differing: checksumming the columns first likely leaves many of them out of the join.'.format(columns, rate))
+    else:
+        choose('prune_identical_columns', False, '{0} columns, with {1} of the rows differing: few columns are likely identical.'.format(columns, rate))
+
+    if estimates['diff_rows'] >= SKIP_ROW_TOTAL_MIN_DIFF_ROWS:
+        choose('skip_row_total', True, 'About {0:,d} rows differ: their sample is enough, without counting them all.'.format(estimates['diff_rows']))
+    else:
+        choose('skip_row_total', False, 'About {0:,d} rows differ, counting them all is cheap.'.format(estimates['diff_rows']))
+
+    if estimates['diff_rows'] > SAMPLE_HASH_MAX_DIFF_ROWS:
+        choose('sample', 'first', 'About {0:,d} rows differ: the samples are the first found, without sorting them all.'.format(estimates['diff_rows']))
+    else:
+        choose('sample', 'hash', 'About {0:,d} rows differ: sorting them by the hash of their keys is cheap, for samples spread over the keys.'.format(estimates['diff_rows']))
+
+    partition_column = estimates['x_partition_column']
+    if any(given.get(option) for option in ('hierarchical_join', 'profile', 'profile_only')):
+        choose('partition_column', None, 'The incremental diff does not support the hierarchical join or the profiles.')
+    elif (partition_column is None) or (partition_column != estimates['y_partition_column']):
+        choose('partition_column', None, 'The tables are not partitioned on the same column.')
+    elif rows < PARTITION_MIN_ROWS:
+        choose('partition_column', None, 'Only {0:,d} rows, diffing the partitions separately does not pay off.'.format(rows))
+    else:
+        choose('partition_column', partition_column, '{0:,d} rows, partitioned on {1}: only the partitions that changed are rediffed.'.format(rows, partition_column))
+    return choices
+
+
+def plan_diff(cur: Cursor,
+              x_schema: str, x_table: str,
+              y_schema: str, y_table: str,
+              join_cols: list,
+              exclude_columns: Optional[set] = None,
+              given: Optional[Dict[str, Any]] = None,
+              sample_keys: int = SAMPLE_KEYS) -> Dict[str, Any]:
+    '''Estimate the size of a diff (see get_estimates()) and choose its strategy from that (see choose_strategy()).
+    Each choice is logged with its reason.
+
+    Returns {'estimates': ..., 'choices': ...}.
+    The chosen options are {option: choice['value'] for option, choice in choices.items()}.
+    '''
+    estimates = get_estimates(cur, x_schema, x_table, y_schema, y_table, join_cols, exclude_columns, sample_keys)
+    LOGGER.info('Plan estimates: ' + ', '.join('{0}={1}'.format(k, v) for k, v in estimates.items()) + '.')
+    choices = choose_strategy(estimates, given)
+    for option, choice in choices.items():
+        LOGGER.info('Plan: {0}={1}. {2}'.format(option, choice['value'], choice['reason']))
+    return {'estimates': estimates, 'choices': choices}
@@ -1,13 +1,26 @@
+import hashlib
+import json
+import re
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Set, Tuple
+
 import pandas as pd
 from jinja2 import Environment, PackageLoader
 
+from dbdiff.batch import get_job_key
+from dbdiff.store import close_columns, get_column_counts, keep_columns
+
 MAX_EXCEL_SHEET_NAME_LEN = 31
+SHARD_DIR_NAME = 'columns'
 JINJA_ENV = Environment(loader=PackageLoader('dbdiff', 'templates'))
 
 
-def get_max_diferences(column_info: pd.DataFrame) -> int:
-    if len(list(column_info.values())) > 0:
-        return list(column_info.values())[0]['count']
+def get_max_diferences(column_info: dict) -> int:
+    # the columns are by most differences first:
+    counts = get_column_counts(column_info)
+    if len(counts) > 0:
+        return list(counts.values())[0]
     else:
         return 0
 
@@ -20,12 +33,7 @@ def reformat_hierarchical_join_info(d: dict, x_table: str, y_table: str) -> dict
     return {col: reformat_missing_join_info(val, x_table, y_table) for col, val in d.items()}
 
 
-def html_report(x_schema: str, y_schema: str, x_table: str, y_table: str, join_cols: list,
-                diff_summary: dict, total_row_count: int,
-                column_info: dict,
-                column_match_info: pd.DataFrame,
-                missing_join_info: dict, hierarchical_join_info: dict,
-                dedup_info: dict) -> str:
+def set_html_filters() -> None:
 
     def comma(value, format='{0:,d}'):
         return format.format(value)
@@ -40,44 +48,232 @@ def html_report(x_schema: str, y_schema: str, x_table: str, y_table: str, join_c
     JINJA_ENV.filters['code'] = code
     JINJA_ENV.filters['dfhtml'] = dfhtml
 
-    t = JINJA_ENV.get_template('html/report.html')
 
+def get_html_context(x_schema: str, y_schema: str, x_table: str, y_table: str, join_cols: list,
+                     diff_summary: dict, total_row_count: int,
+                     column_info: dict,
+                     column_match_info: pd.DataFrame,
+                     missing_join_info: dict, hierarchical_join_info: dict,
+                     dedup_info: dict,
+                     interrupted: Optional[str] = None,
+                     column_profile: pd.DataFrame = None,
+                     profile_only: bool = False,
+                     **kwargs) -> dict:
     max_differences = get_max_diferences(column_info)
     missing_join_info = reformat_missing_join_info(missing_join_info, x_table, y_table)
     hierarchical_join_info = reformat_hierarchical_join_info(hierarchical_join_info, x_table, y_table)
 
-    return t.render({'x_schema': x_schema, 'y_schema': y_schema,
-                     'x_table': x_table, 'y_table': y_table,
-                     'join_cols': join_cols,
-                     'diff_summary': diff_summary,
-                     'total_row_count': total_row_count,
-                     'column_info': column_info,
-                     'max_differences': max_differences,
-                     'missing_join_info': missing_join_info,
-                     'hierarchical_join_info': hierarchical_join_info,
-                     'dedup_info': dedup_info,
-                     # can't do these filters in Jinja
-                     # could write a filter function that takes a list of
-                     # positive and a list of negative filter columns
-                     # but this is good enough for the one case:
-                     'compared_column_count': ((~column_match_info.exclude) & column_match_info.comparable & (~column_match_info.x_dtype.isnull()) & (~column_match_info.y_dtype.isnull()) & (~column_match_info.index.isin(join_cols))).sum(),
-                     'column_match_info': column_match_info})
-
-
-def excel_report(x_schema: str, y_schema: str,
-                 x_table: str, y_table: str,
-                 join_cols: list,
-                 diff_summary: dict,
-                 total_row_count: int,
-                 column_info: dict,
-                 column_match_info: pd.DataFrame,
-                 missing_join_info: dict,
-                 hierarchical_join_info: dict,
-                 dedup_info: dict) -> list:
+    return {'x_schema': x_schema, 'y_schema': y_schema,
+            'x_table': x_table, 'y_table': y_table,
+            'join_cols': join_cols,
+            'diff_summary': diff_summary,
+            'total_row_count': total_row_count,
+            'column_info': column_info,
+            'max_differences': max_differences,
+            'missing_join_info': missing_join_info,
+            'hierarchical_join_info': hierarchical_join_info,
+            'dedup_info': dedup_info,
+            'interrupted': interrupted,
+            'column_profile': column_profile,
+            'profile_only': profile_only,
+            # can't do these filters in Jinja
+            # could write a filter function that takes a list of
+            # positive and a list of negative filter columns
+            # but this is good enough for the one case:
+            'compared_column_count': ((~column_match_info.exclude) & column_match_info.comparable & (~column_match_info.x_dtype.isnull()) & (~column_match_info.y_dtype.isnull()) & (~column_match_info.index.isin(join_cols))).sum(),
+            'column_match_info': column_match_info}
+
+
+def html_report(**all_info) -> str:
+    set_html_filters()
+    t = JINJA_ENV.get_template('html/report.html')
+    return t.render(get_html_context(**all_info))
+
+
+def get_shard_name(column: str) -> str:
+    '''The name of the fragment of `column`: the column name itself if it is a plain identifier, else a hash of it.'''
+    if re.fullmatch(r'[A-Za-z0-9_]+', column):
+        return column
+    return hashlib.sha1(column.encode()).hexdigest()[:16]
+
+
+def get_column_shards(column_info: dict) -> Dict[str, str]:
+    '''The file name of the fragment of each column, by column.
+    Named after the column rather than its place in the report, so that it can be written before the order is known.'''
+    return {column: get_shard_name(column) + '.js' for column in column_info}
+
+
+def html_column_fragment(column: str, info: dict) -> str:
+    '''The fragment of `column` in the report (see html_report_index()): a script that fills its body.'''
+    set_html_filters()
+    html = JINJA_ENV.get_template('html/column.html').render(column=column, info=info)
+    return 'dbdiffLoadColumn({0}, {1});\n'.format(json.dumps(get_shard_name(column)), json.dumps(html))
+
+
+def html_report_index(**all_info) -> Iterator[str]:
+    '''The HTML report without the details of the columns, each loaded from its fragment in SHARD_DIR_NAME/
+    (see get_column_shards()) only when that column is expanded. Streamed, as the parts of the page.'''
+    set_html_filters()
+    context = get_html_context(**all_info)
+    context['shard_dir'] = SHARD_DIR_NAME
+    context['column_shards'] = get_column_shards(all_info['column_info'])
+    return JINJA_ENV.get_template('html/report_index.html').generate(context)
+
+
+def get_columns(columns: MutableMapping) -> MutableMapping:
+    return columns
+
+
+class ShardWriter(MutableMapping):
+    '''The column_info of a diff (see main.get_column_diffs_from_joined) that writes the fragment of each column
+    of the sharded HTML report (see html_report_sharded()) to `output_dir` as soon as the column is set,
+    so that the column stage streams the report to disk rather than leaving it all to the end of the run.
+
+    The info itself is kept in `columns` (a dict by default, or e.g. a dbdiff.store.ColumnStore).
+    Iterating goes through the columns by most differences first, as the reports list them.
+    Pickling a writer pickles its `columns`, and so do keep() and close() (see dbdiff.store.keep_columns()).
     '''
-    Return a list with [(sheet_name: str, df: pd.DataFrame) ... ]
+
+    def __init__(self, output_dir: Path, columns: Optional[MutableMapping] = None):
+        self.output_dir = Path(output_dir)
+        (self.output_dir / SHARD_DIR_NAME).mkdir(parents=True, exist_ok=True)
+        self.columns = {} if columns is None else columns
+        # the columns whose fragment is written:
+        self.written: Set[str] = set()
+
+    def __setitem__(self, column: str, info: dict) -> None:
+        self.columns[column] = info
+        (self.output_dir / SHARD_DIR_NAME / (get_shard_name(column) + '.js')).write_text(html_column_fragment(column, info))
+        self.written.add(column)
+
+    def __getitem__(self, column: str) -> dict:
+        return self.columns[column]
+
+    def __delitem__(self, column: str) -> None:
+        del self.columns[column]
+        self.written.discard(column)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.counts())
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def __contains__(self, column: Any) -> bool:
+        return column in self.columns
+
+    def counts(self) -> Dict[str, int]:
+        '''The # of differences of each column, by most first.'''
+        counts = get_column_counts(self.columns)
+        return {column: counts[column] for column in sorted(counts, key=lambda column: counts[column], reverse=True)}
+
+    def keep(self, path: Path) -> Mapping[str, dict]:
+        return keep_columns(self.columns, path)
+
+    def close(self) -> None:
+        close_columns(self.columns)
+
+    def __reduce__(self):
+        return (get_columns, (self.columns,))
+
+
+def html_report_sharded(output_dir: Path, **all_info) -> Path:
+    '''Write the HTML report as a small index page plus one fragment per column.
+
+    The fragments are written (and released) one column at a time,
+    and the index is streamed to disk rather than built as one string.
+    The fragments already written by a ShardWriter in `output_dir` (as the column stage finished each column)
+    are not written again.
+    The index loads a column's fragment only when that column is expanded,
+    so very wide diffs open quickly in the browser.
+
+    Returns the path of the index page.
+    '''
+    column_info = all_info['column_info']
+    written: Set[str] = set()
+    if isinstance(column_info, ShardWriter) and (column_info.output_dir == Path(output_dir)):
+        written = column_info.written
+    shard_dir = output_dir / SHARD_DIR_NAME
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    column_shards = get_column_shards(column_info)
+    for column in column_info:
+        if column not in written:
+            (shard_dir / column_shards[column]).write_text(html_column_fragment(column, column_info[column]))
+
+    index = output_dir / 'index.html'
+    with index.open('w') as f:
+        f.writelines(html_report_index(**all_info))
+    return index
+
+
+def get_comparison_matrix(all_infos: Dict[str, dict]) -> pd.DataFrame:
+    '''Compare the diffs of one table against several candidates (the all_info of each, by candidate name).
+
+    One column per candidate, with the top line counts first,
+    then the # of differences in each column (0 where none), the columns with the most differences overall first.
+    '''
+    matrix = {}
+    for name, all_info in all_infos.items():
+        matrix[name] = {
+            'Rows matched': all_info['total_row_count'],
+            'Rows only in x': all_info['missing_join_info']['x']['count'],
+            'Rows only in the candidate': all_info['missing_join_info']['y']['count'],
+            'Rows with differences': all_info['diff_summary'].get('count', 0),
+            'Cell differences': all_info['diff_summary']['total_count'],
+            'Columns with differences': len(all_info['column_info']),
+        }
+    counts = {name: get_column_counts(all_info['column_info']) for name, all_info in all_infos.items()}
+    columns = sorted({column for c in counts.values() for column in c}, key=lambda column: -sum(c.get(column, 0) for c in counts.values()))
+    for name in all_infos:
+        matrix[name].update({'Column ' + column: counts[name].get(column, 0) for column in columns})
+    df = pd.DataFrame(matrix, columns=list(all_infos.keys()))
+    df.index.name = 'Candidate'
+    return df.reset_index()
+
+
+def html_matrix_report(x_schema: str, x_table: str, matrix: pd.DataFrame, reports: Dict[str, str]) -> str:
+    '''The page of the comparison matrix (see get_comparison_matrix()), linking to the report of each candidate.'''
+    set_html_filters()
+    t = JINJA_ENV.get_template('html/matrix.html')
+    return t.render(x_schema=x_schema, x_table=x_table, matrix=matrix, reports=reports)
+
+
+def html_schema_report(x_schema: str, y_schema: str,
+                       jobs: List[dict], results: List[dict],
+                       only_x: List[str], only_y: List[str], skipped: List[str]) -> str:
+    '''The index page of the diffs of two schemas, linking to the report of each pair of tables.
+
+    `jobs` and `results` are the batch jobs of the pairs (see dbdiff.schema.get_schema_jobs()) and their results
+    (see dbdiff.batch.run_batch()), in any order.
+    '''
+    set_html_filters()
+    join_cols = {get_job_key(job): job['join_cols'] for job in jobs}
+    pairs = []
+    for result in sorted(results, key=lambda result: result['key']):
+        pair = {'table': result['key'].split('|')[0].split('.', 1)[1], 'join_cols': join_cols[result['key']],
+                'status': result['status'], 'duration': result['duration'], 'error': result.get('error')}
+        pair.update(result.get('result', {}))
+        pairs.append(pair)
+    t = JINJA_ENV.get_template('html/schema.html')
+    return t.render(x_schema=x_schema, y_schema=y_schema, pairs=pairs, only_x=only_x, only_y=only_y, skipped=skipped)
+
+
+def iter_excel_report(x_schema: str, y_schema: str,
+                      x_table: str, y_table: str,
+                      join_cols: list,
+                      diff_summary: dict,
+                      total_row_count: int,
+                      column_info: dict,
+                      column_match_info: pd.DataFrame,
+                      missing_join_info: dict,
+                      hierarchical_join_info: dict,
+                      dedup_info: dict,
+                      column_profile: pd.DataFrame = None,
+                      **kwargs) -> Iterator[Tuple[str, pd.DataFrame]]:
+    '''
+    As excel_report(), yielding each (sheet_name, df), the columns' last,
+    so a column_info kept on disk (see dbdiff.store.ColumnStore) is read one column at a time.
     '''
-    all_sheets = []
     summary_sheet_data = [{'Summary': 'Diff report between tables {x_table} (herein, "x") and {y_table} (herein, "y").'.format(
         x_table=x_table,
         y_table=y_table
@@ -99,16 +295,27 @@ def excel_report(x_schema: str, y_schema: str,
     max_differences = get_max_diferences(column_info)
 
     summary_sheet_data.append({'Summary': 'The maximum number of differences on any individual column is {max_differences}.'.format(max_differences=max_differences)})
-    all_sheets.append(('Summary', pd.DataFrame(summary_sheet_data)))
+    yield ('Summary', pd.DataFrame(summary_sheet_data))
+    if column_profile is not None:
+        yield ('Profile', column_profile)
 
     if missing_join_info['x']['count'] > 0:
-        # all_sheets.append(('Missing rows in {x_table}'.format(x_table=x_table), x_missing_ids))
-        all_sheets.append(('Missing in x', missing_join_info['x']['sample']))
+        # yield ('Missing rows in {x_table}'.format(x_table=x_table), x_missing_ids)
+        yield ('Missing in x', missing_join_info['x']['sample'])
     if missing_join_info['y']['count'] > 0:
-        # all_sheets.append(('Missing rows in {y_table}'.format(y_table=y_table), y_missing_ids))
-        all_sheets.append(('Missing in y', missing_join_info['y']['sample']))
+        # yield ('Missing rows in {y_table}'.format(y_table=y_table), y_missing_ids)
+        yield ('Missing in y', missing_join_info['y']['sample'])
     if diff_summary['count'] > 0:
-        all_sheets.append(('Mismatched rows', diff_summary['sample']))
+        yield ('Mismatched rows', diff_summary['sample'])
     for column, info in column_info.items():
-        all_sheets.append((column[:MAX_EXCEL_SHEET_NAME_LEN], info['df_raw']))
-    return all_sheets
+        # not there if the details were skipped:
+        if 'df_raw' in info:
+            yield (column[:MAX_EXCEL_SHEET_NAME_LEN], info['df_raw'])
+
+
+def excel_report(**all_info) -> List[Tuple[str, pd.DataFrame]]:
+    '''
+    Return a list with [(sheet_name: str, df: pd.DataFrame) ... ]
+    Any other keys of the diff's info (e.g. stage_timings) are ignored.
+    '''
+    return list(iter_excel_report(**all_info))
@@ -0,0 +1,120 @@
+import logging
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+from jinja2 import Environment, PackageLoader
+from vertica_python.vertica.cursor import Cursor
+
+from dbdiff.vertica import CatalogCache
+
+JINJA_ENV = Environment(loader=PackageLoader('dbdiff', 'templates'))
+LOGGER = logging.getLogger(__name__)
+# the columns of table_columns.sql, as read by vertica.get_column_info():
+TABLE_COLUMNS = ['column_name', 'data_type', 'is_nullable', 'ordinal_position']
+# the tables a diff leaves behind, by their suffixes (see cli.get_stages()), lowercase:
+OUTPUT_TABLE_RE = re.compile(r'^(\w+?)_(?:joined(?:_\d+)?|diff|dedup|dup)$')
+
+
+def get_schema_columns(cur: Cursor, schema_names: List[str]) -> Dict[Tuple[str, str], pd.DataFrame]:
+    '''The columns of every table and view in the schemas, from one catalog query.
+
+    Returns the columns of each table by (schema, table), lowercase,
+    as vertica.get_column_info() would, plus its primary_key_position (NULL if not in the primary key).
+    '''
+    q = JINJA_ENV.get_template('schema_columns.sql').render(schema_names=schema_names)
+    LOGGER.info(q)
+    cur.execute(q)
+    df = pd.DataFrame(cur.fetchall(), columns=['table_schema', 'table_name'] + TABLE_COLUMNS + ['primary_key_position'])
+    return {
+        (str(schema).lower(), str(table).lower()): columns.drop(columns=['table_schema', 'table_name']).reset_index(drop=True)
+        for (schema, table), columns in df.groupby(['table_schema', 'table_name'], sort=True)
+    }
+
+
+def fill_catalog_cache(cache: CatalogCache, schema_columns: Dict[Tuple[str, str], pd.DataFrame]) -> None:
+    '''Put the columns read by get_schema_columns() in `cache`, so that the diffs of the tables don't read them again.'''
+    for (schema, table), columns in schema_columns.items():
+        cache.put(schema, table, columns[TABLE_COLUMNS])
+
+
+def get_primary_key(columns: pd.DataFrame) -> List[str]:
+    '''The columns of the primary key of a table (from get_schema_columns()), in order, lowercase.'''
+    key = columns.loc[columns.primary_key_position.notnull(), :].sort_values('primary_key_position')
+    return [col.lower() for col in key.column_name]
+
+
+def get_join_cols(x_columns: pd.DataFrame, y_columns: pd.DataFrame, default_join_cols: Optional[List[str]] = None) -> Optional[List[str]]:
+    '''The join keys of a pair of tables: the primary key of x, or else of y, if all of its columns are in both,
+    or else `default_join_cols`, if all of them are in both. None if there are none.'''
+    x_names = set(x_columns.column_name.str.lower())
+    y_names = set(y_columns.column_name.str.lower())
+    for join_cols in (get_primary_key(x_columns), get_primary_key(y_columns), default_join_cols or []):
+        if join_cols and (set(join_cols) <= (x_names & y_names)):
+            return join_cols
+    return None
+
+
+def get_output_tables(tables: Set[str]) -> Set[str]:
+    '''The tables among `tables` (lowercase) that look left behind by the diff of another of them:
+    [table]_joined (and _joined_1, ... if split), _diff, _dedup and _dup,
+    where the table, or a part of its name before an underscore (e.g. x of the [x]_[y]_joined of diff-many), is one of `tables`.'''
+    output_tables = set()
+    for table in tables:
+        match = OUTPUT_TABLE_RE.match(table)
+        if match is None:
+            continue
+        parts = match.group(1).split('_')
+        if any('_'.join(parts[:i]) in tables for i in range(1, len(parts) + 1)):
+            output_tables.add(table)
+    return output_tables
+
+
+def get_schema_jobs(schema_columns: Dict[Tuple[str, str], pd.DataFrame],
+                    x_schema: str, y_schema: str,
+                    tables: Optional[List[str]] = None,
+                    default_join_cols: Optional[List[str]] = None,
+                    options: Optional[dict] = None) -> Dict[str, Any]:
+    '''Pair the tables of the two schemas by name, as batch jobs (see dbdiff.batch), with their join keys (see get_join_cols()).
+
+    `tables` limits the pairs to those tables, `options` are the diff options of every job.
+    Without `tables`, the tables left by earlier diffs (see get_output_tables()) are left out.
+    Returns:
+
+    - jobs: one per pair that has join keys.
+    - only_x, only_y: the names of the tables in only one of the schemas.
+    - skipped: the names of the pairs without join keys.
+    '''
+    x_tables = {table: columns for (schema, table), columns in schema_columns.items() if schema == x_schema.lower()}
+    y_tables = {table: columns for (schema, table), columns in schema_columns.items() if schema == y_schema.lower()}
+    if tables is not None:
+        tables = [table.lower() for table in tables]
+        x_tables = {table: x_tables[table] for table in tables if table in x_tables}
+        y_tables = {table: y_tables[table] for table in tables if table in y_tables}
+    else:
+        output_tables = get_output_tables(set(x_tables) | set(y_tables))
+        if output_tables:
+            LOGGER.info('Leaving out the tables of earlier diffs: ' + ', '.join(sorted(output_tables)) + '.')
+        x_tables = {table: columns for table, columns in x_tables.items() if table not in output_tables}
+        y_tables = {table: columns for table, columns in y_tables.items() if table not in output_tables}
+    jobs, skipped = [], []
+    for table in sorted(set(x_tables) & set(y_tables)):
+        join_cols = get_join_cols(x_tables[table], y_tables[table], default_join_cols)
+        if join_cols is None:
+            LOGGER.warning('Skipping {0}: it has no primary key in either schema, and the default join keys are not in both.'.format(table))
+            skipped.append(table)
+            continue
+        jobs.append({
+            'schema': x_schema,
+            'x_table': table,
+            'y_table': table,
+            'join_cols': join_cols,
+            'options': {**(options or {}), 'y_schema': y_schema},
+            'priority': 0
+        })
+    return {
+        'jobs': jobs,
+        'only_x': sorted(set(x_tables) - set(y_tables)),
+        'only_y': sorted(set(y_tables) - set(x_tables)),
+        'skipped': skipped,
+    }
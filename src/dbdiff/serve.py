@@ -0,0 +1,265 @@
+import json
+import logging
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import AbstractContextManager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from vertica_python.vertica.cursor import Cursor
+
+from dbdiff.batch import OutputLocks, get_job, get_job_key
+
+LOGGER = logging.getLogger(__name__)
+# how many finished jobs (and their events) to keep for GET /jobs/<id>:
+MAX_FINISHED_JOBS = 100
+# how long a GET /jobs/<id>/events waits for a new event before checking the connection again:
+EVENT_WAIT_SECONDS = 5.0
+# the names a job may use, as they go into the SQL and the names of the reports unquoted:
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_$]{0,127}')
+
+
+def check_identifiers(job: dict) -> None:
+    '''Raise ValueError unless every schema, table and column name of `job` (as from dbdiff.batch.get_job)
+    is a plain identifier.'''
+    names = {'schema': [job['schema']], 'x_table': [job['x_table']], 'y_table': [job['y_table']], 'join_cols': job['join_cols']}
+    for option in ('y_schema', 'output_schema'):
+        if job['options'].get(option):
+            names[option] = [job['options'][option]]
+    exclude_columns = job['options'].get('exclude_columns') or []
+    names['exclude_columns'] = exclude_columns.split(',') if isinstance(exclude_columns, str) else exclude_columns
+    for key, values in names.items():
+        for value in values:
+            if not (isinstance(value, str) and IDENTIFIER.fullmatch(value)):
+                raise ValueError('Not a valid {0}: {1!r}.'.format(key, value))
+
+
+class DiffService:
+    '''Runs diff jobs, as in a batch manifest (see dbdiff.batch.read_manifest), from a bounded queue.
+
+    `workers` threads each take the next job from the queue, get a cursor from `acquire(discard=...)`
+    (e.g. CursorPool.acquire, so the connections stay open between jobs), and call `run_job(cur, job)`
+    with a `progress` callback added to the job's options, which records the events of the job.
+    submit() raises queue.Full if `max_queue` jobs are already waiting,
+    and ValueError if the names in the job aren't plain identifiers (see check_identifiers()).
+    The jobs that write any of the same tables and reports (see dbdiff.batch.get_output_keys()),
+    run one after the other, the later ones keeping their worker waiting.
+
+    Each job has an id, a status (queued, running, ok, error or cancelled),
+    its events in order, and the result of run_job or the error once it is done.
+    '''
+
+    def __init__(self,
+                 run_job: Callable[[Cursor, dict], Dict[str, Any]],
+                 acquire: Callable[..., AbstractContextManager],
+                 workers: int = 2,
+                 max_queue: int = 16):
+        self.run_job = run_job
+        self.acquire = acquire
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._jobs: Dict[str, dict] = {}
+        # guards _jobs, and is notified on each new event:
+        self._changed = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._output_locks = OutputLocks()
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name='dbdiff-serve-{0}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        '''Cancel the queued jobs, and wait for the running ones to finish.'''
+        self._stopping = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _add_event(self, job_id: str, event: dict) -> None:
+        with self._changed:
+            job = self._jobs[job_id]
+            job['events'].append({'time': time.time(), **event})
+            if event['event'] in {'started', 'finished'}:
+                job['status'] = event['status']
+            self._changed.notify_all()
+
+    def submit(self, job: dict) -> str:
+        '''Queue `job`, checked with dbdiff.batch.get_job and check_identifiers(), and return its id.'''
+        job = get_job(job)
+        check_identifiers(job)
+        job_id = uuid.uuid4().hex
+        with self._changed:
+            self._jobs[job_id] = {
+                'id': job_id,
+                'key': get_job_key(job),
+                'status': 'queued',
+                'events': [{'time': time.time(), 'event': 'queued', 'status': 'queued'}],
+                'result': None,
+                'error': None
+            }
+            try:
+                self._queue.put_nowait((job_id, job))
+            except queue.Full:
+                del self._jobs[job_id]
+                raise
+            self._prune()
+            self._changed.notify_all()
+        return job_id
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in {'ok', 'error', 'cancelled'}]
+        # dicts keep the order the jobs were submitted in:
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job_id, job = item
+            if self._stopping:
+                self._add_event(job_id, {'event': 'finished', 'status': 'cancelled'})
+                continue
+            with self._output_locks.hold(job):
+                self._run(job_id, job)
+
+    def _run(self, job_id: str, job: dict) -> None:
+        key = self._jobs[job_id]['key']
+        LOGGER.info('Starting job ' + key + ' (' + job_id + ').')
+        self._add_event(job_id, {'event': 'started', 'status': 'running'})
+        job = {**job, 'options': {**job['options'], 'progress': lambda event: self._add_event(job_id, event)}}
+        start = time.monotonic()
+        try:
+            with self.acquire(discard=job['options'].get('case_insensitive', False)) as cur:
+                result = self.run_job(cur, job)
+        except Exception as e:
+            LOGGER.exception('Job ' + key + ' (' + job_id + ') failed.')
+            with self._changed:
+                self._jobs[job_id]['error'] = str(e)
+            self._add_event(job_id, {'event': 'finished', 'status': 'error', 'duration': time.monotonic() - start})
+            return
+        LOGGER.info('Finished job ' + key + ' (' + job_id + ').')
+        with self._changed:
+            self._jobs[job_id]['result'] = result
+        self._add_event(job_id, {'event': 'finished', 'status': 'ok', 'duration': time.monotonic() - start})
+
+    def get(self, job_id: str) -> Optional[dict]:
+        '''A copy of the job, or None if there is no such job (or it was dropped to keep MAX_FINISHED_JOBS).'''
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return None if job is None else {**job, 'events': list(job['events'])}
+
+    def get_jobs(self) -> List[dict]:
+        with self._changed:
+            return [{'id': job['id'], 'key': job['key'], 'status': job['status']} for job in self._jobs.values()]
+
+    def wait_events(self, job_id: str, since: int, timeout: float) -> Tuple[List[dict], bool]:
+        '''Wait up to `timeout` seconds for events of the job after the first `since`.
+        Returns those events, and whether the job is done (no more events will come).'''
+        with self._changed:
+            self._changed.wait_for(lambda: (job_id not in self._jobs) or (len(self._jobs[job_id]['events']) > since), timeout=timeout)
+            job = self._jobs.get(job_id)
+            if job is None:
+                return [], True
+            return job['events'][since:], job['status'] in {'ok', 'error', 'cancelled'}
+
+    def health(self) -> dict:
+        with self._changed:
+            statuses = [job['status'] for job in self._jobs.values()]
+        return {
+            'status': 'stopping' if self._stopping else 'ok',
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'queued': statuses.count('queued'),
+            'running': statuses.count('running'),
+        }
+
+
+class DiffHandler(BaseHTTPRequestHandler):
+    '''The HTTP/JSON API of a DiffService (set as the `service` of the server):
+
+    - GET /health: the number of queued and running jobs.
+    - POST /jobs: queue the job in the body (as in a batch manifest), returns its id, or 503 if the queue is full
+      (400 if the job is not valid).
+    - GET /jobs: the id, key and status of each job.
+    - GET /jobs/<id>: the job, its events, and its result (or error) once done.
+    - GET /jobs/<id>/events: streams the events of the job as JSON lines, ending with its result.
+    '''
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, format: str, *args) -> None:
+        LOGGER.debug(format % args)
+
+    def send_json(self, status: int, body: Any) -> None:
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        service: DiffService = self.server.service  # type: ignore
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        if parts == ['health']:
+            self.send_json(200, service.health())
+        elif parts == ['jobs']:
+            self.send_json(200, service.get_jobs())
+        elif (len(parts) in {2, 3}) and (parts[0] == 'jobs') and (service.get(parts[1]) is None):
+            self.send_json(404, {'error': 'No job ' + parts[1] + '.'})
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            self.send_json(200, service.get(parts[1]))
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+            self.stream_events(service, parts[1])
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+    def stream_events(self, service: DiffService, job_id: str) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        since = 0
+        done = False
+        while not done:
+            events, done = service.wait_events(job_id, since, EVENT_WAIT_SECONDS)
+            since += len(events)
+            for event in events:
+                self.wfile.write((json.dumps(event, default=str) + '\n').encode())
+            self.wfile.flush()
+        job = service.get(job_id) or {'status': 'unknown', 'result': None, 'error': 'The job was dropped.'}
+        self.wfile.write((json.dumps({'event': 'done', 'status': job['status'], 'result': job['result'], 'error': job['error']}, default=str) + '\n').encode())
+
+    def do_POST(self) -> None:
+        service: DiffService = self.server.service  # type: ignore
+        if self.path.split('?')[0].rstrip('/') != '/jobs':
+            self.send_json(404, {'error': 'Not found.'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            job_id = service.submit(body)
+        except queue.Full:
+            self.send_json(503, {'error': 'The queue is full ({0} jobs), try again later.'.format(service.max_queue)})
+        except (ValueError, TypeError, AttributeError, RuntimeError) as e:
+            self.send_json(400, {'error': str(e)})
+        else:
+            self.send_json(202, {'id': job_id})
+
+
+class DiffServer(ThreadingMixIn, HTTPServer):
+    '''Serves the API of `service` (see DiffHandler) on (host, port), each request in its own thread.'''
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: DiffService):
+        super().__init__(address, DiffHandler)
+        self.service = service
@@ -0,0 +1,246 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from vertica_python.vertica.cursor import Cursor
+
+from dbdiff.telemetry import StageTelemetry
+from dbdiff.vertica import CursorPool
+
+LOGGER = logging.getLogger(__name__)
+# how often to check the running stages for timeouts (and let Ctrl-C through),
+# and to repeat the cancel of statements still running after an interruption:
+POLL_SECONDS = 1.0
+
+
+class Stage(NamedTuple):
+    '''One step of a diff.
+
+    - name: unique name of the stage, its result is stored under this name.
+    - run: called as run(cur, results), where results has the results of all finished stages.
+    - depends: names of the stages that must finish before this one starts.
+    '''
+    name: str
+    run: Callable[[Cursor, Dict[str, Any]], Any]
+    depends: Tuple[str, ...] = ()
+
+
+class StagesInterrupted(RuntimeError):
+    '''Raised by run_stages() when a stage ran past its timeout, or on Ctrl-C (SIGINT).
+
+    Has the results and timings of the stages that finished before,
+    and all_info, for callers that can build a partial report from them.'''
+
+    def __init__(self, message: str, results: Dict[str, Any], timings: Dict[str, dict]):
+        super().__init__(message)
+        self.results = results
+        self.timings = timings
+        self.all_info: Optional[dict] = None
+
+
+def cancel_statement(cur: Cursor) -> None:
+    '''Ask the server to cancel the statement running on `cur`, from any thread.'''
+    connection = getattr(cur, 'connection', None)
+    if connection is None:
+        return
+    try:
+        connection.cancel()
+    except Exception:
+        LOGGER.exception('Could not cancel the running statement.')
+
+
+def check_stages(stages: List[Stage]) -> None:
+    '''Raise if a stage depends on an unknown stage, or the dependencies have a cycle.'''
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        unknown = set(stage.depends) - names
+        if unknown:
+            raise RuntimeError('Stage `{0}` depends on unknown stage(s): {1}.'.format(stage.name, ', '.join(sorted(unknown))))
+    done: set = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if set(stage.depends) <= done]
+        if not ready:
+            raise RuntimeError('Stages have a dependency cycle: ' + ', '.join(stage.name for stage in remaining) + '.')
+        done.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage.name not in done]
+
+
+def get_scoped_results(results: Dict[str, Any], prefix: str, shared: set) -> Dict[str, Any]:
+    '''The results of the stages scoped with `prefix` (see scope_stages()), and of the shared ones, by their own names.'''
+    # a copy, the results are added to by the main thread as the stages finish:
+    results = dict(results)
+    scoped = {name: result for name, result in results.items() if name in shared}
+    scoped.update({name[len(prefix):]: result for name, result in results.items() if name.startswith(prefix)})
+    return scoped
+
+
+def scope_stages(stage_sets: List[Tuple[str, List[Stage]]], shared: set) -> List[Stage]:
+    '''Combine several sets of stages (e.g. the diffs of one table against several others) into one,
+    to run together with run_stages().
+
+    The stages of each set are renamed with its prefix (e.g. 'public.y_table:joined'),
+    except the `shared` ones, which are only taken from the first set and run once for all of them.
+    Each stage still sees the results of its own set, and of the shared stages, under their plain names
+    (see get_scoped_results()).
+    '''
+    combined = []
+    for i, (prefix, stages) in enumerate(stage_sets):
+
+        def scoped_run(run: Callable[[Cursor, Dict[str, Any]], Any], prefix: str = prefix):
+            def run_scoped(cur: Cursor, results: Dict[str, Any]) -> Any:
+                return run(cur, get_scoped_results(results, prefix, shared))
+            return run_scoped
+
+        for stage in stages:
+            if (stage.name in shared) and (i > 0):
+                continue
+            combined.append(Stage(
+                stage.name if stage.name in shared else prefix + stage.name,
+                scoped_run(stage.run),
+                tuple(name if name in shared else prefix + name for name in stage.depends)
+            ))
+    return combined
+
+
+def get_critical_path(stages: List[Stage], timings: Dict[str, dict]) -> List[str]:
+    '''Walk back from the last stage to finish, through the dependency that finished last each time.
+    That chain is what bounded the wall clock time.'''
+    depends = {stage.name: stage.depends for stage in stages}
+    finished = [name for name in depends if name in timings]
+    if not finished:
+        return []
+    path = [max(finished, key=lambda name: timings[name]['end'])]
+    while True:
+        parents = [name for name in depends[path[-1]] if name in timings]
+        if not parents:
+            break
+        path.append(max(parents, key=lambda name: timings[name]['end']))
+    return path[::-1]
+
+
+def log_critical_path(stages: List[Stage], timings: Dict[str, dict]) -> None:
+    path = get_critical_path(stages, timings)
+    if not path:
+        return
+    wall = max(t['end'] for t in timings.values()) - min(t['start'] for t in timings.values())
+    busy = sum(t['end'] - t['start'] for t in timings.values())
+    LOGGER.info('Critical path ({0:.1f}s of {1:.1f}s wall clock, {2:.1f}s of stage time in total): '.format(
+        sum(timings[name]['end'] - timings[name]['start'] for name in path), wall, busy
+    ) + ' -> '.join('{0} ({1:.1f}s)'.format(name, timings[name]['end'] - timings[name]['start']) for name in path))
+
+
+def run_stages(stages: List[Stage],
+               cur: Cursor,
+               pool: Optional[CursorPool] = None,
+               prepare_cur: Optional[Callable[[Cursor], None]] = None,
+               stage_timeout: Optional[float] = None,
+               progress: Optional[Callable[[dict], None]] = None,
+               telemetry: Optional[StageTelemetry] = None) -> Tuple[Dict[str, Any], Dict[str, dict]]:
+    '''Run the stages as soon as their dependencies have finished.
+
+    Without a pool, the stages run one at a time on `cur`.
+    With a pool, independent stages overlap, each on its own pooled cursor,
+    up to the size of the pool.
+    prepare_cur(cur) is called on each pooled cursor before a stage uses it
+    (e.g. for session settings), and those connections are not reused afterwards.
+
+    Returns the result of each stage and the start and end time of each stage, by name.
+    The critical path through the stages is logged at the end.
+
+    If a stage runs for more than `stage_timeout` seconds, or on Ctrl-C,
+    the statements still running are cancelled on the server, no more stages are started,
+    and StagesInterrupted is raised with the results of the stages that finished.
+
+    progress(event), if given, is called (from the thread running the stage) as each stage starts and finishes, with
+    {'event': 'stage_started', 'stage': name} or {'event': 'stage_finished', 'stage': name, 'seconds': duration}.
+    With `telemetry`, the cursor of each stage is registered with it while the stage runs.
+    '''
+    check_stages(stages)
+    workers = 1 if pool is None else pool.size
+    results: Dict[str, Any] = {}
+    timings: Dict[str, dict] = {}
+    # the cursor of each running stage, to cancel its statement:
+    stage_curs: Dict[str, Cursor] = {}
+
+    @contextmanager
+    def stage_cur():
+        if pool is None:
+            yield cur
+        else:
+            with pool.acquire(discard=(prepare_cur is not None)) as pooled_cur:
+                if prepare_cur is not None:
+                    prepare_cur(pooled_cur)
+                yield pooled_cur
+
+    def run_one(stage: Stage) -> Any:
+        with stage_cur() as c:
+            LOGGER.info('Starting stage: ' + stage.name + '.')
+            if telemetry is not None:
+                telemetry.register(stage.name, c)
+            stage_curs[stage.name] = c
+            timings[stage.name] = {'start': time.monotonic()}
+            if progress is not None:
+                progress({'event': 'stage_started', 'stage': stage.name})
+            try:
+                result = stage.run(c, results)
+            finally:
+                del stage_curs[stage.name]
+                if telemetry is not None:
+                    telemetry.unregister(stage.name)
+            timings[stage.name]['end'] = time.monotonic()
+            seconds = timings[stage.name]['end'] - timings[stage.name]['start']
+            LOGGER.info('Finished stage: ' + stage.name + ' in {0:.1f}s.'.format(seconds))
+            if progress is not None:
+                progress({'event': 'stage_finished', 'stage': stage.name, 'seconds': seconds})
+            return result
+
+    def get_wait_timeout() -> float:
+        if stage_timeout is None:
+            return POLL_SECONDS
+        now = time.monotonic()
+        started = [timings[stage.name]['start'] for stage in running.values() if stage.name in timings]
+        return max(0.0, min([start + stage_timeout - now for start in started] + [POLL_SECONDS, stage_timeout]))
+
+    pending = list(stages)
+    running: dict = {}
+    interrupted = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while pending or running:
+                ready = [stage for stage in pending if all(name in results for name in stage.depends)]
+                for stage in ready:
+                    pending.remove(stage)
+                    running[executor.submit(run_one, stage)] = stage
+                done, _ = wait(running, timeout=get_wait_timeout(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    # re-raises the exception of a failed stage:
+                    results[stage.name] = future.result()
+                if stage_timeout is not None:
+                    late = [stage.name for stage in running.values()
+                            if (stage.name in timings) and (time.monotonic() - timings[stage.name]['start'] >= stage_timeout)]
+                    if late:
+                        interrupted = 'Stage(s) ' + ', '.join(late) + ' ran for more than {0:g}s.'.format(stage_timeout)
+                        break
+        except KeyboardInterrupt:
+            interrupted = 'Interrupted.'
+
+        if interrupted is not None:
+            LOGGER.warning(interrupted + ' Cancelling the running stages: ' + ', '.join(stage.name for stage in running.values()) + '.')
+            for future in running:
+                future.cancel()
+            while running:
+                for c in list(stage_curs.values()):
+                    cancel_statement(c)
+                done, _ = wait(running, timeout=POLL_SECONDS)
+                for future in done:
+                    stage = running.pop(future)
+                    if (not future.cancelled()) and (future.exception() is None):
+                        results[stage.name] = future.result()
+            raise StagesInterrupted(interrupted, results, timings)
+
+    log_critical_path(stages, timings)
+    return results, timings
@@ -0,0 +1,129 @@
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import weakref
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+
+def close_store(connection: sqlite3.Connection, path: Optional[Path]) -> None:
+    connection.close()
+    if (path is not None) and path.exists():
+        path.unlink()
+
+
+class ColumnStore(MutableMapping):
+    '''The column_info of a diff (column name: info dict, see main.get_column_diffs_from_joined),
+    kept in a SQLite file in `spill_dir` rather than in memory.
+
+    Each column's info, samples and all, is pickled to the file when it is set,
+    and read back from it on each access, so only the counts of the columns stay in memory.
+    Iterating goes through the columns by most differences first, as the reports list them.
+    The file is removed once the store is closed (at the end of the run, see close_columns()) or garbage collected.
+
+    With `path`, the store in that file is opened instead (e.g. a copy from keep()), and the file is kept once closed.
+    Pickling a store pickles the path of its file, which is opened again when unpickled,
+    so a store that outlives the run (e.g. in the run cache) is pickled as its copy (see keep_columns()).
+    '''
+
+    def __init__(self, spill_dir: Optional[Path] = None, path: Optional[Path] = None):
+        if path is None:
+            if spill_dir is not None:
+                Path(spill_dir).mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='dbdiff_columns_', suffix='.sqlite', dir=spill_dir)
+            os.close(fd)
+            self.path = Path(temp_path)
+        else:
+            self.path = Path(path)
+        # set by the column diffs stage, read by the next stages and the report, each in its own thread:
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS columns (name TEXT PRIMARY KEY, count INTEGER, info BLOB)')
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = dict(self._connection.execute('SELECT name, count FROM columns').fetchall())
+        self._finalizer = weakref.finalize(self, close_store, self._connection, self.path if path is None else None)
+
+    def __setitem__(self, column: str, info: dict) -> None:
+        data = pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO columns (name, count, info) VALUES (?, ?, ?)', (column, info['count'], data))
+            self._connection.commit()
+            self._counts[column] = info['count']
+        LOGGER.debug('Spilled the diff of column {0} ({1:,} bytes) to {2}.'.format(column, len(data), self.path))
+
+    def __getitem__(self, column: str) -> dict:
+        with self._lock:
+            row = self._connection.execute('SELECT info FROM columns WHERE name = ?', (column,)).fetchone()
+        if row is None:
+            raise KeyError(column)
+        return pickle.loads(row[0])
+
+    def __delitem__(self, column: str) -> None:
+        with self._lock:
+            if column not in self._counts:
+                raise KeyError(column)
+            self._connection.execute('DELETE FROM columns WHERE name = ?', (column,))
+            self._connection.commit()
+            del self._counts[column]
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            counts = dict(self._counts)
+        return iter(sorted(counts, key=lambda column: counts[column], reverse=True))
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def __contains__(self, column: Any) -> bool:
+        return column in self._counts
+
+    def counts(self) -> Dict[str, int]:
+        '''The # of differences of each column, by most first, without reading the file.'''
+        with self._lock:
+            counts = dict(self._counts)
+        return {column: counts[column] for column in sorted(counts, key=lambda column: counts[column], reverse=True)}
+
+    def keep(self, path: Path) -> 'ColumnStore':
+        '''A copy of the store in `path`, which is kept once closed.'''
+        target = sqlite3.connect(str(path))
+        with self._lock:
+            self._connection.backup(target)
+        target.close()
+        return ColumnStore(path=path)
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def __reduce__(self):
+        return (ColumnStore, (None, self.path))
+
+
+def get_column_counts(column_info: Mapping[str, dict]) -> Dict[str, int]:
+    '''The # of differences of each column of a column_info, a dict or a ColumnStore (without loading its samples)
+    or anything else with such counts().'''
+    counts = getattr(column_info, 'counts', None)
+    if counts is not None:
+        return counts()
+    return {column: info['count'] for column, info in column_info.items()}
+
+
+def keep_columns(column_info: Mapping[str, dict], path: Path) -> Mapping[str, dict]:
+    '''A column_info that outlives the run, e.g. for the run cache: a ColumnStore (or anything else with such keep())
+    copied to `path`, a dict as it is.'''
+    keep = getattr(column_info, 'keep', None)
+    if keep is not None:
+        return keep(path)
+    return column_info
+
+
+def close_columns(column_info: Mapping[str, dict]) -> None:
+    '''Close a column_info kept on disk (a ColumnStore, or anything else with such close()) at the end of the run,
+    which removes its file unless it was opened from a copy.'''
+    close = getattr(column_info, 'close', None)
+    if close is not None:
+        close()
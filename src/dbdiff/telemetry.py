@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, Optional, Tuple
+
+from jinja2 import Environment, PackageLoader
+from vertica_python.vertica.cursor import Cursor
+
+JINJA_ENV = Environment(loader=PackageLoader('dbdiff', 'templates'))
+LOGGER = logging.getLogger(__name__)
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return 'unknown'
+    if seconds < 60:
+        return '{0:.0f}s'.format(seconds)
+    if seconds < 3600:
+        return '{0:.0f}m'.format(seconds / 60)
+    return '{0:.1f}h'.format(seconds / 3600)
+
+
+class StageTelemetry:
+    '''Follow the statements of the running stages in Vertica's monitoring tables.
+
+    Each stage registers the cursor it runs on (see run_stages()), which is asked for its session once.
+    Every `interval` seconds, a separate connection from `connect()` (e.g. vertica.get_cur)
+    reads the executing statements of those sessions from query_profiles,
+    with their rows produced (and the optimizer's estimate) and rows scanned from execution_engine_profiles,
+    their memory in use from resource_acquisitions, and their spill events from query_events.
+    Each sample is logged with the ETA of the running statement (from its rows produced so far against the estimate),
+    and passed to progress(event), if given, as {'event': 'stage_telemetry', 'stage': name, ...}.
+
+    summary() has the peak memory, rows scanned, and spill events of each stage.
+    These are sampled: statements that finish between two samples aren't counted.
+    Use as a context manager to start and stop the sampling.
+    '''
+
+    def __init__(self,
+                 connect: Callable[[], ContextManager[Cursor]],
+                 interval: float = 30.0,
+                 progress: Optional[Callable[[dict], None]] = None):
+        self.connect = connect
+        self.interval = interval
+        self.progress = progress
+        # session id and start time of each running stage:
+        self._running: Dict[str, Tuple[str, float]] = {}
+        self._stats: Dict[str, dict] = {}
+        # the first time each statement was seen, for its ETA:
+        self._statement_starts: Dict[Tuple[Any, Any], float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, stage: str, cur: Cursor) -> None:
+        '''Called from the stage's thread, before it runs, while `cur` is idle.'''
+        cur.execute('SELECT CURRENT_SESSION() AS session_id;')
+        rows = cur.fetchall()
+        if not rows:
+            return
+        with self._lock:
+            self._running[stage] = (rows[0]['session_id'], time.monotonic())
+            self._stats[stage] = {'peak_memory_kb': 0, 'rows_scanned': 0, 'spill_events': 0, 'samples': 0, 'statements': {}}
+
+    def unregister(self, stage: str) -> None:
+        with self._lock:
+            self._running.pop(stage, None)
+
+    def sample(self, cur: Cursor) -> None:
+        '''Read the executing statements of the running stages once, on the monitoring cursor.'''
+        with self._lock:
+            running = dict(self._running)
+        if not running:
+            return
+        cur.execute(JINJA_ENV.get_template('stage_telemetry.sql').render(session_ids=sorted({session_id for session_id, start in running.values()})))
+        rows = cur.fetchall()
+        now = time.monotonic()
+        for stage, (session_id, stage_start) in running.items():
+            statements = [row for row in rows if row['session_id'] == session_id]
+            with self._lock:
+                stats = self._stats.get(stage)
+                if stats is None:
+                    continue
+                stats['samples'] += 1
+                stats['peak_memory_kb'] = max([stats['peak_memory_kb']] + [row['memory_kb'] for row in statements])
+                for row in statements:
+                    seen = stats['statements'].setdefault((row['transaction_id'], row['statement_id']), {'rows_scanned': 0, 'spill_events': 0})
+                    seen['rows_scanned'] = max(seen['rows_scanned'], row['rows_scanned'])
+                    seen['spill_events'] = max(seen['spill_events'], row['spill_events'])
+                stats['rows_scanned'] = sum(seen['rows_scanned'] for seen in stats['statements'].values())
+                stats['spill_events'] = sum(seen['spill_events'] for seen in stats['statements'].values())
+            for row in statements:
+                key = (row['transaction_id'], row['statement_id'])
+                statement_start = self._statement_starts.setdefault(key, now)
+                done = (row['rows_produced'] / row['rows_estimated']) if row['rows_estimated'] else None
+                eta = None
+                # from the second sample of a statement on:
+                if (done is not None) and (0 < done < 1) and (now > statement_start):
+                    eta = (now - statement_start) * (1 - done) / done
+                event = {
+                    'event': 'stage_telemetry',
+                    'stage': stage,
+                    'seconds': now - stage_start,
+                    'rows_produced': row['rows_produced'],
+                    'rows_estimated': row['rows_estimated'],
+                    'rows_scanned': row['rows_scanned'],
+                    'memory_kb': row['memory_kb'],
+                    'spill_events': row['spill_events'],
+                    'eta': eta,
+                }
+                LOGGER.info('Stage {0} ({1:.0f}s): {2:,} of ~{3:,} rows produced{4}, {5:,} rows scanned, {6:,.0f} MB of memory, {7} spill event(s), statement ETA {8}.'.format(
+                    stage, now - stage_start, row['rows_produced'], row['rows_estimated'],
+                    '' if done is None else ' ({0:.0%})'.format(min(done, 1)),
+                    row['rows_scanned'], row['memory_kb'] / 1024, row['spill_events'], format_eta(eta)
+                ))
+                if self.progress is not None:
+                    self.progress(event)
+
+    def summary(self) -> Dict[str, dict]:
+        '''The peak memory (KB), rows scanned and spill events seen for each stage, and the # of samples.'''
+        with self._lock:
+            return {stage: {k: v for k, v in stats.items() if k != 'statements'} for stage, stats in self._stats.items()}
+
+    def _run(self) -> None:
+        try:
+            with self.connect() as cur:
+                while not self._stop.wait(self.interval):
+                    try:
+                        self.sample(cur)
+                    except Exception:
+                        LOGGER.exception('Could not read the telemetry of the running stages.')
+        except Exception:
+            LOGGER.exception('Could not connect to read the telemetry of the running stages.')
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name='dbdiff-telemetry', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
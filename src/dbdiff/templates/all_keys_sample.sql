@@ -1,10 +1,11 @@
+{% from "join_on.sql" import join_on, key_hash -%}
+{% from "sample_order.sql" import sample_order -%}
 SELECT {% for col in join_cols -%}
                    {% if x %}x{% else %}y{% endif %}.{{ col }} AS {{ col }}{% if not loop.last %},
                    {% endif %}{% endfor %}
               FROM {{ x_schema }}.{{ x_table }} x
    FULL OUTER JOIN {{ y_schema }}.{{ y_table }} y
-                   ON {% for col in join_cols %}x.{{ col }} <=> y.{{ col }}{% if not loop.last %} AND {% endif %}
-                   {% endfor -%}
+                   ON {{ join_on(join_cols, not_null_keys, x_hash=(key_hash(hash_cols, 'x.') if hash_keys), y_hash=(key_hash(hash_cols, 'y.') if hash_keys)) }}
                    WHERE {% if x %}y{% else %}x{% endif %}.{{ join_cols[0] }} IS NULL
-                   ORDER BY {% for col in join_cols %}{% if x %}x{% else %}y{% endif %}.{{ col }}{% if not loop.last %}, {% endif %}{% endfor %}
+                   {{ sample_order(sample, join_cols, 'x.' if x else 'y.') }}
                    LIMIT {{ max_rows_column }}
\ No newline at end of file
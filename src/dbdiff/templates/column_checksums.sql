@@ -0,0 +1,7 @@
+SELECT COUNT(*) AS row_count,
+       SUM(HASH({{ join_cols|join(", ") }}) % 4294967296) AS key_hash
+       {%- for column in columns %},
+       SUM(HASH({{ join_cols|join(", ") }}, {{ column }}) % 4294967296) AS hash_{{ loop.index }},
+       COUNT({{ column }}) AS count_{{ loop.index }}
+       {%- endfor %}
+  FROM {{ schema_name }}.{{ table_name }}
@@ -0,0 +1,7 @@
+SELECT COUNT(*) AS row_count{% for col, is_numeric in columns %},
+       COUNT({{ col }}) AS count_{{ loop.index0 }},
+       MIN({{ col }}) AS min_{{ loop.index0 }},
+       MAX({{ col }}) AS max_{{ loop.index0 }},
+       APPROXIMATE_COUNT_DISTINCT({{ col }}) AS distinct_{{ loop.index0 }}{% if is_numeric %},
+       AVG({{ col }}) AS mean_{{ loop.index0 }}{% endif %}{% endfor %}
+  FROM {{ schema_name }}.{{ table_name }}
\ No newline at end of file
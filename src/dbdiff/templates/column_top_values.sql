@@ -0,0 +1,14 @@
+SELECT column_index, value, ct
+  FROM (
+    SELECT column_index, value, ct,
+           ROW_NUMBER() OVER (PARTITION BY column_index ORDER BY ct DESC, value) AS rn
+      FROM (
+        SELECT CASE {% for col in columns %}WHEN GROUPING({{ col }}) = 0 THEN {{ loop.index0 }} {% endfor %}END AS column_index,
+               CASE {% for col in columns %}WHEN GROUPING({{ col }}) = 0 THEN {{ col }}::VARCHAR {% endfor %}END AS value,
+               COUNT(*) AS ct
+          FROM {{ schema_name }}.{{ table_name }}
+      GROUP BY GROUPING SETS ({% for col in columns %}({{ col }}){% if not loop.last %}, {% endif %}{% endfor %})
+           ) grouped
+       ) ranked
+ WHERE rn <= {{ limit }}
+ ORDER BY column_index, ct DESC, value
\ No newline at end of file
@@ -1,11 +1,4 @@
-    SELECT x.*
+    SELECT {{ columns|join(", ") }}
 {% if not use_temp_table %}INTO {{ schema_name }}.{{ table_name_dedup }}{% endif %}
-      FROM {{ schema_name }}.{{ table_name }} x
-INNER JOIN (
-    SELECT {{ group_cols }},
-           COUNT(*) AS dup_count
-      FROM {{ schema_name }}.{{ table_name }}
-  GROUP BY {{ group_cols }}
-           ) y
-           ON {{ join_cols }}
-     WHERE y.dup_count = 1
\ No newline at end of file
+      FROM v_temp_schema.{{ table_name_dup_count }}
+     WHERE dup_count = 1
@@ -0,0 +1,3 @@
+    SELECT x.*,
+           COUNT(*) OVER (PARTITION BY {{ group_cols }}) AS dup_count
+      FROM {{ schema_name }}.{{ table_name }} x
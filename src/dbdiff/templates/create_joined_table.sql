@@ -1,4 +1,7 @@
 CREATE TABLE {{ joined_schema }}.{{ joined_table }} (
+    {% if hash_keys %}
+    join_hash INT,
+    {% endif %}
     {% for i, row in compare_cols.iterrows() %}
     {% if row.name in join_cols %}
     {{ row.name }} {{ row.x_dtype }}
@@ -9,5 +12,10 @@ CREATE TABLE {{ joined_schema }}.{{ joined_table }} (
     {% if not loop.last %},{% endif %}
     {% endfor %}
 )
+{% if hash_keys %}
+ORDER BY join_hash
+SEGMENTED BY HASH(join_hash) ALL NODES
+{% else %}
 ORDER BY {{ join_cols|join(", ") }}
+{% endif %}
 ;
@@ -10,5 +10,5 @@
        INTO {{ joined_schema }}.{{ joined_table }}
        FROM {{ x_schema }}.{{ x_table }} AS x
  INNER JOIN {{ y_schema }}.{{ y_table }} AS y
-            ON {% for col in join_cols %}x.{{ col }} <=> y.{{ col }}{% if not loop.last %} AND {% endif %}
+            ON {% for col in join_cols %}x.{{ col }} {% if col in not_null_keys %}={% else %}<=>{% endif %} y.{{ col }}{% if not loop.last %} AND {% endif %}
             {% endfor %}
\ No newline at end of file
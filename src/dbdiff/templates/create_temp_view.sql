@@ -0,0 +1 @@
+CREATE LOCAL TEMP VIEW {{ table_name }} AS {{ query }}
\ No newline at end of file
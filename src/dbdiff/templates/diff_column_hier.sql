@@ -1,5 +1,6 @@
+{% from "sample_order.sql" import sample_order -%}
         SELECT {{ join_cols }},
                {{ column }}
           FROM {{ schema }}.{{ table }}
-         WHERE {{ first_join_col }} IN (SELECT {{ first_join_col }} FROM {{ diff_schema }}.{{ diff_table }} WHERE column_name = '{{ column }}' GROUP BY {{ first_join_col }} ORDER BY {{ first_join_col }} {% if limit %}LIMIT {{ limit }}{% endif %})
-      ORDER BY {{ join_cols }}
\ No newline at end of file
+         WHERE {{ first_join_col }} IN (SELECT {{ first_join_col }} FROM {{ diff_schema }}.{{ diff_table }} WHERE column_name = '{{ column }}' GROUP BY {{ first_join_col }} {{ sample_order(sample, [first_join_col]) }} {% if limit %}LIMIT {{ limit }}{% endif %})
+      {% if sample == 'ordered' %}ORDER BY {{ join_cols }}{% elif sample == 'hash' %}ORDER BY HASH({{ join_cols }}){% endif %}
\ No newline at end of file
@@ -0,0 +1,9 @@
+SELECT COUNT(*) AS group_count,
+       SUM(dup_count) AS row_count,
+       MAX(dup_count) AS max_dup_count
+  FROM (
+    SELECT {{ group_cols }},
+           MAX(dup_count) AS dup_count
+      FROM {{ schema_name }}.{{ table_name }}
+  GROUP BY {{ group_cols }}
+       ) groups
@@ -1,9 +1,10 @@
 {% extends "first_key_base.sql" %}
+{% from "sample_order.sql" import sample_order %}
 {% block select %}
          SELECT {% if x %}x{% else %}y{% endif %}.{{ join_col }} AS {{ join_col }}
 {% endblock %}
 {% block orderby %}
-                ORDER BY {% if x %}x{% else %}y{% endif %}.{{ join_col }}
+                {{ sample_order(sample, [join_col], 'x.' if x else 'y.') }}
 {% endblock %}
 {% block limit %}
                 LIMIT {{ max_rows_column }}
@@ -1,4 +1,8 @@
+{% from "join_on.sql" import join_on, key_hash -%}
 INSERT INTO {{ joined_schema }}.{{ joined_table }} (
+    {%- if hash_keys %}
+    join_hash,
+    {%- endif %}
     {%- for i, row in compare_cols.iterrows() %}
     {% if row.name in join_cols -%}
     {{- row.name -}}
@@ -10,7 +14,8 @@ INSERT INTO {{ joined_schema }}.{{ joined_table }} (
     {%- endfor %}
 )
 (
-     SELECT {% for i, row in compare_cols.iterrows() -%}
+     SELECT {% if hash_keys %}{{ key_hash(hash_cols, 'x.') }} AS join_hash,
+            {% endif %}{% for i, row in compare_cols.iterrows() -%}
             {%- if row.name in join_cols -%}
             COALESCE(x.{{ row.name }}, y.{{ row.name }}) AS {{ row.name -}}
             {%- else -%}
@@ -21,6 +26,5 @@ INSERT INTO {{ joined_schema }}.{{ joined_table }} (
             {% endfor %}
        FROM {{ x_schema }}.{{ x_table }} AS x
  INNER JOIN {{ y_schema }}.{{ y_table }} AS y
-            ON {% for col in join_cols %}x.{{ col }} <=> y.{{ col }}{% if not loop.last %} AND {% endif %}
-            {% endfor %}
+            ON {{ join_on(join_cols, not_null_keys, x_hash=(key_hash(hash_cols, 'x.') if hash_keys), y_hash=(key_hash(hash_cols, 'y.') if hash_keys)) }}
 )
\ No newline at end of file
@@ -0,0 +1,9 @@
+{#- the join on the keys of two tables, see main.create_joined_table() -#}
+{%- macro key_hash(cols, prefix='') -%}
+HASH({% for col in cols %}{{ prefix }}{{ col }}{% if not loop.last %}, {% endif %}{% endfor %})
+{%- endmacro %}
+{#- with hashes, the join is on those first, and the keys themselves are only compared on the rows whose hashes match -#}
+{%- macro join_on(cols, not_null_keys, x='x', y='y', x_hash=None, y_hash=None) -%}
+{% if x_hash %}{{ x_hash }} = {{ y_hash }} AND {% endif -%}
+{% for col in cols %}{{ x }}.{{ col }} {% if col in not_null_keys %}={% else %}<=>{% endif %} {{ y }}.{{ col }}{% if not loop.last %} AND {% endif %}{% endfor %}
+{%- endmacro %}
\ No newline at end of file
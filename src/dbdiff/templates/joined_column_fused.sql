@@ -0,0 +1,63 @@
+{#- one query for all of the details of a column: a part column says which of them each row is for -#}
+{%- from "sample_order.sql" import sample_order -%}
+{%- set keys = join_cols|join(", ") -%}
+{%- set null_keys %}{% for col in join_cols %}NULL{% if not loop.last %}, {% endif %}{% endfor %}{% endset -%}
+WITH /*+ENABLE_WITH_CLAUSE_MATERIALIZATION*/ mismatched AS (
+    SELECT {{ keys }},
+           x_{{ column }},
+           y_{{ column }}
+      FROM {{ joined_schema }}.{{ joined_table }}
+     WHERE (x_{{ column }} <=> y_{{ column }}) IS FALSE
+), grouped AS (
+      SELECT x_{{ column }},
+             y_{{ column }},
+             COUNT(*) AS ct
+        FROM mismatched
+    GROUP BY x_{{ column }}, y_{{ column }}
+)
+SELECT part, rn, ct, {{ keys }}, x_{{ column }}, y_{{ column }}{% if numeric %}, min_diff, max_diff, abs_diff{% endif %}
+  FROM (
+    SELECT 'raw' AS part,
+           ROW_NUMBER() OVER (ORDER BY {{ keys }}) AS rn,
+           NULL AS ct,
+           {{ keys }},
+           x_{{ column }},
+           y_{{ column }}{% if numeric %},
+           NULL AS min_diff, NULL AS max_diff, NULL AS abs_diff{% endif %}
+      FROM (SELECT * FROM mismatched {{ sample_order(sample, join_cols) }} LIMIT {{ limit }}) raw
+     UNION ALL
+    SELECT 'count', 1, COUNT(*), {{ null_keys }}, NULL, NULL{% if numeric %}, NULL, NULL, NULL{% endif %}
+      FROM mismatched
+     UNION ALL
+    SELECT 'grouped', ROW_NUMBER() OVER (ORDER BY ct DESC), ct, {{ null_keys }}, x_{{ column }}, y_{{ column }}{% if numeric %}, NULL, NULL, NULL{% endif %}
+      FROM (SELECT * FROM grouped ORDER BY ct DESC LIMIT {{ limit }}) top_pairs
+    {%- if numeric %}
+     UNION ALL
+    SELECT 'binned', ROW_NUMBER() OVER (ORDER BY MIN(diff), MAX(diff)), SUM(ct), {{ null_keys }}, NULL, NULL, MIN(diff), MAX(diff), NULL
+      FROM (
+        SELECT NTILE({{ tiles }}) OVER (ORDER BY ABS(x_{{ column }} - y_{{ column }})) AS n_tile,
+               ABS(x_{{ column }} - y_{{ column }}) AS diff,
+               ct
+          FROM grouped
+         WHERE x_{{ column }} IS NOT NULL
+               AND y_{{ column }} IS NOT NULL
+           ) tiled
+  GROUP BY n_tile
+     UNION ALL
+    SELECT 'sorted', ROW_NUMBER() OVER (ORDER BY abs_diff DESC), NULL, {{ keys }}, x_{{ column }}, y_{{ column }}, NULL, NULL, abs_diff
+      FROM (
+        SELECT {{ keys }}, x_{{ column }}, y_{{ column }}, ABS(x_{{ column }} - y_{{ column }}) AS abs_diff
+          FROM mismatched
+      ORDER BY ABS(x_{{ column }} - y_{{ column }}) DESC
+         LIMIT {{ limit }}
+           ) largest
+    {%- endif %}
+    {%- for side, schema, table in hier_tables %}
+     UNION ALL
+    SELECT 'hier_{{ side }}', ROW_NUMBER() OVER (ORDER BY {{ keys }}), NULL, {{ keys }},
+           {% if side == 'x' %}{{ column }}::{{ x_dtype }}, NULL{% else %}NULL, {{ column }}::{{ y_dtype }}{% endif %}{% if numeric %}, NULL, NULL, NULL{% endif %}
+      FROM {{ schema }}.{{ table }}
+     WHERE {{ join_cols[0] }} IN (SELECT {{ join_cols[0] }} FROM mismatched {{ sample_order(sample, join_cols) }} LIMIT {{ limit }})
+    {%- endfor %}
+       ) parts
+ ORDER BY part, rn
\ No newline at end of file
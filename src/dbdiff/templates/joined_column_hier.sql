@@ -1,3 +1,4 @@
+{% from "sample_order.sql" import sample_order -%}
         SELECT {{ join_cols|join(", ") }},
                {{ column }}
           FROM {{ schema }}.{{ table }}
@@ -5,7 +6,7 @@
              SELECT {{ join_cols[0] }}
              FROM {{ joined_schema }}.{{ joined_table }}
              WHERE (x_{{ column }} <=> y_{{ column }}) IS FALSE
-             ORDER BY {{ join_cols|join(", ") }}
+             {{ sample_order(sample, join_cols) }}
              {% if limit %}LIMIT {{ limit }}{% endif %}
          )
-      ORDER BY {{ join_cols|join(", ") }}
\ No newline at end of file
+      {{ sample_order(sample, join_cols) }}
\ No newline at end of file
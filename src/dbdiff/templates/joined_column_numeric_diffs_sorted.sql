@@ -2,5 +2,5 @@
                x_{{ column }},
                y_{{ column }},
                ABS(x_{{ column }} - y_{{ column }}) AS abs_diff
-          FROM ({% include "joined_column_raw.sql" %}) q_raw
+          FROM ({% with sample = None %}{% include "joined_column_raw.sql" %}{% endwith %}) q_raw
       ORDER BY ABS(x_{{ column }} - y_{{ column }}) DESC
\ No newline at end of file
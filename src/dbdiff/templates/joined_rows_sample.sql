@@ -1,3 +1,5 @@
+{% from "sample_order.sql" import sample_order -%}
 SELECT joined.*
   FROM {{ joined_schema }}.{{ joined_table }} joined
- WHERE {% for column in columns %}((x_{{ column }} <=> y_{{ column }}) IS FALSE){% if not loop.last %} OR {% endif %}{% endfor %}
\ No newline at end of file
+ WHERE {% for column in columns %}((x_{{ column }} <=> y_{{ column }}) IS FALSE){% if not loop.last %} OR {% endif %}{% endfor %}
+ {{ sample_order(sample, join_cols, 'joined.') }}
\ No newline at end of file
@@ -0,0 +1,7 @@
+{% for table, columns in shards -%}
+SELECT {% if hash_keys %}join_hash, {% endif %}{{ join_cols|join(", ") }}
+  FROM {{ joined_schema }}.{{ table }}
+ WHERE {% for column in columns %}((x_{{ column }} <=> y_{{ column }}) IS FALSE){% if not loop.last %} OR {% endif %}{% endfor %}
+{% if not loop.last %} UNION
+{% endif %}
+{%- endfor %}
@@ -0,0 +1,2 @@
+SELECT COUNT(*)
+  FROM ({% include "joined_shards_keys.sql" %}) diff_keys
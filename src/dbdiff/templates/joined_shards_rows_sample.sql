@@ -0,0 +1,12 @@
+{% from "join_on.sql" import join_on -%}
+{% from "sample_order.sql" import sample_order -%}
+    SELECT {% for col in join_cols %}diff_keys.{{ col }}, {% endfor %}
+           {%- for table, columns in shards %}{% set shard = loop.index %}{% for column in columns %}
+           shard{{ shard }}.x_{{ column }}, shard{{ shard }}.y_{{ column }}{% if not loop.last %},{% endif %}
+           {%- endfor %}{% if not loop.last %},{% endif %}{% endfor %}
+      FROM ({% include "joined_shards_keys.sql" %}) diff_keys
+    {%- for table, columns in shards %}
+INNER JOIN {{ joined_schema }}.{{ table }} shard{{ loop.index }}
+           ON {{ join_on(join_cols, not_null_keys, 'diff_keys', 'shard' ~ loop.index, x_hash=('diff_keys.join_hash' if hash_keys), y_hash=('shard' ~ loop.index ~ '.join_hash' if hash_keys)) }}
+    {%- endfor %}
+  {{ sample_order(sample, join_cols, 'diff_keys.') }}
@@ -0,0 +1,34 @@
+{#- the same keys are sampled on both sides, by the hash of the keys -#}
+{#- the keys with several rows on a side are counted, but not matched, as the diff leaves them out (see create_dedup.sql) -#}
+WITH x_sample AS (
+    SELECT HASH({{ join_cols|join(", ") }}) AS key_hash,
+           HASH({{ x_columns|join(", ") }}) AS row_hash
+      FROM {{ x_schema }}.{{ x_table }}
+     WHERE HASH({{ join_cols|join(", ") }}) % {{ modulus }} = 0
+), y_sample AS (
+    SELECT HASH({{ join_cols|join(", ") }}) AS key_hash,
+           HASH({{ y_columns|join(", ") }}) AS row_hash
+      FROM {{ y_schema }}.{{ y_table }}
+     WHERE HASH({{ join_cols|join(", ") }}) % {{ modulus }} = 0
+), x AS (
+      SELECT key_hash,
+             MIN(row_hash) AS row_hash,
+             COUNT(*) AS ct
+        FROM x_sample
+    GROUP BY key_hash
+), y AS (
+      SELECT key_hash,
+             MIN(row_hash) AS row_hash,
+             COUNT(*) AS ct
+        FROM y_sample
+    GROUP BY key_hash
+)
+SELECT SUM(CASE WHEN x.ct > 1 THEN x.ct ELSE 0 END) AS x_dup_rows,
+       SUM(CASE WHEN y.ct > 1 THEN y.ct ELSE 0 END) AS y_dup_rows,
+       SUM(x.ct) AS x_rows,
+       SUM(y.ct) AS y_rows,
+       SUM(CASE WHEN x.ct = 1 AND y.ct = 1 THEN 1 ELSE 0 END) AS matched_rows,
+       SUM(CASE WHEN x.ct = 1 AND y.ct = 1 AND x.row_hash <> y.row_hash THEN 1 ELSE 0 END) AS diff_rows
+  FROM x
+       FULL OUTER JOIN y
+       ON x.key_hash = y.key_hash
\ No newline at end of file
@@ -0,0 +1,3 @@
+SELECT *
+  FROM {{ schema_name }}.{{ table_name }}
+ WHERE {% if partition_value is none %}{{ partition_col }} IS NULL{% else %}{{ partition_col }} = '{{ partition_value|replace("'", "''") }}'{% endif %}
@@ -0,0 +1,4 @@
+SELECT {% for col, dtype, keep in columns -%}
+       {% if keep %}q.{{ col }}{% else %}NULL::{{ dtype }} AS {{ col }}{% endif %}{% if not loop.last %},
+       {% endif %}{% endfor %}
+  FROM ({{ query }}) q
\ No newline at end of file
@@ -0,0 +1,8 @@
+{#- how the rows of a sample are picked, see main.SAMPLE_METHODS -#}
+{%- macro sample_order(sample, cols, prefix='') -%}
+{%- if sample == 'ordered' -%}
+ORDER BY {% for col in cols %}{{ prefix }}{{ col }}{% if not loop.last %}, {% endif %}{% endfor %}
+{%- elif sample == 'hash' -%}
+ORDER BY HASH({% for col in cols %}{{ prefix }}{{ col }}{% if not loop.last %}, {% endif %}{% endfor %})
+{%- endif -%}
+{%- endmacro %}
\ No newline at end of file
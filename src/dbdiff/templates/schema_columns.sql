@@ -0,0 +1,15 @@
+{#- the columns of every table and view of the schemas, with the position of each in its table's primary key, if any -#}
+select c.table_schema, c.table_name, c.column_name, c.data_type, c.is_nullable, c.ordinal_position,
+       pk.ordinal_position as primary_key_position
+  from columns c
+       left join primary_keys pk
+       on pk.table_schema = c.table_schema
+          and pk.table_name = c.table_name
+          and pk.column_name = c.column_name
+ where lower(c.table_schema) in ({% for schema_name in schema_names %}lower('{{ schema_name }}'){% if not loop.last %}, {% endif %}{% endfor %})
+ union all
+select table_schema, table_name, column_name, data_type, true as is_nullable, ordinal_position,
+       null as primary_key_position
+  from view_columns
+ where lower(table_schema) in ({% for schema_name in schema_names %}lower('{{ schema_name }}'){% if not loop.last %}, {% endif %}{% endfor %})
+ order by table_schema, table_name, ordinal_position
\ No newline at end of file
@@ -0,0 +1,40 @@
+    SELECT qp.session_id,
+           qp.transaction_id,
+           qp.statement_id,
+           COALESCE(e.rows_produced, 0) AS rows_produced,
+           COALESCE(e.rows_estimated, 0) AS rows_estimated,
+           COALESCE(e.rows_scanned, 0) AS rows_scanned,
+           COALESCE(r.memory_kb, 0) AS memory_kb,
+           COALESCE(q.spill_events, 0) AS spill_events
+      FROM query_profiles qp
+ LEFT JOIN (
+    SELECT transaction_id,
+           statement_id,
+           SUM(CASE WHEN counter_name = 'rows produced' THEN counter_value ELSE 0 END) AS rows_produced,
+           SUM(CASE WHEN counter_name = 'estimated rows produced' THEN counter_value ELSE 0 END) AS rows_estimated,
+           SUM(CASE WHEN counter_name = 'rows produced' AND operator_name = 'Scan' THEN counter_value ELSE 0 END) AS rows_scanned
+      FROM execution_engine_profiles
+     WHERE session_id IN ({% for session_id in session_ids %}'{{ session_id|replace("'", "''") }}'{% if not loop.last %}, {% endif %}{% endfor %})
+  GROUP BY transaction_id, statement_id
+           ) e
+        ON e.transaction_id = qp.transaction_id AND e.statement_id = qp.statement_id
+ LEFT JOIN (
+    SELECT transaction_id,
+           statement_id,
+           SUM(memory_inuse_kb) AS memory_kb
+      FROM resource_acquisitions
+  GROUP BY transaction_id, statement_id
+           ) r
+        ON r.transaction_id = qp.transaction_id AND r.statement_id = qp.statement_id
+ LEFT JOIN (
+    SELECT transaction_id,
+           statement_id,
+           COUNT(*) AS spill_events
+      FROM query_events
+     WHERE session_id IN ({% for session_id in session_ids %}'{{ session_id|replace("'", "''") }}'{% if not loop.last %}, {% endif %}{% endfor %})
+           AND event_type ILIKE '%SPILL%'
+  GROUP BY transaction_id, statement_id
+           ) q
+        ON q.transaction_id = qp.transaction_id AND q.statement_id = qp.statement_id
+     WHERE qp.is_executing
+           AND qp.session_id IN ({% for session_id in session_ids %}'{{ session_id|replace("'", "''") }}'{% if not loop.last %}, {% endif %}{% endfor %})
\ No newline at end of file
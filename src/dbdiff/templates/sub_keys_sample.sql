@@ -1,11 +1,12 @@
 {% extends "sub_keys_base.sql" %}
+{% from "sample_order.sql" import sample_order %}
 {% block select %}
 SELECT {% for col in join_cols -%}
        {% if x %}x{% else %}y{% endif %}.{{ col }} AS {{ col }}{% if not loop.last %},{% endif %}
        {% endfor -%}
 {% endblock %}
 {% block orderby %}
-ORDER BY {% for col in join_cols %}{% if x %}x{% else %}y{% endif %}.{{ col }}{% if not loop.last %}, {% endif %}{% endfor %}
+{{ sample_order(sample, join_cols, 'x.' if x else 'y.') }}
 {% endblock %}
 {% block limit %}
 LIMIT {{ max_rows_column }}
@@ -1,5 +1,10 @@
-select column_name, data_type
+select column_name, data_type, is_nullable, ordinal_position
   from columns
  where lower(table_schema) = lower('{{ schema_name }}')
        and lower(table_name) = lower('{{ table_name }}')
+ union all
+select column_name, data_type, true as is_nullable, ordinal_position
+  from view_columns
+ where lower(table_schema) = lower('{{ schema_name }}')
+       and lower(table_name) = lower('{{ table_name }}')
  order by ordinal_position
\ No newline at end of file
@@ -0,0 +1,6 @@
+  SELECT {% if partition_col %}{{ partition_col }} AS partition_value,
+         {% endif %}COUNT(*) AS row_count,
+         SUM(HASH({{ columns|join(", ") }}) % 4294967296) AS row_hash{% if key_cols %},
+         SUM(HASH({{ key_cols|join(", ") }}) % 4294967296) AS key_hash{% endif %}
+    FROM {{ schema_name }}.{{ table_name }}
+{% if partition_col %}GROUP BY {{ partition_col }}{% endif %}
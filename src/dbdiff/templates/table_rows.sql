@@ -1,2 +1,3 @@
-SELECT COUNT(*)
+SELECT COUNT(*){% for col in null_cols|default([]) %},
+       COUNT(*) - COUNT({{ col }}) AS null_{{ loop.index0 }}{% endfor %}
   FROM {{ schema_name }}.{{ table_name }}
\ No newline at end of file
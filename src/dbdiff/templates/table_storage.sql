@@ -0,0 +1,16 @@
+SELECT (SELECT MAX(partition_expression)
+          FROM v_catalog.tables
+         WHERE lower(table_schema) = lower('{{ schema_name }}')
+               AND lower(table_name) = lower('{{ table_name }}')) AS partition_expression,
+       MAX(row_count) AS row_count,
+       MAX(used_bytes) AS used_bytes
+  FROM (
+      -- each projection (and buddy) has all of the rows, summed over the nodes:
+        SELECT projection_name,
+               SUM(row_count) AS row_count,
+               SUM(used_bytes) AS used_bytes
+          FROM v_monitor.projection_storage
+         WHERE lower(anchor_table_schema) = lower('{{ schema_name }}')
+               AND lower(anchor_table_name) = lower('{{ table_name }}')
+      GROUP BY projection_name
+       ) projections
\ No newline at end of file
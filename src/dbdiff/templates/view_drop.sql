@@ -0,0 +1 @@
+DROP VIEW IF EXISTS {{ schema_name }}.{{ table_name }}
\ No newline at end of file
@@ -1,7 +1,11 @@
 import logging
 import os
+import queue
 import ssl
+import threading
+import time
 from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 import requests
@@ -14,8 +18,52 @@ JINJA_ENV = Environment(loader=PackageLoader('dbdiff', 'templates'))
 LOGGER = logging.getLogger(__name__)
 
 
+class CatalogCache:
+    '''The columns of each table, as read by get_column_info(), kept for `ttl` seconds.
+
+    For long running processes (see `dbdiff serve`) that diff the same tables again and again.
+    A table whose columns change is only seen after its entry expires, or after clear().
+    Local temp tables (v_temp_schema) are never cached, they belong to one session.
+    '''
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, str], Tuple[float, pd.DataFrame]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, schema_name: str, table_name: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get((schema_name.lower(), table_name.lower()))
+        if (entry is None) or (time.monotonic() - entry[0] > self.ttl):
+            return None
+        return entry[1].copy()
+
+    def put(self, schema_name: str, table_name: str, df: pd.DataFrame) -> None:
+        with self._lock:
+            self._entries[(schema_name.lower(), table_name.lower())] = (time.monotonic(), df.copy())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# set with use_catalog_cache():
+CATALOG_CACHE: Optional[CatalogCache] = None
+
+
+def use_catalog_cache(cache: Optional[CatalogCache]) -> None:
+    '''Have get_column_info() read from (and fill) `cache`, for the whole process. None turns it off.'''
+    global CATALOG_CACHE
+    CATALOG_CACHE = cache
+
+
 def get_column_info(cur: Cursor, schema_name: str,
                     table_name: str) -> pd.DataFrame:
+    cache = None if schema_name.lower() == 'v_temp_schema' else CATALOG_CACHE
+    if cache is not None:
+        df = cache.get(schema_name, table_name)
+        if df is not None:
+            return df
     column_template = JINJA_ENV.get_template('table_columns.sql')
     cur.execute(column_template.render(schema_name=schema_name,
                                        table_name=table_name))
@@ -23,6 +71,8 @@ def get_column_info(cur: Cursor, schema_name: str,
     df = pd.DataFrame(cur.fetchall())
     if df.shape[0] == 0:
         raise RuntimeError('{schema}.{table} has no columns.'.format(schema=schema_name, table=table_name))
+    if cache is not None:
+        cache.put(schema_name, table_name, df)
     return df
 
 
@@ -66,9 +116,8 @@ def implicit_dtype_comparison(x_dtype: str, y_dtype: str) -> bool:
         return source == target
 
 
-@contextmanager
-def get_cur() -> Cursor:
-    '''Build a connection.
+def get_conninfo() -> dict:
+    '''Build the connection options.
 
     For connection options,
     this function will look for a file, recursively up from this directory,
@@ -118,9 +167,112 @@ def get_cur() -> Cursor:
             context = ssl.create_default_context()
             conninfo['ssl'] = context
 
-    with vertica_python.connect(**conninfo) as conn:
+    return conninfo
+
+
+def get_session_statements(resource_pool: Optional[str] = None,
+                           runtime_cap: Optional[str] = None,
+                           memory_cap: Optional[str] = None) -> List[str]:
+    '''The statements that limit what a session can use of the cluster:
+
+    - resource_pool: run the session's queries in this resource pool.
+    - runtime_cap: the longest any one query may run, e.g. '30 minutes'.
+    - memory_cap: the most memory the session's queries may use at once, e.g. '4G'.
+
+    These can only lower the limits of the user and the pool, not raise them.
+    '''
+    statements = []
+    if resource_pool:
+        statements.append('SET SESSION RESOURCE_POOL = "{0}";'.format(resource_pool.replace('"', '""')))
+    if runtime_cap:
+        statements.append("SET SESSION RUNTIMECAP '{0}';".format(runtime_cap.replace("'", "''")))
+    if memory_cap:
+        statements.append("SET SESSION MEMORYCAP '{0}';".format(memory_cap.replace("'", "''")))
+    return statements
+
+
+def set_session(cur: Cursor, **limits) -> None:
+    '''Apply the session limits (see get_session_statements()) to the session of `cur`.'''
+    for q in get_session_statements(**limits):
+        LOGGER.info(q)
+        cur.execute(q)
+
+
+@contextmanager
+def get_cur(**limits) -> Cursor:
+    '''Build a connection, see get_conninfo() for the options used,
+    and get_session_statements() for the optional limits of the session.'''
+    with vertica_python.connect(**get_conninfo()) as conn:
         with conn.cursor('dict') as cur:
             try:
+                set_session(cur, **limits)
                 yield cur
             finally:
                 conn.close()
+
+
+class CursorPool:
+    '''A pool of at most `size` connections, handing out one dict cursor at a time.
+
+    Connections are opened lazily (SSL setup, the cert download,
+    and the login are paid once per connection, not once per use)
+    and reused by later calls to acquire().
+    A connection whose user raised, or that was acquired with discard=True
+    (e.g. after changing session settings), is closed rather than reused.
+
+    `session` has the limits applied to each new connection (see get_session_statements()).
+
+    warm() opens all of the connections ahead of their first use.
+    Use as a context manager to close all idle connections at the end.
+    '''
+
+    def __init__(self, size: int, conninfo: Optional[dict] = None, session: Optional[dict] = None):
+        self.size = size
+        self.conninfo = get_conninfo() if conninfo is None else conninfo
+        self.session = {} if session is None else session
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def connect(self) -> vertica_python.Connection:
+        LOGGER.debug('Opening a new pooled connection.')
+        conn = vertica_python.connect(**self.conninfo)
+        with conn.cursor('dict') as cur:
+            set_session(cur, **self.session)
+        return conn
+
+    def warm(self) -> None:
+        '''Open idle connections up to the size of the pool (call it before any acquire()).'''
+        while self._idle.qsize() < self.size:
+            self._idle.put(self.connect())
+
+    @contextmanager
+    def acquire(self, discard: bool = False):
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+            reuse = False
+            cur = conn.cursor('dict')
+            try:
+                yield cur
+                reuse = not discard
+            finally:
+                cur.close()
+                if reuse:
+                    self._idle.put(conn)
+                else:
+                    conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,22 +1,74 @@
+import json
 import logging
 import os
+import pickle
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
 from pathlib import Path
 
 import pandas as pd
 import pytest
 from click.testing import CliRunner
 
+from dbdiff.batch import get_job
+from dbdiff.batch import get_output_keys
+from dbdiff.batch import order_jobs
+from dbdiff.batch import read_manifest
+from dbdiff.batch import run_batch
+from dbdiff.batch import update_history
+from dbdiff.bundle import load_bundle
+from dbdiff.bundle import save_bundle
+from dbdiff.cache import RunCache
+from dbdiff.cli import cli
+from dbdiff.cli import main
+from dbdiff.cli import write_json_summary
+from dbdiff.explore import DetailCache
+from dbdiff.explore import DiffExplorer
+from dbdiff.explore import ExploreServer
+from dbdiff.frame import diff_frames
+from dbdiff.incremental import diff_incremental
+from dbdiff.incremental import get_options_key
+from dbdiff.incremental import merge_all_info
 from dbdiff.main import check_primary_key
 from dbdiff.main import create_diff_table
 from dbdiff.main import create_joined_table
+from dbdiff.main import get_column_details
 from dbdiff.main import get_column_diffs
+from dbdiff.main import get_column_diffs_from_joined
+from dbdiff.main import get_column_profile
 from dbdiff.main import get_diff_columns
 from dbdiff.main import get_diff_rows
+from dbdiff.main import get_dup_stats
+from dbdiff.main import get_hash_keys
+from dbdiff.main import get_joined_shards
+from dbdiff.main import get_primary_key_info
+from dbdiff.main import get_profile_drift
 from dbdiff.main import get_unmatched_rows
 from dbdiff.main import get_unmatched_rows_straight
 from dbdiff.main import insert_diff_table
 from dbdiff.main import select_distinct_rows
-from dbdiff.cli import cli
+from dbdiff.planner import choose_strategy
+from dbdiff.planner import get_estimates
+from dbdiff.report import ShardWriter
+from dbdiff.report import excel_report
+from dbdiff.report import html_report
+from dbdiff.report import html_report_sharded
+from dbdiff.report import html_schema_report
+from dbdiff.schema import get_schema_jobs
+from dbdiff.serve import DiffServer
+from dbdiff.serve import DiffService
+from dbdiff.stages import Stage
+from dbdiff.stages import StagesInterrupted
+from dbdiff.stages import get_critical_path
+from dbdiff.stages import run_stages
+from dbdiff.stages import scope_stages
+from dbdiff.store import ColumnStore
+from dbdiff.store import get_column_counts
+from dbdiff.telemetry import StageTelemetry
 from dbdiff.vertica import get_column_info
 from dbdiff.vertica import get_column_info_lookup
 from dbdiff.vertica import get_cur
@@ -35,6 +87,30 @@ JOIN_COLS = pd.DataFrame({'join1': {**VARCHAR_DTYPES, **VALID_COL},
                           'join2': {**VARCHAR_DTYPES, **VALID_COL}}).transpose()
 
 
+class StubCursor:
+    '''Stands in for a cursor without Vertica: keeps the queries run,
+    and answers each with `rows`, or if `rows` is a dict, with the rows of its first key found in the query.'''
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, q):
+        self.queries.append(q)
+
+    def fetchall(self):
+        if isinstance(self.rows, dict):
+            return next(rows for source, rows in self.rows.items() if source in self.queries[-1])
+        return self.rows
+
+
+@pytest.fixture
+def all_info():
+    '''The all_info of a diff of two small data frames, with differences in data1 (1) and data2 (2).'''
+    x = pd.DataFrame({'join1': ['a', 'b', 'c'], 'data1': [1, 2, 3], 'data2': ['a', 'b', 'c']})
+    y = pd.DataFrame({'join1': ['a', 'b', 'c'], 'data1': [1, 5, 3], 'data2': ['a', 'c', 'd']})
+    return diff_frames(x, y, ['join1'], 'x_table', 'y_table')
+
+
 @pytest.fixture(scope='session')
 def cur():
     # vsql -d docker -u dbadmin
@@ -133,6 +209,22 @@ def test_check_primary_key(cur):
     assert check_primary_key(cur, 'dbdiff', 'x_table', ['join1']) == 4
 
 
+def test_get_primary_key_info(cur):
+    assert get_primary_key_info(cur, 'dbdiff', 'x_table', ['join1', 'join2']) == {'count': 0, 'key_nulls': {'join1': 1, 'join2': 3}}
+    assert get_primary_key_info(cur, 'dbdiff', 'y_table', ['join1'])['key_nulls'] == {'join1': 0}
+
+
+def test_get_column_profile(cur):
+    x_profile = get_column_profile(cur, 'dbdiff', 'x_table', {'data1': 'int', 'data4': 'varchar(10)'}, top_values=2)
+    assert x_profile.loc['data1', 'null_count'] == 5
+    assert (x_profile.loc['data1', 'min'], x_profile.loc['data1', 'max']) == ('0', '1')
+    assert x_profile.loc['data1', 'top_values'] == 'NULL (5), 0 (2)'
+    assert pd.isna(x_profile.loc['data4', 'mean'])
+    y_profile = get_column_profile(cur, 'dbdiff', 'y_table', {'data1': 'int', 'data4': 'varchar(10)'}, top_values=0)
+    drift = get_profile_drift(x_profile, y_profile).set_index('column').drift
+    assert 'null_rate' in drift['data1'] and 'top_values' in drift['data1']
+
+
 def test_select_distinct_rows(cur):
     x_table_rows = 8
     x_table_columns = 9
@@ -155,6 +247,9 @@ def test_select_distinct_rows(cur):
         dup = pd.DataFrame(cur.fetchall())
         assert dup.shape[0] == (x_table_rows - dedup.shape[0])
         assert dup.shape[1] == (x_table_columns + 1)
+        dup_stats = get_dup_stats(cur, new_table_schema, 'x_table', ['join1'])
+        assert dup_stats['row_count'] == dup.shape[0]
+        assert dup_stats['max_dup_count'] == dup.dup_count.max()
 
 
 def test_create_joined_table(cur):
@@ -220,6 +315,36 @@ def test_get_unmatched_rows_straight(cur):
     assert results['y']['sample'].shape[1] == expected_results['y']['sample_shape'][1]
 
 
+def test_hash_join_keys(cur):
+    # joining on the hash of the keys first finds the same rows:
+    join_cols = ['join1', 'join2']
+    compare_cols = pd.concat([COMPARE_COLS, JOIN_COLS])
+    hash_cols = get_hash_keys(compare_cols, join_cols)
+    assert hash_cols == join_cols
+    counts = {}
+    for hash_keys in (False, True):
+        results = get_unmatched_rows_straight(
+            cur, 'dbdiff', 'dbdiff', 'x_table', 'y_table', join_cols, 100,
+            hash_keys=hash_keys, hash_cols=hash_cols
+        )
+        create_joined_table(
+            cur,
+            x_schema='dbdiff',
+            y_schema='dbdiff',
+            x_table='x_table',
+            y_table='y_table',
+            join_cols=join_cols,
+            compare_cols=compare_cols,
+            joined_schema='dbdiff',
+            joined_table='x_table_HASH_JOINED',
+            hash_keys=hash_keys
+        )
+        cur.execute('select count(*) from dbdiff.x_table_HASH_JOINED')
+        counts[hash_keys] = (results['x']['count'], results['y']['count'], cur.fetchall()[0]['COUNT'])
+        cur.execute('drop table dbdiff.x_table_HASH_JOINED')
+    assert counts[True] == counts[False] == (5, 3, 4)
+
+
 def test_get_unmatched_rows(cur):
     join_cols = ['join1', 'join2']
     # these are, again, a litte wierd. see note in test_get_unmatched_rows_straight()
@@ -300,6 +425,475 @@ def test_insert_diff_table(cur):
     assert df.shape[1] == 3
 
 
+def test_batch_order_jobs(tmp_path):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps({
+        'defaults': {'max_rows_column': 5},
+        'jobs': [
+            {'schema': 's', 'x_table': 'short', 'y_table': 'y', 'join_cols': 'A,b'},
+            {'schema': 's', 'x_table': 'long', 'y_table': 'y', 'join_cols': ['a']},
+            {'schema': 's', 'x_table': 'new', 'y_table': 'y', 'join_cols': 'a'},
+            {'schema': 's', 'x_table': 'urgent', 'y_table': 'y', 'join_cols': 'a', 'priority': 1},
+        ]
+    }))
+    jobs = read_manifest(manifest)
+    assert jobs[0]['join_cols'] == ['a', 'b']
+    assert jobs[0]['options'] == {'max_rows_column': 5}
+    history = update_history({}, [
+        {'key': 's.short|s.y', 'status': 'ok', 'duration': 10},
+        {'key': 's.long|s.y', 'status': 'ok', 'duration': 100},
+        {'key': 's.new|s.y', 'status': 'error', 'duration': 1},
+    ])
+    assert [job['x_table'] for job in order_jobs(jobs, history)] == ['urgent', 'long', 'new', 'short']
+    history = update_history(history, [{'key': 's.long|s.y', 'status': 'ok', 'duration': 0}])
+    assert history['s.long|s.y'] == {'duration': 50, 'runs': 2}
+
+
+def test_run_batch_same_output():
+    running = set()
+    overlaps = []
+
+    class FakePool:
+        @contextmanager
+        def acquire(self, discard=False):
+            yield None
+
+    def run_job(cur, job):
+        # jobs with the same x table write the same [x_table]_JOINED and report,
+        # and jobs with a table on either side in common the same [table]_dedup and _dup:
+        tables = {job['x_table'].lower(), job['y_table'].lower()}
+        overlaps.extend(running & tables)
+        running.update(tables)
+        time.sleep(0.05)
+        running.difference_update(tables)
+        return {}
+
+    jobs = [get_job({'schema': 's', 'x_table': x_table, 'y_table': y_table, 'join_cols': 'a'})
+            for x_table, y_table in (('x', 'y1'), ('X', 'y2'), ('y1', 'x'), ('other', 'y2'), ('a', 'b'))]
+    results = run_batch(jobs, run_job, FakePool(), concurrency=5)
+    assert [result['status'] for result in results] == ['ok'] * 5
+    assert overlaps == []
+    assert get_output_keys(jobs[0]) == ['report:x', 's.x_dedup', 's.x_diff', 's.x_dup', 's.x_joined', 's.y1_dedup', 's.y1_dup']
+
+
+def test_get_joined_shards():
+    assert get_joined_shards(['a', 'b', 'c'], 0, 't_JOINED') == {'t_JOINED': ['a', 'b', 'c']}
+    assert get_joined_shards(['a', 'b', 'c'], 3, 't_JOINED') == {'t_JOINED': ['a', 'b', 'c']}
+    assert get_joined_shards(['a', 'b', 'c'], 2, 't_JOINED') == {'t_JOINED_1': ['a', 'b'], 't_JOINED_2': ['c']}
+
+
+def test_run_stages():
+    stages = [
+        Stage('a', lambda cur, results: 1),
+        Stage('b', lambda cur, results: results['a'] + 1, ('a',)),
+        Stage('c', lambda cur, results: results['a'] + 2, ('a',)),
+        Stage('d', lambda cur, results: results['b'] + results['c'], ('b', 'c')),
+    ]
+    results, timings = run_stages(stages, cur=None)
+    assert results == {'a': 1, 'b': 2, 'c': 3, 'd': 5}
+    path = get_critical_path(stages, timings)
+    assert path[0] == 'a' and path[-1] == 'd' and len(path) == 3
+    with pytest.raises(RuntimeError):
+        run_stages([Stage('a', lambda cur, results: 1, ('b',)), Stage('b', lambda cur, results: 1, ('a',))], cur=None)
+    with pytest.raises(RuntimeError):
+        run_stages([Stage('a', lambda cur, results: 1, ('z',))], cur=None)
+    slow_stages = [
+        Stage('a', lambda cur, results: 1),
+        Stage('b', lambda cur, results: time.sleep(1), ('a',)),
+        Stage('c', lambda cur, results: 3, ('b',)),
+    ]
+    with pytest.raises(StagesInterrupted) as e:
+        run_stages(slow_stages, cur=None, stage_timeout=0.1)
+    assert 'a' in e.value.results and 'c' not in e.value.results
+
+    runs = []
+
+    def get_stages(y):
+        return [
+            Stage('x', lambda cur, results: runs.append('x') or 1),
+            Stage('y', lambda cur, results: y),
+            Stage('d', lambda cur, results: results['y'] - results['x'], ('x', 'y')),
+        ]
+    results, timings = run_stages(scope_stages([('y1:', get_stages(2)), ('y2:', get_stages(5))], {'x'}), cur=None)
+    # the shared stage runs once:
+    assert runs == ['x']
+    assert (results['y1:d'], results['y2:d']) == (1, 4)
+
+
+def test_stage_telemetry():
+    # the stub cursors stand in for a stage's cursor and for the monitoring one:
+    def row(statement_id, rows_produced, memory_kb, spill_events):
+        return {'session_id': 's1', 'transaction_id': 1, 'statement_id': statement_id, 'rows_produced': rows_produced,
+                'rows_estimated': 100, 'rows_scanned': rows_produced, 'memory_kb': memory_kb, 'spill_events': spill_events}
+
+    events = []
+    telemetry = StageTelemetry(connect=None, interval=1, progress=events.append)
+    telemetry.register('joined', StubCursor([{'session_id': 's1'}]))
+    for rows in ([row(1, 10, 2048, 0)], [row(1, 50, 1024, 1)], [row(2, 20, 512, 0)]):
+        telemetry.sample(StubCursor(rows))
+    telemetry.unregister('joined')
+    telemetry.sample(StubCursor([row(3, 99, 9999, 9)]))
+    assert telemetry.summary() == {'joined': {'peak_memory_kb': 2048, 'rows_scanned': 70, 'spill_events': 1, 'samples': 3}}
+    assert [event['rows_produced'] for event in events] == [10, 50, 20]
+    assert events[0]['stage'] == 'joined' and events[0]['eta'] is None
+
+
+def test_serve():
+    release = threading.Event()
+
+    def run_job(cur, job):
+        # a stand-in for the database, and for the stages of cli.run_job:
+        results, timings = run_stages([Stage('a', lambda cur, results: release.wait(5))], cur, progress=job['options']['progress'])
+        if job['x_table'] == 'bad':
+            raise RuntimeError('bad table')
+        return {'cur': cur, 'x_table': job['x_table']}
+
+    @contextmanager
+    def acquire(discard=False):
+        yield 'warm cursor'
+
+    service = DiffService(run_job, acquire, workers=1, max_queue=1)
+    service.start()
+    server = DiffServer(('127.0.0.1', 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+
+    def post(job):
+        request = urllib.request.Request(url + '/jobs', data=json.dumps(job).encode(), method='POST')
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())['id']
+
+    try:
+        job = {'schema': 's', 'x_table': 'x', 'y_table': 'y', 'join_cols': 'join1'}
+        first = post(job)
+        while service.get(first)['status'] != 'running':
+            time.sleep(0.01)
+        second = post({**job, 'x_table': 'bad'})
+        # one running, one queued, and the queue is full:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            post(job)
+        assert e.value.code == 503
+        for bad_job in ({'schema': 's'}, {**job, 'x_table': 'x; DROP TABLE s.y'}, {**job, 'join_cols': ['join1', '../x']}):
+            with pytest.raises(urllib.error.HTTPError) as e:
+                post(bad_job)
+            assert e.value.code == 400
+        release.set()
+        with urllib.request.urlopen(url + '/jobs/' + first + '/events') as response:
+            events = [json.loads(line) for line in response]
+        assert [event['event'] for event in events] == ['queued', 'started', 'stage_started', 'stage_finished', 'finished', 'done']
+        assert events[-1]['result'] == {'cur': 'warm cursor', 'x_table': 'x'}
+        with urllib.request.urlopen(url + '/jobs/' + second + '/events') as response:
+            events = [json.loads(line) for line in response]
+        assert events[-1]['status'] == 'error' and events[-1]['error'] == 'bad table'
+        with urllib.request.urlopen(url + '/health') as response:
+            assert json.loads(response.read())['queued'] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+
+def test_explore(all_info):
+    # as diffed with --skip-column-details:
+    all_info['column_info']['data2'] = {'count': 2, 'q': 'select grouped', 'q_raw': 'select raw', 'q_h_x_sample': 'select hier limit 5'}
+    cur = StubCursor([{'x_data2': 'b', 'y_data2': 'c'}])
+
+    @contextmanager
+    def acquire(discard=False):
+        yield cur
+
+    server = ExploreServer(('127.0.0.1', 0), DiffExplorer(all_info, acquire, max_rows_column=5))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+
+    def get(path):
+        with urllib.request.urlopen(url + path) as response:
+            return response.read().decode()
+
+    try:
+        assert 'columns/data1.js' in get('/')
+        # the column's queries run only once it's opened, and only once:
+        assert cur.queries == []
+        fragment = get('/columns/data2.js')
+        assert fragment.startswith('dbdiffLoadColumn("data2", ') and 'select raw' in fragment
+        # the hierarchical sample is limited already:
+        assert cur.queries == ['select grouped LIMIT 5', 'select raw LIMIT 5', 'select hier limit 5']
+        get('/columns/data2.js')
+        # the other column has its samples already:
+        get('/columns/data1.js')
+        assert len(cur.queries) == 3
+        with pytest.raises(urllib.error.HTTPError) as e:
+            get('/columns/data3.js')
+        assert e.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    cache = DetailCache(size=1)
+    cache.get('a', lambda: {'df': 1})
+    cache.get('b', lambda: {'df': 2})
+    assert cache.get('a', lambda: {'df': 3}) == {'df': 3}
+    assert (cache.hits, cache.misses) == (0, 3)
+    # a column opened while it is loading waits for that load:
+    loads = []
+    release = threading.Event()
+
+    def slow_load():
+        loads.append(1)
+        release.wait()
+        return {'df': 4}
+
+    threads = [threading.Thread(target=cache.get, args=('c', slow_load)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    while not loads:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert loads == [1]
+    assert cache.get('c', lambda: {'df': 5}) == {'df': 4}
+
+
+def test_merge_all_info():
+    def partition_info(table, count, pairs):
+        df = pd.DataFrame({'x_data1': pairs, 'y_data1': [p + 1 for p in pairs], 'ct': [1] * len(pairs)})
+        return {
+            'join_cols': ['join1'], 'total_row_count': 3, 'column_match_info': pd.DataFrame(),
+            'column_info': {'data1': {'count': count, 'df': df, 'q': table}},
+            'missing_join_info': {side: {'count': 1, 'query': '', 'sample': pd.DataFrame({'join1': [table]})} for side in 'xy'},
+            'dedup_info': {table + '_x': {'count': 0}, table + '_y': {'count': 2}},
+            'diff_summary': {'count': count, 'total_count': count, 'sample': pd.DataFrame({'join1': [table]})},
+        }
+    merged = merge_all_info([partition_info('a', 2, [1, 2]), partition_info('b', 1, [1])],
+                            's', 'x', 's', 'y', max_rows_all=10, max_rows_column=10)
+    assert merged['total_row_count'] == 6
+    assert merged['missing_join_info']['x']['count'] == 2
+    assert merged['dedup_info'] == {'x': {'count': 0}, 'y': {'count': 4}}
+    assert merged['diff_summary']['count'] == 3
+    assert merged['column_info']['data1']['count'] == 3
+    assert merged['column_info']['data1']['df']['ct'].tolist() == [2, 1]
+    assert merged['column_info']['data1']['q'] == 'b'
+    assert get_options_key({'exclude_columns': {'a', 'b'}}) == get_options_key({'exclude_columns': {'b', 'a'}, 'pool': object()})
+
+
+def test_diff_incremental(tmp_path, all_info):
+    fingerprints = [{'partition_value': 'a', 'row_count': 1, 'row_hash': 1}, {'partition_value': 'b', 'row_count': 1, 'row_hash': 2}]
+    cur = StubCursor({'from columns': [{'column_name': 'join1', 'data_type': 'int'}], 'partition_value': fingerprints, 'TABLE': []})
+    runs = []
+
+    def run_diff(cur, x_table, **options):
+        # as with --spill-dir:
+        runs.append(x_table)
+        store = ColumnStore(options['spill_dir'])
+        for column, info in all_info['column_info'].items():
+            store[column] = info
+        return {**all_info, 'column_info': store}
+
+    def diff():
+        merged = diff_incremental(cur, run_diff, 'incr', 'x', 'incr', 'y', ['join1'], 'part', state_dir=tmp_path / 'state', spill_dir=tmp_path / 'spill')
+        return merged['incremental_info']['rediffed'], get_column_counts(merged['column_info'])
+
+    assert diff() == (['a', 'b'], {'data2': 4, 'data1': 2})
+    fingerprints[1]['row_hash'] = 3
+    # the reused partition keeps its columns, from its copy next to the state:
+    assert diff() == (['b'], {'data2': 4, 'data1': 2})
+    assert runs == ['x_incr_x'] * 3
+    assert len(list((tmp_path / 'state').glob('*.sqlite'))) == 2
+    assert list((tmp_path / 'spill').iterdir()) == []
+
+
+def test_diff_frames():
+    x = pd.DataFrame({'join1': ['a', 'b', 'c', 'd', 'd', None], 'data1': [1.0, None, 3, 4, 5, 6], 'data2': ['a', 'b', None, 'd', 'e', 'f'], 'only_x': 1})
+    y = pd.DataFrame({'join1': ['a', 'b', 'c', 'e', None], 'data1': [1.0, None, 4, 5, 7], 'data2': ['a', 'c', None, 'd', 'f'], 'only_y': 1})
+    all_info = diff_frames(x, y, ['join1'], 'x_table', 'y_table')
+    # nulls match nulls, in the keys and the values:
+    assert all_info['total_row_count'] == 4
+    assert all_info['dedup_info'] == {'x_table': {'count': 1, 'group_count': 1, 'row_count': 2, 'max_dup_count': 2}, 'y_table': {'count': 0}}
+    assert all_info['missing_join_info']['x']['count'] == 0
+    assert all_info['missing_join_info']['y']['sample']['join1'].tolist() == ['e']
+    assert all_info['diff_summary']['count'] == 3 and all_info['diff_summary']['total_count'] == 3
+    assert list(all_info['column_info'].keys()) == ['data1', 'data2']
+    assert all_info['column_info']['data1']['df']['x_data1'].tolist() == [3.0, 6.0]
+    assert all_info['column_info']['data2']['df_raw']['join1'].tolist() == ['b']
+    assert all_info['column_match_info'].loc['only_x', 'y_dtype'] is None
+    assert 'x_table' in html_report(**all_info)
+    assert [sheet for sheet, df in excel_report(**all_info)][-2:] == ['data1', 'data2']
+    with pytest.raises(RuntimeError):
+        diff_frames(x, y, ['only_x'])
+
+
+def test_hash_join_keys_case_insensitive():
+    # rejected before any query, as equal keys of different case hash differently:
+    with pytest.raises(RuntimeError):
+        main(None, 'dbdiff', 'x_table', 'dbdiff', 'y_table', 'dbdiff', ['join1'], hash_join_keys=True, case_insensitive=True)
+    for command in (['diff', 'dbdiff', 'x_table', 'y_table', 'join1'], ['diff-many', 'dbdiff', 'x_table', 'y_table', 'join1']):
+        result = CliRunner().invoke(cli, command + ['--hash-join-keys', '--case-insensitive'])
+        assert result.exit_code == 2 and '--hash-join-keys does not support --case-insensitive' in result.output
+
+
+def test_write_json_summary(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    x = pd.DataFrame({'join1': ['a', 'b'], 'data1': [1.0, None]})
+    y = pd.DataFrame({'join1': ['a', 'b'], 'data1': [2.0, None]})
+    all_info = diff_frames(x, y, ['join1'], 'x_table', 'y_table')
+    all_info['column_profile'] = pd.DataFrame({'column': ['data1'], 'x_mean': [1.0], 'y_mean': [float('nan')]})
+    # JSON has no NaN:
+    summary = json.loads(write_json_summary(all_info, 'x_table').read_text(), parse_constant=lambda constant: pytest.fail(constant))
+    assert summary['column_profile'] == [{'column': 'data1', 'x_mean': 1.0, 'y_mean': None}]
+
+
+def test_bundle(tmp_path):
+    pytest.importorskip('pyarrow')
+    all_info = {
+        'x_table': 'x', 'join_cols': ['join1'], 'total_row_count': 3,
+        'column_match_info': COMPARE_COLS,
+        'column_info': {'data1': {'count': 1, 'q': 'select', 'df': pd.DataFrame({'x_data1': [1], 'y_data1': [2], 'ct': [1]})}},
+        'diff_summary': {'count': 0, 'total_count': 1, 'sample': []},
+        'missing_join_info': {'x': {'count': 0, 'sample': pd.DataFrame()}},
+        # e.g. a varchar key against an int one:
+        'diff_summary_mixed': pd.DataFrame({'join1': ['01', 1, None]}),
+    }
+    save_bundle(all_info, tmp_path, 'x_table')
+    loaded = load_bundle(tmp_path)
+    assert loaded['name'] == 'x_table'
+    assert loaded['all_info']['total_row_count'] == 3
+    assert loaded['all_info']['diff_summary'] == all_info['diff_summary']
+    pd.testing.assert_frame_equal(loaded['all_info']['column_info']['data1']['df'], all_info['column_info']['data1']['df'])
+    assert loaded['all_info']['column_match_info'].index.tolist() == all_info['column_match_info'].index.tolist()
+    assert loaded['all_info']['missing_join_info']['x']['sample'].shape == (0, 0)
+    assert loaded['all_info']['diff_summary_mixed']['join1'].tolist()[:2] == ['01', '1']
+    assert loaded['all_info']['diff_summary_mixed']['join1'].isnull().tolist() == [False, False, True]
+
+
+def test_run_cache(tmp_path):
+    cache = RunCache(tmp_path, max_mb=1)
+    assert cache.get('a') is None
+    cache.put('a', {'total_row_count': 1})
+    cache.put('b', {'total_row_count': 2})
+    os.utime(cache.get_path('b'), (0, 0))
+    assert cache.get('a') == {'total_row_count': 1}
+    # 'b' is now the least recently used:
+    cache.max_bytes = cache.get_path('a').stat().st_size + cache.get_path('b').stat().st_size
+    cache.put('c', {'total_row_count': 3})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+
+def test_column_store(tmp_path, all_info):
+    df_raw = all_info['column_info']['data1']['df_raw']
+    store = ColumnStore(tmp_path)
+    for column in ('data1', 'data2'):
+        store[column] = all_info['column_info'][column]
+    # by most differences first, with only the counts in memory:
+    assert list(store) == ['data2', 'data1']
+    assert get_column_counts(store) == {'data2': 2, 'data1': 1}
+    assert store['data1']['df_raw'].equals(df_raw)
+    all_info['column_info'] = store
+    assert 'data2' in html_report(**all_info)
+    assert [sheet for sheet, df in excel_report(**all_info)][-2:] == ['data2', 'data1']
+    assert pickle.loads(pickle.dumps(store)).keys() == {'data1', 'data2'}
+    # the run cache keeps a copy, which outlives the store:
+    cache = RunCache(tmp_path / 'cache')
+    cache.put('a', {'column_info': store})
+    path = store.path
+    store.close()
+    assert not path.exists()
+    cached = cache.get('a')['column_info']
+    assert get_column_counts(cached) == {'data2': 2, 'data1': 1}
+    assert cached['data1']['df_raw'].equals(df_raw)
+
+
+def test_shard_writer(tmp_path, all_info):
+    writer = ShardWriter(tmp_path)
+    # as the column stage sets them, least differences first:
+    for column in ('data1', 'data2'):
+        writer[column] = all_info['column_info'][column]
+        assert (tmp_path / 'columns' / (column + '.js')).exists()
+    assert list(writer) == ['data2', 'data1']
+    all_info['column_info'] = writer
+    (tmp_path / 'columns' / 'data1.js').write_text('written already')
+    html_report_sharded(tmp_path, **all_info)
+    assert (tmp_path / 'columns' / 'data1.js').read_text() == 'written already'
+    assert 'columns/data2.js' in (tmp_path / 'index.html').read_text()
+    assert pickle.loads(pickle.dumps(writer)).keys() == {'data1', 'data2'}
+
+
+def test_choose_strategy():
+    estimates = {'columns': 50, 'x_rows': 10 ** 9, 'y_rows': 10 ** 9, 'diff_rate': 0.01, 'diff_rows': 10 ** 7,
+                 'x_partition_column': 'load_date', 'y_partition_column': 'load_date'}
+    choices = choose_strategy(estimates)
+    assert {option: choice['value'] for option, choice in choices.items()} == {
+        'use_diff_table': True, 'joined_shard_width': 0, 'prune_identical_columns': True,
+        'skip_row_total': True, 'sample': 'first', 'partition_column': 'load_date'}
+    # what's given by hand is kept, and the rest chosen around it:
+    choices = choose_strategy(dict(estimates, columns=500, diff_rate=0.9), {'joined_shard_width': 50, 'profile': True})
+    assert choices['joined_shard_width'] == {'value': 50, 'reason': 'Given.'}
+    assert not choices['use_diff_table']['value']
+    assert not choices['prune_identical_columns']['value']
+    assert choices['partition_column']['value'] is None
+    choices = choose_strategy(dict(estimates, columns=500, diff_rate=None, diff_rows=0, x_rows=100, y_rows=100))
+    assert [choices[option]['value'] for option in ('use_diff_table', 'joined_shard_width', 'skip_row_total', 'sample', 'partition_column')] == [False, 100, False, 'hash', None]
+
+
+def test_get_estimates():
+    # answers the catalog and sample queries of the planner by what they read:
+    columns = [{'column_name': 'join1', 'data_type': 'int'}, {'column_name': 'data1', 'data_type': 'int'}, {'column_name': 'data2', 'data_type': 'date'}]
+    cur = StubCursor({
+        'from columns': columns,
+        'v_monitor.projection_storage': [{'partition_expression': 'planner_x.load_date', 'row_count': 2000, 'used_bytes': 100}],
+        'key_hash': [{'x_dup_rows': 10, 'y_dup_rows': 0, 'x_rows': 100, 'y_rows': 80, 'matched_rows': 50, 'diff_rows': 5}],
+    })
+    estimates = get_estimates(cur, 'planner', 'planner_x', 'planner', 'planner_y', ['join1'], {'data2'}, sample_keys=1000)
+    assert estimates['columns'] == 1
+    assert (estimates['x_rows'], estimates['x_bytes'], estimates['x_partition_column']) == (2000, 100, 'load_date')
+    # 1 in 2 keys sampled:
+    assert estimates['sample_modulus'] == 2
+    assert 'HASH(join1) % 2 = 0' in cur.queries[-1]
+    assert (estimates['diff_rate'], estimates['diff_rows']) == (0.1, 10)
+    assert (estimates['x_dup_rate'], estimates['y_dup_rate']) == (0.1, 0.0)
+
+
+def test_get_schema_jobs():
+    def columns(names, primary_key=()):
+        return pd.DataFrame({
+            'column_name': names,
+            'data_type': ['int'] * len(names),
+            'is_nullable': [True] * len(names),
+            'ordinal_position': list(range(1, len(names) + 1)),
+            'primary_key_position': [(primary_key.index(name) + 1) if name in primary_key else None for name in names],
+        })
+    schema_columns = {
+        ('x', 'a'): columns(['id2', 'id1', 'v'], ('id1', 'id2')),
+        ('y', 'a'): columns(['id1', 'id2', 'v']),
+        ('x', 'b'): columns(['k', 'v']),
+        ('y', 'b'): columns(['k', 'v'], ('k',)),
+        ('x', 'c'): columns(['v']),
+        ('y', 'c'): columns(['v']),
+        ('x', 'd'): columns(['id', 'v']),
+        ('y', 'e'): columns(['id', 'v']),
+        # left by earlier diffs:
+        ('x', 'a_joined'): columns(['id1', 'id2', 'x_v', 'y_v']),
+        ('x', 'b_dedup_joined_1'): columns(['k', 'x_v', 'y_v']),
+        ('x', 'b_dedup'): columns(['k', 'v']),
+        ('y', 'b_dup'): columns(['k', 'v', 'dup_count']),
+        ('x', 'a_e_joined'): columns(['id', 'x_v', 'y_v']),
+        # but not these:
+        ('x', 'f_joined'): columns(['id', 'v']),
+        ('y', 'f_joined'): columns(['id', 'v']),
+    }
+    pairs = get_schema_jobs(schema_columns, 'X', 'Y', default_join_cols=['id'], options={'sample': 'hash'})
+    assert [(job['x_table'], job['join_cols']) for job in pairs['jobs']] == [('a', ['id1', 'id2']), ('b', ['k']), ('f_joined', ['id'])]
+    assert pairs['jobs'][0]['options'] == {'sample': 'hash', 'y_schema': 'Y'}
+    assert (pairs['only_x'], pairs['only_y'], pairs['skipped']) == (['d'], ['e'], ['c'])
+    assert [job['x_table'] for job in get_schema_jobs(schema_columns, 'x', 'y', tables=['B', 'c'])['jobs']] == ['b']
+    results = [{'key': 'x.a|y.a', 'status': 'ok', 'duration': 1.0,
+                'result': {'total_row_count': 3, 'x_only_row_count': 0, 'y_only_row_count': 1, 'diff_row_count': 2, 'diff_column_count': 1, 'report': 'a_report.html'}},
+               {'key': 'x.b|y.b', 'status': 'error', 'duration': 0.5, 'error': 'boom'}]
+    html = html_schema_report('x', 'y', pairs['jobs'], results, pairs['only_x'], pairs['only_y'], pairs['skipped'])
+    assert 'href="a_report.html"' in html and 'Failed: boom' in html
+
+
 # def test_implicit_dytpe_comparison():
 #     implicit_dytpe_comparison(x_dtype, y_dtype)
 
@@ -367,6 +961,67 @@ def test_get_column_diffs(cur):
             assert expected[column_name]['df_h_y_shape'][i] == grouped_column_diffs[column_name]['df_h_y'].shape[i]
 
 
+def test_select_distinct_rows_one_scan():
+    # the table is only read once, by the query that counts the rows of each key:
+    cur = StubCursor({'from columns': [{'column_name': 'join1', 'data_type': 'int'}, {'column_name': 'data1', 'data_type': 'int'}], '': []})
+    assert select_distinct_rows(cur, 'scan', 'x', ['join1']) == ('scan', 'x_dedup')
+    scans = [q for q in cur.queries if 'FROM scan.x ' in q]
+    assert len(scans) == 1 and 'PARTITION BY join1' in scans[0]
+    assert any(('INTO scan.x_dedup' in q) and ('dup_count = 1' in q) for q in cur.queries)
+    assert any(('INTO scan.x_dup' in q) and ('dup_count > 1' in q) for q in cur.queries)
+
+
+def test_get_column_details():
+    # the queries of the diff table's columns, rendered without their details, are run later:
+    diff_columns = pd.DataFrame({'column_name': ['data1'], 'COUNT': [1]})
+    cur = StubCursor([{'x_data1': 1, 'y_data1': 2}])
+    column_diffs = get_column_diffs(diff_columns, cur, 'dbdiff', 'dbdiff', 'x_table', 'dbdiff', 'y_table', ['join1', 'join2'], 5,
+                                    COMPARE_COLS, hierarchical=True, details=False)
+    assert cur.queries == []
+    info = column_diffs['data1']
+    details = get_column_details(cur, info, 5)
+    assert set(details.keys()) == {'df', 'df_raw', 'df_h_x', 'df_h_y', 'df_n', 'df_n_sample'}
+    # the hierarchical samples are limited within their queries:
+    assert info['q_h_x_sample'] in cur.queries and info['q_h_y_sample'] in cur.queries
+    assert 'LIMIT 5' in info['q_h_x_sample'] and 'LIMIT' not in info['q_h_x']
+
+
+def test_get_column_diffs_fused(cur):
+    # the fused query gets the same info as the separate queries:
+    column_diffs = {}
+    for fused in (False, True):
+        column_diffs[fused] = get_column_diffs_from_joined(
+            cur,
+            'dbdiff',
+            'dbdiff',
+            'x_table',
+            'dbdiff',
+            'y_table',
+            ['join1', 'join2'],
+            100,
+            COMPARE_COLS,
+            COMPARE_COLS.comparable.astype(bool),
+            hierarchical=True,
+            fused=fused,
+            sample='ordered'
+        )
+    assert list(column_diffs[True].keys()) == list(column_diffs[False].keys())
+    for column, info in column_diffs[False].items():
+        fused_info = column_diffs[True][column]
+        assert set(fused_info.keys()) == set(info.keys())
+        for key, value in info.items():
+            if not isinstance(value, pd.DataFrame):
+                assert fused_info[key] == value
+            elif value.empty:
+                assert fused_info[key].empty
+            else:
+                pd.testing.assert_frame_equal(
+                    fused_info[key].sort_values(list(value.columns)).reset_index(drop=True),
+                    value.sort_values(list(value.columns)).reset_index(drop=True),
+                    check_dtype=False
+                )
+
+
 def test_drop_data_end(cur):
     drop_schema(cur)
 
@@ -406,9 +1061,55 @@ def test_main(cur):
     runner_wrapper(runner, base_options, ['--drop-output-tables', '--output-format=XLSX'])
     runner_wrapper(runner, base_options, ['--use-diff-table'])
     runner_wrapper(runner, base_options, ['--hierarchical-join', '--use-diff-table'])
+    runner_wrapper(runner, base_options, ['--hierarchical-join', '--workers=3'])
+    runner_wrapper(runner, base_options, ['--prune-identical-columns'])
+    runner_wrapper(runner, base_options, ['--prune-identical-columns', '--use-diff-table'])
+    runner_wrapper(runner, base_options, ['--joined-shard-width=1'])
+    runner_wrapper(runner, base_options, ['--runtime-cap=10 minutes', '--stage-timeout=600'])
+    runner_wrapper(runner, base_options, ['--fused-column-queries', '--hierarchical-join'])
+    runner_wrapper(runner, base_options, ['--plan', '--save-json-summary'])
+    runner_wrapper(runner, base_options, ['--sample=hash', '--hierarchical-join', '--joined-shard-width=1'])
+    runner_wrapper(runner, base_options, ['--sample=ordered', '--hierarchical-join', '--use-diff-table'])
+    runner_wrapper(runner, base_options, ['--hash-join-keys', '--joined-shard-width=1'])
+    runner_wrapper(runner, base_options, ['--hash-join-keys', '--use-diff-table'])
+    runner_wrapper(runner, base_options, ['--skip-column-details', '--hierarchical-join'])
+    runner_wrapper(runner, base_options, ['--skip-column-details', '--use-diff-table', '--hierarchical-join'])
+    runner_wrapper(runner, ['schema', 'dbdiff', 'dbdiff'], ['--tables=x_table', '--join-cols=join1,join2', '--concurrency=2', '--history=schema_history.json'])
+    assert 'x_table_report.html' in Path('dbdiff_dbdiff_schema.html').read_text()
+    Path('dbdiff_dbdiff_schema.html').unlink()
+    Path('schema_history.json').unlink()
+    runner_wrapper(runner, base_options, ['--profile', '--workers=2'])
+    runner_wrapper(runner, base_options, ['--profile-only', '--output-format=XLSX'])
+    runner_wrapper(runner, base_options, ['--save-bundle'])
+    runner_wrapper(runner, ['diff-many', 'dbdiff', 'x_table', 'y_table,dbdiff.x_table', 'join1,join2'], ['--workers=2', '--profile'])
+    assert Path('x_table_matrix.html').exists()
+    runner_wrapper(runner, ['report', 'x_table_bundle'], ['--output-format=XLSX'])
+    assert runner.invoke(cli, ['--check', 'dbdiff', 'x_table', 'x_table', 'join1,join2'], catch_exceptions=False).exit_code == 0
+    assert runner.invoke(cli, ['--check'] + base_options, catch_exceptions=False).exit_code == 3
+    assert runner.invoke(cli, ['--check', '--diff-if-different'] + base_options, catch_exceptions=False).exit_code == 3
+    assert runner.invoke(cli, ['--check', '--case-insensitive'] + base_options, catch_exceptions=False).exit_code == 2
+    runner_wrapper(runner, base_options, ['--joined-shard-width=2', '--hierarchical-join', '--drop-output-tables'])
+    runner_wrapper(runner, base_options, ['--hierarchical-join', '--output-format=HTML-SHARDED'])
+    assert Path('x_table_report', 'index.html').exists()
+    assert len(list(Path('x_table_report', 'columns').glob('*.js'))) > 0
+
+    runner_wrapper(runner, base_options, ['--partition-column=join1', '--state-dir=dbdiff_state'])
+    # nothing changed, so the stored partitions are reused:
+    runner_wrapper(runner, base_options, ['--partition-column=join1', '--state-dir=dbdiff_state'])
+    assert len(list(Path('dbdiff_state').glob('*.pkl'))) == 1
+    runner_wrapper(runner, base_options, ['--cache-dir=dbdiff_cache'])
+    # neither table changed, so the cached result is used:
+    runner_wrapper(runner, base_options, ['--cache-dir=dbdiff_cache'])
+    assert len(list(Path('dbdiff_cache').glob('*.pkl'))) == 1
 
     Path('x_table_report.html').unlink()
     Path('x_table_report.xlsx').unlink()
+    shutil.rmtree('x_table_report')
+    for path in ['x_table_matrix.html', 'x_table_y_table_report.html', 'x_table_x_table_report.html']:
+        Path(path).unlink()
+    shutil.rmtree('dbdiff_state')
+    shutil.rmtree('dbdiff_cache')
+    shutil.rmtree('x_table_bundle')
 
     Path('x_table_temp.sql').write_text('select * from dbdiff.x_table')
     x_table_temp_options = ['dbdiff', 'x_table_temp.sql', 'y_table', 'join1,join2', '--x-table-query']
@@ -423,7 +1124,8 @@ def test_main(cur):
     runner_wrapper(runner, both_table_temp_options, ['--hierarchical-join'])
     runner_wrapper(runner, both_table_temp_options, ['--save-column-summary'])
     runner_wrapper(runner, both_table_temp_options, ['--save-column-summary', '--save-column-summary-format=pickle'])
-
+    runner_wrapper(runner, both_table_temp_options, ['--lazy-table-query'])
+    runner_wrapper(runner, both_table_temp_options, ['--lazy-table-query', '--exclude-columns=data4', '--hierarchical-join'])
 
     Path('x_table_temp.sql').unlink()
     Path('y_table_temp.sql').unlink()
@@ -447,3 +1149,15 @@ def test_main(cur):
 
     Path('x_table_report.html').unlink()
     Path('x_table_diff_summary.json').unlink()
+
+    Path('manifest.json').write_text(json.dumps([
+        {'schema': 'dbdiff', 'x_table': 'x_table', 'y_table': 'y_table', 'join_cols': 'join1,join2'},
+        {'schema': 'dbdiff', 'x_table': 'y_table', 'y_table': 'x_table', 'join_cols': 'join1,join2',
+         'options': {'hierarchical_join': True, 'save_json_summary': True}, 'priority': 1},
+    ]))
+    runner_wrapper(runner, ['batch', 'manifest.json'], ['--concurrency=2', '--history=history.json'])
+    assert len(json.loads(Path('batch_summary.json').read_text())) == 2
+    assert len(json.loads(Path('history.json').read_text())) == 2
+
+    for path in ['manifest.json', 'history.json', 'batch_summary.json', 'x_table_report.html', 'y_table_report.html', 'y_table_diff_summary.json']:
+        Path(path).unlink()